@@ -22,14 +22,293 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
-from gi.repository import Gtk, Gdk, GLib, GConf
+import time
+STARTUP_MARKS = [('start', time.time())]
+
+import sys
+
+# The command line mode (see run_cli) never loads Gtk, nor GLib and GConf
+CLI_OPTIONS = ('--list', '--query', '--connect')
+HEADLESS = (__name__ == '__main__' and
+            any(arg.split('=', 1)[0] in CLI_OPTIONS for arg in sys.argv[1:]))
+
+if HEADLESS:
+    Gtk = Gdk = Gio = GLib = None
+else:
+    from gi.repository import Gtk, Gdk, Gio, GLib
+STARTUP_MARKS.append(('import gi', time.time()))
+
+# yaml, json, argparse, webbrowser and GConf are imported where they are
+# used, as most sessions never need them and yaml alone costs more than
+# building the menu. See --profile-startup.
+import atexit
 import copy
+import glob
 import re
+import shutil
 import subprocess
 import os
-import yaml
-import shutil
-import webbrowser
+import struct
+import bisect
+import errno
+import hashlib
+import heapq
+import marshal
+import math
+import resource
+import select
+import shlex
+import socket
+import stat
+import tempfile
+import threading
+from array import array
+from collections import deque
+
+try:
+    intern
+except NameError:
+    from sys import intern
+
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+STARTUP_MARKS.append(('import modules', time.time()))
+
+
+def shell_quote(value):
+    '''Quote a string for use as one word of a shell command line'''
+
+    try:
+        from shlex import quote
+    except ImportError:
+        from pipes import quote
+    return quote(value)
+
+
+def load_yaml(data):
+    '''Parse a YAML document, with libyaml if it is available'''
+
+    import yaml
+    return yaml.load(data, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
+def dump_yaml(document):
+    '''Return a YAML document as a string, with libyaml if it is available'''
+
+    import yaml
+    return yaml.dump(document, Dumper=getattr(yaml, 'CSafeDumper', yaml.SafeDumper),
+                     default_flow_style=False)
+
+
+def mark_startup(phase):
+    '''
+    Record the end of a startup phase for --profile-startup
+
+    Takes
+        phase (str): What was done since the previous mark
+    '''
+
+    STARTUP_MARKS.append((phase, time.time()))
+
+
+def report_startup():
+    '''
+    Print the time taken by each startup phase to stderr. Runs as an idle
+    callback, so the last phase ends when the main loop is up.
+    '''
+
+    mark_startup('main loop')
+    previous = STARTUP_MARKS[0][1]
+    for phase, when in STARTUP_MARKS[1:]:
+        sys.stderr.write('%-20s %8.1f ms\n' % (phase, (when - previous) * 1000))
+        previous = when
+    sys.stderr.write('%-20s %8.1f ms\n' % ('total', (previous - STARTUP_MARKS[0][1]) * 1000))
+    return False
+
+
+def run_cli(argv):
+    '''
+    The command line mode: list, search or connect to the hosts of
+    ~/.sshmenu without Gtk. Hosts are printed as JSON, one object per line.
+    Requests go to the running indicator if there is one, otherwise the
+    HostCache is used. Returns the exit status.
+
+    Takes
+        argv (list [str]): The command line arguments
+    '''
+
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(
+        prog='SSHMenu',
+        description='List, search or connect to the hosts of ~/.sshmenu. '
+                    'Hosts are printed as JSON, one object per line.')
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument('--list', action='store_true',
+                        help='print all hosts in menu order')
+    action.add_argument('--query', metavar='TEXT',
+                        help='print the hosts matching TEXT, best match first')
+    action.add_argument('--connect', metavar='HOST',
+                        help='open a terminal connected to the host with this '
+                             'menu path, or else title')
+    parser.add_argument('--limit', type=int, default=20,
+                        help='maximum number of --query results')
+    args = parser.parse_args(argv)
+
+    # A running indicator answers from the config it already has in memory
+    if args.list:
+        request = {'command': 'list'}
+    elif args.query is not None:
+        request = {'command': 'query', 'text': args.query, 'limit': args.limit}
+    else:
+        request = {'command': 'connect', 'host': args.connect}
+    response = ControlClient().request(request)
+
+    if response is not None:
+        if not response.get('ok'):
+            sys.stderr.write('SSHMenu: %s\n' % response.get('error'))
+            return 1
+        hosts = response.get('hosts', [])
+    else:
+        cache = HostCache(os.path.join(os.environ['HOME'], '.sshmenu'))
+        cache.load()
+        if args.list:
+            hosts = [HostCache.describe(row) for row in cache.rows]
+        elif args.query is not None:
+            hosts = [HostCache.describe(row)
+                     for row in cache.search(args.query, args.limit)]
+        else:
+            row = cache.find(args.connect)
+            if row is None:
+                sys.stderr.write('SSHMenu: no host %s\n' % args.connect)
+                return 1
+
+            multiplexer.configure(cache)
+            host = HostCache.host_item(row)
+            try:
+                supervisor.spawn(host.command(), host.display)
+            except OSError as e:
+                sys.stderr.write('SSHMenu: unable to start a terminal for %s: %s\n' %
+                                 (host.display, e.strerror))
+                return 1
+            if cache.get_global('menus_frequent'):
+                usage.append(row[HostCache.PATH], UsageLog.weight(time.time()))
+            hosts = [HostCache.describe(row)]
+
+    write = sys.stdout.write
+    try:
+        for host in hosts:
+            write(json.dumps(host, sort_keys=True) + '\n')
+        sys.stdout.flush()
+    except (IOError, OSError) as e:
+        # The reader went away, e.g. piped into head
+        if e.errno != errno.EPIPE:
+            raise
+    return 0
+
+
+def intern_string(value):
+    '''
+    Return the interned copy of a str so equal values share one object.
+    Other values, such as unicode strings, are returned unchanged.
+    '''
+
+    if type(value) is str:
+        return intern(value)
+    return value
+
+
+def as_text(value):
+    '''
+    Return a UTF-8 encoded str decoded to unicode on Python 2, where PyYAML,
+    JSON and Gtk disagree on the type of non-ASCII titles. Other values are
+    returned unchanged.
+    '''
+
+    if str is bytes and isinstance(value, str):
+        # unicode() skips the codec lookup of decode, it runs once per title
+        return unicode(value, 'utf-8', 'replace')
+    return value
+
+
+def atomic_write(path, data):
+    '''
+    Write data to path through a temporary file in the same directory which is
+    flushed, fsynced and renamed over the target, so readers only ever see the
+    old or the new content. The directory is fsynced too, so the new content
+    survives a crash. A symlink at path is written through, not replaced.
+
+    Takes
+        path (str): File to write
+        data (str): Content of the file
+    '''
+
+    path = os.path.realpath(path)
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path),
+                                    dir=directory)
+    try:
+        if os.path.exists(path):
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        fout = os.fdopen(fd, 'wb')
+        fout.write(data)
+        fout.flush()
+        os.fsync(fout.fileno())
+        fout.close()
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    # The rename is only durable once the directory entry is on disk
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def private_directory(name):
+    '''
+    Return a directory only the user can access, in $XDG_RUNTIME_DIR or else
+    the temporary directory, creating it if needed. Returns None if it
+    exists but is not private.
+
+    Takes
+        name (str): Name of the directory
+    '''
+
+    base = os.environ.get('XDG_RUNTIME_DIR')
+    if base:
+        path = os.path.join(base, name)
+    else:
+        path = os.path.join(tempfile.gettempdir(), '%s-%d' % (name, os.getuid()))
+    try:
+        os.mkdir(path, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            return None
+
+    # Anyone who can write here could hijack the sockets in it
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return None
+    if (not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or
+            info.st_mode & 0o077):
+        return None
+    return path
+
 
 class App():
     '''
@@ -45,23 +324,55 @@ class App():
     SITE_URL = 'https://github.com/MasslessParticle/pySSHMenu'
     ATTR_URL = 'http://sshmenu.sourceforge.net/'
 
+    # Milliseconds to wait for a burst of writes to the config file to end
+    RELOAD_DELAY = 300
+
     def __init__(self):
-        self.has_key = False
+        self.agent = SSHAgent()
+        # The key named on the 'Remove SSH Key' entry, if it names one
+        self.shown_key = None
         self.config = Config(os.environ['HOME'] + "/.sshmenu")
+        mark_startup('load config')
+        metrics.configure(self.config)
+        usage.configure(self.config)
+        self.host_index = None
+        self.quick_connect = QuickConnect(self)
+        self.fan_outs = []
+        self.prober = ReachabilityProber()
+        self.probed = {}
+        self.probe_results = []
+        self.probe_lock = threading.Lock()
+        self.probe_timer = None
+        multiplexer.configure(self.config)
+        self.preferences_open = False
+        self.reload_pending = False
+        self.reload_timer = None
         self.initialize_indicator()
+        mark_startup('indicator')
         self.initialize_menu()
+        mark_startup('menu')
+        self.watch_config()
+        mark_startup('watch config')
+        self.control = ControlServer(self)
+        if self.control.start():
+            atexit.register(self.control.stop)
+        mark_startup('control socket')
 
     def initialize_indicator(self):
         '''Setup the appindicator or the Gtk.StatusIcon'''
 
         try:
             from gi.repository import AppIndicator3
+        except ImportError:
+            AppIndicator3 = None
+
+        if AppIndicator3 is not None:
             self.indicator = AppIndicator3.Indicator.new("SSH",
                                     "gnome-netstatus-tx",
                                     AppIndicator3.IndicatorCategory.APPLICATION_STATUS)
             self.indicator.set_label('SSH', 'SSH')
             self.indicator.set_status(AppIndicator3.IndicatorStatus.ACTIVE)
-        except:
+        else:
             self.indicator = Indicator("SSH", "gnome-netstatus-tx")
             self.indicator.set_status(Indicator.STATUS_ACTIVE)
 
@@ -71,1176 +382,5111 @@ class App():
         indicator
         '''
 
+        started = metrics.start()
         self.menu = Gtk.Menu()
         self.menu.show()
+        self.lazy = not self.config.get_global('menus_eager')
+        self.options = self.menu_options()
+
+        # Bookkeeping for update_menu(). Items are keyed on identity; the
+        # top level menu is keyed on None.
+        self.widgets = {}
+        self.parents = {}
+        self.children = {None: self.config.all_items()}
+        self.headers = {None: 0}
 
-        self.menus = []
-        for item in self.config.menu_items:
-            self.add_item(self.menu, item)
+        if usage.enabled:
+            self.add_frequent_menu(self.menu)
+            self.add_item(self.menu, SeparatorItem())
+            self.headers[None] = 2
+
+        for item in self.config.all_items():
+            self.add_child(self.menu, None, item)
 
         self.add_item(self.menu, SeparatorItem())
+        self.add_sessions_menu(self.menu)
+        if multiplexer.enabled():
+            self.add_connections_menu(self.menu)
+        if metrics.enabled:
+            self.add_statistics_menu(self.menu)
+        self.cancel_item = self.add_item(self.menu,
+                            Item("Cancel opening windows", self.cancel_fan_outs))
+        self.cancel_item.set_visible(len(self.fan_outs) > 0)
+        self.add_item(self.menu, Item("Quick Connect...", self.show_quick_connect))
         self.add_item(self.menu, Item("Add SSH Key", self.add_ssh_key))
-        self.add_item(self.menu, Item("Remove SSH Key", self.remove_ssh_key))
+        self.remove_key_item = self.add_item(self.menu,
+                                Item("Remove SSH Key", self.remove_ssh_key))
+        self.update_key_status()
         self.add_item(self.menu, Item("Preferences", self.preferences))
+        self.menu.connect('show', self.on_menu_show)
         self.indicator.set_menu(self.menu)
+        metrics.stop('menu.build', started)
 
-    def add_item(self, menu, menu_item):
-        '''Add a MenuItem to the main menu'''
+    def watch_config(self):
+        '''
+        Watch the config file, so changes made by other programs show up on
+        the menu without a restart
+        '''
 
-        if menu_item.kind == Item.SEPARATOR:
-            gtk_item = Gtk.SeparatorMenuItem()
-        elif menu_item.kind == Item.MENU:
-            new_menu = Gtk.Menu()
-            gtk_item = Gtk.MenuItem(menu_item.display)
-            gtk_item.set_submenu(new_menu)
+        config_file = Gio.File.new_for_path(self.config.config_file)
+        self.monitor = config_file.monitor_file(Gio.FileMonitorFlags.NONE, None)
+        self.monitor.connect('changed', self.on_config_changed)
 
-            if len(menu_item.items) > 0:
-                self.add_options_from_preferences(menu_item)
+    def on_config_changed(self, monitor, changed_file, other_file, event):
+        '''
+        Called for every change to the config file. Writes often come in
+        bursts, so the file is only read once it has been left alone for
+        RELOAD_DELAY milliseconds.
+        '''
 
-                for item in menu_item.items:
-                    self.add_item(new_menu, item)
+        if self.reload_timer is not None:
+            GLib.source_remove(self.reload_timer)
+        self.reload_timer = GLib.timeout_add(App.RELOAD_DELAY, self.reload_config)
 
-            self.menus.append(menu_item)
-        else:
-            gtk_item = Gtk.MenuItem(menu_item.display)
-            gtk_item.connect("activate", menu_item.action, menu_item)
+    def reload_config(self):
+        '''
+        Load the config file again and update the menu if its content
+        changed. Waits while the preferences dialog is open, as it edits the
+        items in place.
+        '''
+
+        self.reload_timer = None
+        if self.preferences_open:
+            self.reload_pending = True
+        elif self.config.reload():
+            self.apply_config()
+        return False
+
+    def apply_config(self):
+        '''Bring the menu and the other users of the Config up to date'''
+
+        multiplexer.configure(self.config)
+        metrics.configure(self.config)
+        usage.configure(self.config)
+        self.update_menu()
+        if self.host_index is not None:
+            self.host_index.update(self.config)
+
+    def add_frequent_menu(self, menu):
+        '''
+        Add the 'Frequent' submenu listing the hosts opened most, by
+        frecency. It is filled each time it is opened.
+        '''
 
+        gtk_item = Gtk.MenuItem("Frequent")
+        gtk_item.set_submenu(Gtk.Menu())
+        gtk_item.connect('select', self.fill_frequent_menu)
+        gtk_item.connect('activate', self.fill_frequent_menu)
         gtk_item.show()
         menu.append(gtk_item)
 
-    def add_options_from_preferences(self, menu_item):
-        '''Add additional MenuItems based on global preferences'''
+    def fill_frequent_menu(self, gtk_item):
+        '''Replace the entries of the 'Frequent' submenu with the current ones'''
+
+        submenu = gtk_item.get_submenu()
+        for widget in submenu.get_children():
+            widget.destroy()
+
+        hosts = []
+        for path in usage.frequent():
+            item = self.config.get_item_by_path(path)
+            if item is not None and item.kind == Item.HOST:
+                hosts.append(item)
+
+        for item in hosts:
+            entry = Gtk.MenuItem(self.item_label(item))
+            entry.connect('activate', item.action, item)
+            entry.show()
+            submenu.append(entry)
+        if not hosts:
+            entry = Gtk.MenuItem('No hosts opened yet')
+            entry.set_sensitive(False)
+            entry.show()
+            submenu.append(entry)
+
+    def add_sessions_menu(self, menu):
+        '''
+        Add the 'Sessions' submenu listing the processes started by the
+        ProcessSupervisor. It is filled each time it is opened.
+        '''
 
-        items = []
-        if self.config.get_global('menus_open_tabs') == 1:
-            items.append(Item("Open all as tabs", action=self.open_all_tabs))
+        gtk_item = Gtk.MenuItem("Sessions")
+        gtk_item.set_submenu(Gtk.Menu())
+        gtk_item.connect('select', self.fill_sessions_menu)
+        gtk_item.connect('activate', self.fill_sessions_menu)
+        gtk_item.show()
+        menu.append(gtk_item)
 
-        if self.config.get_global('menus_open_all') == 1:
-            items.append(Item("Open all windows", action=self.open_all_windows))
+    def fill_sessions_menu(self, gtk_item):
+        '''Replace the entries of the 'Sessions' submenu with the current ones'''
 
-        if len(items) > 0:
-            items.append(SeparatorItem())
-            for item in items:
-                item.show_in_tree = False
-            menu_item.items = items + menu_item.items
+        submenu = gtk_item.get_submenu()
+        for widget in submenu.get_children():
+            widget.destroy()
 
-    def open_all_tabs(self, sender, item):
-        '''Open all menu items in the menu or submenu in one window as tabs'''
+        labels = [session.describe() for session in supervisor.sessions()]
+        for label in labels or ['No sessions']:
+            entry = Gtk.MenuItem(label)
+            entry.set_sensitive(False)
+            entry.show()
+            submenu.append(entry)
 
-        for menu in self.menus:
-            if item in menu.items:
-                cmd = ['gnome-terminal']
-                for item in menu.items:
-                    if item.kind == Item.HOST:
-                        cmd.append("--tab")
-                        cmd.append("-t")
-                        cmd.append(item.display)
-                        cmd.append("--profile")
-                        cmd.append(item.profile)
-                        cmd.append("-e")
-                        cmd.append("ssh %s" % item.ssh_params)
-                subprocess.Popen(cmd, shell=False)
-                return
+    def add_connections_menu(self, menu):
+        '''
+        Add the 'Connections' submenu listing the shared master connections.
+        It is filled each time it is opened.
+        '''
 
-    def open_all_windows(self, sender, item):
-        '''Open all menu items in the menu or submenu as seperate windows'''
+        gtk_item = Gtk.MenuItem("Connections")
+        gtk_item.set_submenu(Gtk.Menu())
+        gtk_item.connect('select', self.fill_connections_menu)
+        gtk_item.connect('activate', self.fill_connections_menu)
+        gtk_item.show()
+        menu.append(gtk_item)
 
-        for menu in self.menus:
-            if item in menu.items:
-                for item in menu.items:
-                    if item.kind == Item.HOST:
-                        item.action(sender, item)
+    def fill_connections_menu(self, gtk_item):
+        '''
+        Replace the entries of the 'Connections' submenu with the live master
+        connections. Selecting one closes it.
+        '''
 
-    def add_ssh_key(self, sender, item):
-        '''Run the ssh -l command if possible to add keys to ssh agent'''
+        submenu = gtk_item.get_submenu()
+        for widget in submenu.get_children():
+            widget.destroy()
 
-        if not self.has_key:
-            try:
-                ssh_auth = os.environ['SSH_AUTH_SOCK']
-                if os.path().exists(ssh_auth):
-                    try:
-                        subprocess.check_call(['ssh-add', '-l'],
-                                              stdout=subprocess.PIPE,
-                                              stderr=subprocess.PIPE)
-                        self.has_key = True
-                        return
-                    except:
-                        subprocess.Popen(['ssh-add'], stdout=subprocess.PIPE)
-                else:
-                    ErrorDialog("$SSH_AUTH_SOCK points to " +
-                                ssh_auth +
-                                ",\n but it does not exist!")
-            except:
-                ErrorDialog("$SSH_AUTH_SOCK is not set.\nIs the ssh-agent running?")
+        masters = multiplexer.masters()
+        entries = [('Close ' + name, [path]) for name, path in masters]
+        if len(masters) > 1:
+            entries.append(('Close all connections',
+                            [path for name, path in masters]))
 
-    def remove_ssh_key(self, sender, item):
-        '''Remove keys from the ssh-agent'''
+        for label, paths in entries or [('No connections', None)]:
+            entry = Gtk.MenuItem(label)
+            if paths is None:
+                entry.set_sensitive(False)
+            else:
+                entry.connect('activate', self.close_connections, paths)
+            entry.show()
+            submenu.append(entry)
 
-        subprocess.Popen(['ssh-add', '-D'], stdout=subprocess.PIPE,
-                                            stderr=subprocess.PIPE)
-        self.has_key = False
+    def close_connections(self, sender, paths):
+        '''Shut down master connections given by their control paths'''
 
-    def preferences(self, sender, item):
+        for path in paths:
+            try:
+                multiplexer.close(path)
+            except OSError as e:
+                ErrorDialog("Unable to close the connection:\n%s" % e.strerror)
+                return
+
+    def add_statistics_menu(self, menu):
         '''
-        Construct the PreferencesDialog and invoke it. Reinitialize menu if
-        Preferences are saved.
+        Add the 'Statistics' submenu showing the timings collected by
+        metrics. It is filled each time it is opened.
         '''
 
-        dialog = PreferencesDialog(self, self.config);
-        if dialog.invoke():
-            self.initialize_menu()
+        gtk_item = Gtk.MenuItem("Statistics")
+        gtk_item.set_submenu(Gtk.Menu())
+        gtk_item.connect('select', self.fill_statistics_menu)
+        gtk_item.connect('activate', self.fill_statistics_menu)
+        gtk_item.show()
+        menu.append(gtk_item)
 
+    def fill_statistics_menu(self, gtk_item):
+        '''Replace the entries of the 'Statistics' submenu with the current ones'''
 
-class Config():
-    '''
-    Implements the data model for the application.
-    It is responsible for:
-    * reading the configuration file
-    * maintaining an in-memory representation of the menu items and option
-      settings
-    * writing the config file if changes are made via the preferences dialog
-    '''
+        submenu = gtk_item.get_submenu()
+        for widget in submenu.get_children():
+            widget.destroy()
 
-    def __init__(self, config_file):
-        '''
-        Takes:
-            config_file (str): Path to the config file. ~/.sshmenu by default
-        '''
-        self.preferences = {}
-        self.menu_items = []
-        self.globals = {}
-        self.config_file = config_file
-        self.load_config()
+        for label in metrics.describe() or ['No timings yet']:
+            entry = Gtk.MenuItem(label)
+            entry.set_sensitive(False)
+            entry.show()
+            submenu.append(entry)
 
-    def load_config(self):
-        '''Load and parse the congiguration file into local dictionaries'''
+        entry = Gtk.MenuItem("Save to " + Metrics.dump_path())
+        entry.connect('activate', self.dump_statistics)
+        entry.show()
+        submenu.append(entry)
+
+    def dump_statistics(self, sender):
+        '''Write the collected timings to a JSON file'''
 
         try:
-            fin = open(self.config_file)
-            self.preferences = yaml.load(fin.read())
-            self.menu_items = self.parse_items(self.preferences['items'])
-            self.globals = self.preferences['global']
-            fin.close()
-        except:
-            if os.path.exists(self.config_file):
-                ErrorDialog("Unable to read config file")
-            else:
-                self.save(); #Config file does not yet exist... make one.
+            metrics.dump()
+        except (IOError, OSError) as e:
+            ErrorDialog("Unable to save the statistics:\n%s" % e)
+
+    def menu_options(self):
+        '''Return the global settings that change the shape of the menu'''
+
+        return (self.config.get_global('menus_eager'),
+                self.config.get_global('menus_open_tabs'),
+                self.config.get_global('menus_open_all'),
+                self.config.get_global('menus_probe'),
+                multiplexer.enabled(),
+                metrics.enabled,
+                usage.enabled)
+
+    def add_item(self, menu, menu_item, position=-1):
+        '''
+        Add a MenuItem to the main menu and return the new Gtk.MenuItem
 
-    def parse_items(self, items):
-        '''Parse the items yaml into Item objects'''
+        Takes
+            menu (Gtk.Menu): The menu to add the item to
+            menu_item (Item): The item to add
+            position (int): Where to insert the item, -1 appends
+        '''
 
-        item_list = []
-        for item in items:
-            if item['type'] == 'separator':
-                menu_item = SeparatorItem();
-            elif item['type'] == 'menu':
-                menu_item = MenuItem(item['title'])
-                menu_items = self.parse_items(item['items'])
-                menu_item.items = menu_items
+        if menu_item.kind == Item.SEPARATOR:
+            gtk_item = Gtk.SeparatorMenuItem()
+        elif menu_item.kind == Item.MENU:
+            new_menu = Gtk.Menu()
+            gtk_item = Gtk.MenuItem(menu_item.display)
+            gtk_item.set_submenu(new_menu)
+
+            if self.lazy:
+                gtk_item.connect('select', self.populate_submenu, menu_item)
+                gtk_item.connect('activate', self.populate_submenu, menu_item)
             else:
-                params = dict((k,v) for k,v in item.iteritems()
-                              if k != 'title' and k != 'type')
-                menu_item = HostItem(item['title'], params)
+                self.populate_menu(new_menu, menu_item)
+        else:
+            gtk_item = Gtk.MenuItem(self.item_label(menu_item))
+            gtk_item.connect("activate", menu_item.action, menu_item)
 
-            item_list.append(menu_item)
-        return item_list
+        gtk_item.show()
+        menu.insert(gtk_item, position)
+        return gtk_item
 
-    def get_item(self, title, items = None):
+    def add_child(self, menu, parent, menu_item, position=-1):
         '''
-        Return a MenuItem
-        Takes:
-            title (str): Name of the MenuItem to return
-            items (list, MenuItem): List of items to search
+        Add an Item from the config to a menu and remember its widget so the
+        menu can be updated in place later.
+
+        Takes
+            menu (Gtk.Menu): The menu to add the item to
+            parent (MenuItem): The submenu owning menu, None for the top level
+            menu_item (Item): The item to add
+            position (int): Where to insert the item, -1 appends
         '''
-        if items == None:
-            items = self.menu_items
 
-        ret = None
-        for item in items:
-            if item.display == title:
-                ret = item
-            elif item.kind == Item.MENU:
-                ret = self.get_item(title, item.items)
+        self.widgets[menu_item] = self.add_item(menu, menu_item, position)
+        self.parents[menu_item] = parent
 
-        return ret
+    def populate_submenu(self, gtk_item, menu_item):
+        '''
+        Signal handler used in lazy mode. Builds the children of a submenu the
+        first time it is selected and then disconnects itself.
 
-    def get_global(self, attribute):
-        '''Return a global setting as a boolean'''
+        Takes
+            gtk_item (Gtk.MenuItem): The menu item the submenu hangs from
+            menu_item (MenuItem): The submenu to build
+        '''
 
-        if self.globals.has_key(attribute):
-            return bool(self.globals[attribute])
-        else:
-            return False
+        gtk_item.disconnect_by_func(self.populate_submenu)
+        self.populate_menu(gtk_item.get_submenu(), menu_item)
 
-    def set_global(self, attribute, value):
+    def populate_menu(self, menu, menu_item):
         '''
-        Set a global attribute. Converts from boolean to SSHMenu format (int)
+        Add the children of a MenuItem to a Gtk.Menu
+
+        Takes
+            menu (Gtk.Menu): The menu to fill
+            menu_item (MenuItem): The submenu whose items are added
         '''
 
-        if value == True or value == False:
-            self.globals[attribute] = int(value);
+        started = metrics.start()
+        self.children[menu_item] = list(menu_item.items)
+        self.headers[menu_item] = 0
 
-    def backup(self):
-        '''Backup configuration file'''
+        if len(menu_item.items) > 0:
+            self.headers[menu_item] = self.add_options_from_preferences(menu,
+                                                                    menu_item)
+            for item in menu_item.items:
+                self.add_child(menu, menu_item, item)
+        metrics.stop('menu.populate', started)
 
-        if os.path.exists(self.config_file):
-            new_path = self.config_file + '.bak'
-            shutil.copy(self.config_file, new_path)
+    def add_options_from_preferences(self, menu, menu_item):
+        '''
+        Add additional menu entries based on global preferences. These only
+        exist on the Gtk.Menu, the MenuItem itself is left untouched. Returns
+        the number of entries added.
 
-    def save(self, backup=False):
-        '''Save the current state of this object to the configuration file'''
+        Takes
+            menu (Gtk.Menu): The menu to add the entries to
+            menu_item (MenuItem): The submenu the entries act on
+        '''
 
-        if backup:
-            self.backup()
+        items = []
+        if self.config.get_global('menus_open_tabs') == 1:
+            items.append(Item("Open all as tabs", action=self.open_all_tabs))
 
-        menu_items = []
-        for item in self.menu_items:
-            menu_items.append(item.to_yaml())
+        if self.config.get_global('menus_open_all') == 1:
+            items.append(Item("Open all windows", action=self.open_all_windows))
 
-        yaml_dict = {'classes' : {}}
-        yaml_dict['items'] = menu_items
-        yaml_dict['global'] = self.globals
+        if multiplexer.enabled():
+            items.append(Item("Connect all in background", action=self.prewarm))
 
-        fout = file(self.config_file, 'w')
-        yaml.dump(yaml_dict, fout, default_flow_style=False)
-        fout.close()
+        if self.config.get_global('menus_probe') == 1:
+            items.append(Item("Check reachability",
+                              action=self.check_reachability))
 
-    def have_bcvi(self):
-        '''Whether or not bcvi is enabled'''
+        if len(items) > 0:
+            for item in items:
+                gtk_item = Gtk.MenuItem(item.display)
+                gtk_item.connect("activate", item.action, menu_item)
+                gtk_item.show()
+                menu.append(gtk_item)
+            self.add_item(menu, SeparatorItem())
+            return len(items) + 1
 
-        return len(filter(lambda x: os.path.exists(x + '/bcvi'),
-                          os.environ['PATH'].split(':'))) > 0
+        return 0
 
+    def update_menu(self):
+        '''
+        Bring the menu in line with the Config object after it changed.
+        Instead of rebuilding everything, the old and new Item trees are
+        compared on item identity and only the affected Gtk widgets are
+        added, removed, moved or relabelled. Falls back to a full rebuild when
+        a global option that shapes every submenu changed.
+        '''
 
-class Item():
-    '''
-    Base class for the HostItem, MenuItem, and SeparatorIte, classes and
-    '''
+        if self.menu_options() != self.options:
+            old_menu = self.menu
+            self.initialize_menu()
+            old_menu.destroy()
+            return
 
-    MENU = "menu"
-    SEPARATOR = "separator"
-    ITEM = "item"
-    HOST = "host"
+        parents = {}
+        stack = [(None, self.config.all_items())]
+        while stack:
+            parent, items = stack.pop()
+            for item in items:
+                parents[item] = parent
+                if item.kind == Item.MENU:
+                    stack.append((item, item.items))
 
-    def __init__(self, display, action=None, kind=ITEM, show_in_tree=True):
+        for item in list(self.parents):
+            if item in self.parents:
+                if item not in parents or parents[item] is not self.parents[item]:
+                    self.remove_child(item)
+
+        self.sync_menu(self.menu, None, self.config.all_items())
+
+    def sync_menu(self, menu, parent, items):
         '''
-        Takes:
-            display (str): how the menu item will look on the GTK menu
-            action (callable): what happens when the menu item is clicked
-            kind (str): Item Type
-            show_in_tree (bool): Whether or not this item appears on the
-                                 hosts menu. Used for menu items added via
-                                 preferences
+        Update one built menu so its widgets mirror the given items. Widgets
+        of items that left this menu must already have been removed.
+
+        Takes
+            menu (Gtk.Menu): The menu to update
+            parent (MenuItem): The submenu owning menu, None for the top level
+            items (list [Item]): The new children of the menu
         '''
-        self.kind = kind
-        self.display = display
-        self.action = action
-        self.show_in_tree = show_in_tree
 
-    def __str__(self):
-        return "Item - type: %s Name: %s" % (self.kind, self.display)
+        old_items = self.children[parent]
+        if parent is not None and bool(old_items) != bool(items):
+            # The 'Open all' entries come and go with the children, so rebuild
+            for item in old_items:
+                if item in self.parents and self.parents[item] is parent:
+                    self.forget(item)
+            for widget in menu.get_children():
+                widget.destroy()
+            self.populate_menu(menu, parent)
+            return
+
+        reorder = items != old_items
+        offset = self.headers[parent]
+        for position, item in enumerate(items):
+            gtk_item = self.widgets.get(item)
+            if gtk_item is None:
+                self.add_child(menu, parent, item, offset + position)
+                continue
+
+            if reorder:
+                menu.reorder_child(gtk_item, offset + position)
+            label = self.item_label(item)
+            if item.kind != Item.SEPARATOR and gtk_item.get_label() != label:
+                gtk_item.set_label(label)
+            if item.kind == Item.MENU and item in self.children:
+                self.sync_menu(gtk_item.get_submenu(), item, item.items)
+
+        self.children[parent] = list(items)
+
+    def remove_child(self, menu_item):
+        '''Destroy the widget of an Item and forget it and its children'''
+
+        self.widgets[menu_item].destroy()
+        self.forget(menu_item)
+
+    def forget(self, menu_item):
+        '''Drop the bookkeeping for an Item and everything below it'''
+
+        stack = [menu_item]
+        while stack:
+            item = stack.pop()
+            self.widgets.pop(item, None)
+            self.parents.pop(item, None)
+            self.headers.pop(item, None)
+            self.probed.pop(item, None)
+            stack.extend(self.children.pop(item, []))
+
+    def open_all_tabs(self, sender, menu_item):
+        '''
+        Open all menu items in the menu or submenu as tabs. Large menus are
+        split over several windows, opened in parallel, so that no command
+        line exceeds 'tabs_per_window' tabs or the system's argument size
+        limit.
+        '''
 
+        hosts = [item for item in menu_item.items if item.kind == Item.HOST]
+        batches = self.tab_batches(hosts,
+                                   self.config.get_setting('tabs_per_window', 20),
+                                   self.argv_budget())
 
-class HostItem(Item):
-    '''
-    Used as a container for the configuration options associated with a host
-    item on the main menu.
+        jobs = []
+        for number, batch in enumerate(batches):
+            title = menu_item.display
+            if len(batches) > 1:
+                title = '%s (%d/%d)' % (title, number + 1, len(batches))
+            jobs.append((title, batch))
+        self.fan_out(jobs)
 
-    Inherits from Item.
-    '''
+    @staticmethod
+    def tab_batches(hosts, per_window, budget):
+        '''
+        Split the tabs for hosts into gnome-terminal command lines
 
-    def __init__(self, display, params=None):
+        Takes
+            hosts (list [HostItem]): Hosts to open as tabs
+            per_window (int): Maximum tabs per window, 0 for no limit
+            budget (int): Maximum size of a command line in bytes
         '''
-        Takes:
-            display (str): string to be displayed in the menu
+
+        pointer = struct.calcsize('P')
+
+        def cost(args):
+            return sum(len(arg) + 1 + pointer for arg in args)
+
+        batches = []
+        cmd = None
+        for host in hosts:
+            tab = host.tab_args()
+            if (cmd is None or (per_window and tabs == per_window) or
+                    size + cost(tab) > budget):
+                cmd = ['gnome-terminal']
+                size = cost(cmd)
+                tabs = 0
+                batches.append(cmd)
+            cmd.extend(tab)
+            size += cost(tab)
+            tabs += 1
+        return batches
+
+    @staticmethod
+    def argv_budget():
+        '''
+        Return the number of bytes available for a command line: ARG_MAX less
+        the environment, which shares the same space, and a safety margin
+        '''
+
+        try:
+            arg_max = os.sysconf('SC_ARG_MAX')
+        except (ValueError, OSError):
+            arg_max = 131072
+
+        pointer = struct.calcsize('P')
+        environment = sum(len(key) + len(value) + 2 + pointer
+                          for key, value in os.environ.items())
+        return arg_max - environment - 4096
+
+    def open_all_windows(self, sender, menu_item):
+        '''Open all menu items in the menu or submenu as seperate windows'''
+
+        jobs = [(item.display, item.command()) for item in menu_item.items
+                if item.kind == Item.HOST]
+        self.fan_out(jobs)
+
+    def prewarm(self, sender, menu_item):
+        '''Start master connections to all hosts in the menu or submenu'''
+
+        hosts = [item for item in menu_item.items if item.kind == Item.HOST]
+        multiplexer.prewarm(hosts, self.on_prewarm_done)
+
+    def on_prewarm_done(self, failures):
+        '''Report the hosts a master connection could not be started for'''
+
+        if failures:
+            details = '\n'.join('%s: %s' % failure for failure in failures[:10])
+            ErrorDialog("Unable to connect to %d hosts:\n%s" %
+                        (len(failures), details))
+
+    def item_label(self, menu_item):
+        '''
+        Return the text shown for an Item on the menu. Hosts probed by
+        'Check reachability' carry the result while it is in the cache.
+        '''
+
+        if menu_item.kind != Item.HOST or menu_item not in self.probed:
+            return menu_item.display
+
+        fresh, latency = self.prober.cached(self.probed[menu_item])
+        if not fresh:
+            return menu_item.display
+        if latency is None:
+            return '%s  [down]' % menu_item.display
+        return '%s  [up %d ms]' % (menu_item.display, latency * 1000)
+
+    def check_reachability(self, sender, menu_item):
+        '''
+        Probe the SSH port of all hosts in the menu or submenu in the
+        background and annotate their menu entries with the results
+        '''
+
+        for item in menu_item.items:
+            if item.kind == Item.HOST:
+                target = item.target()
+                if target is not None:
+                    self.probed[item] = target
+
+        targets = [self.probed[item] for item in menu_item.items
+                   if item in self.probed]
+        self.prober.start(targets, self.on_probe_result)
+
+    def on_probe_result(self, target, latency):
+        '''
+        Called from the probing thread for every result. Results are queued
+        and applied to the menu in batches from the main loop.
+        '''
+
+        self.probe_lock.acquire()
+        self.probe_results.append(target)
+        first = len(self.probe_results) == 1
+        self.probe_lock.release()
+        if first:
+            GLib.idle_add(self.apply_probe_results)
+
+    def apply_probe_results(self):
+        '''Relabel the menu entries of the hosts probed since the last call'''
+
+        self.probe_lock.acquire()
+        targets = set(self.probe_results)
+        self.probe_results = []
+        self.probe_lock.release()
+
+        for item, target in list(self.probed.items()):
+            if target in targets and item in self.widgets:
+                self.widgets[item].set_label(self.item_label(item))
+
+        if self.probe_timer is None:
+            self.schedule_probe_expiry()
+        return False
+
+    def schedule_probe_expiry(self):
+        '''Arrange for expire_probe_results to run when the next result expires'''
+
+        expiries = [self.prober.expiry(target) for target in self.probed.values()]
+        expiries = [expiry for expiry in expiries if expiry is not None]
+        if not expiries:
+            self.probe_timer = None
+            return
+        delay = max(0, min(expiries) - time.time())
+        self.probe_timer = GLib.timeout_add(int(delay * 1000) + 100,
+                                            self.expire_probe_results)
+
+    def expire_probe_results(self):
+        '''Remove the annotations of the hosts whose results have expired'''
+
+        for item, target in list(self.probed.items()):
+            fresh, latency = self.prober.cached(target)
+            if not fresh:
+                del self.probed[item]
+                if item in self.widgets:
+                    self.widgets[item].set_label(self.item_label(item))
+
+        self.schedule_probe_expiry()
+        return False
+
+    def fan_out(self, jobs):
+        '''
+        Start many programs in the background with a FanOut, limited by the
+        'open_all_concurrency' and 'open_all_rate' settings
+
+        Takes
+            jobs (list [(str, list [str])]): Title and command line of each
+                                             program to start
+        '''
+
+        fan_out = FanOut(jobs,
+                         self.config.get_setting('open_all_concurrency', 8),
+                         self.config.get_setting('open_all_rate', 20),
+                         self.on_fan_out_progress, self.on_fan_out_done)
+        self.fan_outs.append(fan_out)
+        self.cancel_item.show()
+        fan_out.start()
+
+    def on_fan_out_progress(self, fan_out):
+        '''Show how many windows have been opened on the indicator'''
+
+        done = sum(f.done for f in self.fan_outs)
+        total = sum(f.total for f in self.fan_outs)
+        self.set_label('SSH %d/%d' % (done, total))
+
+    def on_fan_out_done(self, fan_out):
+        '''Clean up after a FanOut and report the launches that failed'''
+
+        self.fan_outs.remove(fan_out)
+        if not self.fan_outs:
+            self.cancel_item.hide()
+            self.set_label('SSH')
+
+        if fan_out.failures:
+            details = '\n'.join('%s: %s' % failure
+                                for failure in fan_out.failures[:10])
+            ErrorDialog("Unable to open %d of %d windows:\n%s" %
+                        (len(fan_out.failures), fan_out.total, details))
+
+    def cancel_fan_outs(self, sender, item):
+        '''Stop opening the windows of all running FanOuts'''
+
+        for fan_out in self.fan_outs:
+            fan_out.cancel()
+
+    def set_label(self, label):
+        '''Set the text shown next to the indicator icon'''
+
+        if isinstance(self.indicator, Indicator):
+            self.indicator.set_label(label)
+        else:
+            self.indicator.set_label(label, 'SSH 000/000')
+
+    def get_host_index(self):
+        '''Return the HostIndex over the config, building it on first use'''
+
+        if self.host_index is None:
+            self.host_index = HostIndex()
+            self.host_index.update(self.config)
+        return self.host_index
+
+    def show_quick_connect(self, sender, item):
+        '''Open the quick connect popup'''
+
+        self.quick_connect.invoke()
+
+    def add_ssh_key(self, sender, item):
+        '''Run ssh-add to add keys to the ssh-agent, unless it has some'''
+
+        try:
+            if self.agent.identities(refresh=True):
+                self.update_key_status()
+                return
+            supervisor.spawn(['ssh-add'], on_exit=self.on_ssh_add_exit)
+        except AgentError as e:
+            ErrorDialog(str(e))
+        except OSError as e:
+            ErrorDialog("Unable to run ssh-add:\n%s" % e.strerror)
+
+    def on_ssh_add_exit(self, session):
+        '''Refresh the key status once ssh-add is finished'''
+
+        try:
+            self.agent.identities(refresh=True)
+        except AgentError:
+            pass
+        self.update_key_status()
+
+    def remove_ssh_key(self, sender, item):
+        '''
+        Remove the key named on the menu entry from the ssh-agent, or all keys
+        if it names none. Keys added since the entry was labelled stay.
+        '''
+
+        try:
+            if self.shown_key is not None:
+                self.agent.remove(self.shown_key)
+            else:
+                self.agent.remove_all()
+        except AgentError as e:
+            ErrorDialog(str(e))
+        self.update_key_status()
+
+    def on_menu_show(self, menu):
+        '''Refresh the key status as the menu opens'''
+
+        self.update_key_status()
+
+    def update_key_status(self):
+        '''
+        Show the number of keys in the ssh-agent on the 'Remove SSH Key' menu
+        entry. Uses the cached agent state and only asks the agent when it
+        is out of date.
+        '''
+
+        try:
+            keys = self.agent.identities()
+        except AgentError:
+            keys = None
+
+        self.shown_key = keys[0][0] if keys and len(keys) == 1 else None
+        if not keys:
+            label = "Remove SSH Key"
+        elif len(keys) == 1:
+            label = "Remove SSH Key (%s)" % (keys[0][1] or '1 loaded')
+        else:
+            label = "Remove SSH Keys (%d loaded)" % len(keys)
+        self.remove_key_item.set_label(label)
+
+    def preferences(self, sender, item):
+        '''
+        Construct the PreferencesDialog and invoke it. Update the menu if
+        Preferences are saved.
+        '''
+
+        dialog = PreferencesDialog(self, self.config);
+        self.preferences_open = True
+        try:
+            saved = dialog.invoke()
+        finally:
+            self.preferences_open = False
+
+        if saved:
+            self.config.import_ssh_config()
+            self.apply_config()
+
+        if self.reload_pending:
+            self.reload_pending = False
+            self.reload_config()
+
+
+class Config():
+    '''
+    Implements the data model for the application.
+    It is responsible for:
+    * reading the configuration file
+    * maintaining an in-memory representation of the menu items and option
+      settings
+    * writing the config file if changes are made via the preferences dialog
+    '''
+
+    def __init__(self, config_file):
+        '''
+        Takes:
+            config_file (str): Path to the config file. ~/.sshmenu by default
+        '''
+        self.menu_items = []
+        self.classes = {}
+        self.globals = {}
+        self.saved_snapshot = None
+        self.titles = {}
+        self.paths = {}
+        self.item_paths = {}
+        self.index_stale = False
+        self.generated_items = []
+        self.ssh_config = SSHConfigImporter()
+        self.digest = None
+        self.config_file = config_file
+        self.load_config()
+
+    def load_config(self):
+        '''Load and parse the congiguration file into local dictionaries'''
+
+        started = metrics.start()
+        try:
+            data, stamp = self.read_file()
+            self.digest = stamp[2]
+            # import_ssh_config below rebuilds the index
+            self.classes, self.menu_items, snapshot = self.parse_document(data, stamp)
+            self.globals = dict(snapshot[1])
+            self.saved_snapshot = snapshot
+        except:
+            if os.path.exists(self.config_file):
+                ErrorDialog("Unable to read config file")
+            else:
+                self.save(); #Config file does not yet exist... make one.
+
+        self.import_ssh_config()
+        metrics.stop('config.load', started)
+
+    def read_file(self):
+        '''Return the content of the config file and its ConfigCache stamp'''
+
+        fin = open(self.config_file, 'rb')
+        try:
+            data = fin.read()
+            stamp = ConfigCache.stamp(data, os.fstat(fin.fileno()))
+        finally:
+            fin.close()
+        return data, stamp
+
+    def parse_document(self, data, stamp):
+        '''
+        Return the classes and items of the config file, and its snapshot.
+        They are built from the snapshot in the ConfigCache if it is valid,
+        otherwise the YAML is parsed and the snapshot stored.
+
+        Takes
+            data (str): Content of the config file
+            stamp (tuple): (mtime, size, sha1) of the config file
+        '''
+
+        cache = ConfigCache(self.config_file)
+        snapshot = cache.load(stamp)
+        if snapshot is not None:
+            classes = self.parse_classes(snapshot[0])
+            return classes, self.build_items(snapshot[2], classes), snapshot
+
+        document = load_yaml(data)
+        classes = self.parse_classes(document.get('classes'))
+        items = self.parse_items(document['items'], classes)
+        # A config without settings uses the defaults rather than losing its items
+        snapshot = Config.snapshot_of(classes, document.get('global') or {}, items)
+        cache.store(stamp, snapshot)
+        return classes, items, snapshot
+
+    @staticmethod
+    def snapshot_of(classes, globals, items):
+        '''
+        Return the snapshot of a config: its classes as YAML, a copy of its
+        global settings and the rows of its items (see HostItem.to_row). It is
+        what the ConfigCache stores, and comparing the snapshots of the last
+        load or save and of the current state tells whether to save.
+        '''
+
+        return (dict((name, cls.to_yaml()) for name, cls in classes.items()),
+                dict(globals), [item.to_row() for item in items])
+
+    def snapshot(self):
+        '''Return the snapshot of the current state, see snapshot_of'''
+
+        return Config.snapshot_of(self.classes, self.globals, self.menu_items)
+
+    def build_items(self, rows, classes):
+        '''
+        Build the Item objects of snapshot rows, like parse_items does from YAML
+
+        Takes:
+            rows (list [tuple]): The rows, see HostItem.to_row
+            classes (dict {str:HostClass}): The classes hosts are linked to
+        '''
+
+        item_list = []
+        for row in rows:
+            kind = row[0]
+            if kind == Item.HOST:
+                menu_item = HostItem.from_row(row)
+                if menu_item.host_class:
+                    menu_item.template = classes.get(menu_item.host_class)
+            elif kind == Item.MENU:
+                menu_item = MenuItem(row[1], self.build_items(row[2], classes))
+            else:
+                menu_item = SeparatorItem()
+            item_list.append(menu_item)
+        return item_list
+
+    def reload(self):
+        '''
+        Load the config file again after it changed on disk. Returns True if
+        it was loaded, False if it could not be read or its content is the
+        same as at the last load or save, e.g. after our own save.
+
+        Unchanged items keep their identity, see merge_items.
+        '''
+
+        started = metrics.start()
+        try:
+            data, stamp = self.read_file()
+        except (IOError, OSError):
+            return False
+        if stamp[2] == self.digest:
+            return False
+
+        # Don't complain again about the same broken content
+        self.digest = stamp[2]
+        try:
+            classes, menu_items, snapshot = self.parse_document(data, stamp)
+        except Exception:
+            ErrorDialog("Unable to read config file")
+            return False
+
+        self.classes = classes
+        # import_ssh_config below rebuilds the index
+        self.menu_items = self.merge_items(self.menu_items, menu_items)
+        self.globals = dict(snapshot[1])
+        self.saved_snapshot = snapshot
+        self.import_ssh_config()
+        metrics.stop('config.reload', started)
+        return True
+
+    def merge_items(self, old_items, new_items):
+        '''
+        Return new_items with every item replaced by the old item of the same
+        kind and title in the same submenu, updated in place. Keeps the
+        identity of unchanged items so App.update_menu only touches what
+        really changed.
+
+        Takes:
+            old_items (list [Item]): The current items
+            new_items (list [Item]): The items just parsed
+        '''
+
+        def keyed(items):
+            separators = 0
+            for item in items:
+                if item.kind == Item.SEPARATOR:
+                    separators += 1
+                    yield (item.kind, separators), item
+                else:
+                    yield (item.kind, item.display), item
+
+        old = {}
+        for key, item in keyed(old_items):
+            old.setdefault(key, item)
+
+        merged = []
+        for key, item in keyed(new_items):
+            existing = old.pop(key, None)
+            if existing is None:
+                merged.append(item)
+                continue
+
+            if item.kind == Item.HOST:
+                for name in HostItem.__slots__:
+                    setattr(existing, name, getattr(item, name))
+            elif item.kind == Item.MENU:
+                existing.items = self.merge_items(existing.items, item.items)
+            merged.append(existing)
+        return merged
+
+    def parse_items(self, items, classes=None):
+        '''
+        Parse the items yaml into Item objects
+
+        Takes:
+            items (list [dict]): The items yaml
+            classes (dict {str:HostClass}): The classes hosts are linked to,
+                                            the current ones by default
+        '''
+
+        if classes is None:
+            classes = self.classes
+
+        item_list = []
+        for item in items:
+            if item['type'] == 'separator':
+                menu_item = SeparatorItem();
+            elif item['type'] == 'menu':
+                menu_item = MenuItem(item['title'])
+                menu_items = self.parse_items(item['items'], classes)
+                menu_item.items = menu_items
+            else:
+                menu_item = HostItem(item['title'], item)
+                if menu_item.host_class:
+                    menu_item.template = classes.get(menu_item.host_class)
+
+            item_list.append(menu_item)
+        return item_list
+
+    def parse_classes(self, document):
+        '''
+        Parse the classes yaml into resolved HostClass objects keyed by name
+
+        Takes:
+            document (dict {str:dict}): The classes yaml, may be None
+        '''
+
+        classes = {}
+        for name, params in (document or {}).items():
+            classes[name] = HostClass(name, params or {})
+        self.resolve_classes(classes)
+        return classes
+
+    def resolve_classes(self, classes):
+        '''
+        Apply the ancestors of every class to its resolved values. Each class
+        is resolved once, the resolved values of a parent are reused by all
+        its children. An unknown parent, or a loop of classes, ends a chain.
+
+        Takes:
+            classes (dict {str:HostClass}): The classes to resolve
+        '''
+
+        done = set()
+        for cls in classes.values():
+            chain = []
+            seen = set()
+            while cls is not None and cls.name not in done and cls.name not in seen:
+                seen.add(cls.name)
+                chain.append(cls)
+                cls = classes.get(cls.parent)
+
+            if cls is not None and cls.name in done:
+                base = cls.resolved
+            else:
+                base = ('', '', '')
+
+            for cls in reversed(chain):
+                ssh_params = ' '.join(params for params in
+                                      (base[2], cls.ssh_params) if params)
+                base = (cls.profile or base[0], cls.geometry or base[1],
+                        ssh_params)
+                cls.resolved = base
+                done.add(cls.name)
+
+    def set_menu_items(self, menu_items):
+        '''
+        Replace the menu items and rebuild the lookup index
+
+        Takes:
+            menu_items (list [Item]): The new top level items
+        '''
+
+        self.menu_items = menu_items
+        self.reindex()
+
+    def all_items(self):
+        '''
+        Return the top level items of the menu: the ones from the config file
+        followed by the generated ones
+        '''
+
+        return self.menu_items + self.generated_items
+
+    def import_ssh_config(self):
+        '''
+        Refresh the generated 'SSH config' submenu if the 'import_ssh_config'
+        global is set, otherwise drop it
+        '''
+
+        if self.get_global('import_ssh_config'):
+            self.generated_items = self.ssh_config.items()
+        else:
+            self.generated_items = []
+        self.reindex()
+
+    def reindex(self):
+        '''
+        Mark the index used by get_item, get_item_by_path and get_path out of
+        date. Must be called whenever items are added, removed, moved or
+        renamed. The index is rebuilt by the next lookup, so loading a large
+        config does not pay for it before anything is looked up.
+        '''
+
+        self.index_stale = True
+
+    def build_index(self):
+        '''
+        Rebuild the index used by get_item, get_item_by_path and get_path.
+
+        Paths are the titles of the enclosing submenus and of the item joined
+        with '/', e.g. 'prod/db/db-01'. When titles or paths are not unique the
+        first item in menu order wins. Titles and paths are indexed as text,
+        see as_text.
+        '''
+
+        titles = {}
+        paths = {}
+        item_paths = {}
+
+        stack = [('', self.all_items(), 0)]
+        while stack:
+            prefix, items, index = stack.pop()
+            for position in range(index, len(items)):
+                item = items[position]
+                if item.kind == Item.SEPARATOR:
+                    continue
+
+                title = as_text(item.display)
+                path = prefix + title
+                titles.setdefault(title, item)
+                paths.setdefault(path, item)
+                item_paths[item] = path
+
+                if item.kind == Item.MENU:
+                    # Finish this level after the submenu to keep menu order
+                    stack.append((prefix, items, position + 1))
+                    stack.append((path + '/', item.items, 0))
+                    break
+
+        self.titles = titles
+        self.paths = paths
+        self.item_paths = item_paths
+        self.index_stale = False
+
+    def walk(self):
+        '''Iterate over all items in menu order, submenus before their items'''
+
+        stack = [iter(self.all_items())]
+        while stack:
+            for item in stack[-1]:
+                yield item
+                if item.kind == Item.MENU:
+                    stack.append(iter(item.items))
+                    break
+            else:
+                stack.pop()
+
+    def get_item(self, title, items = None):
+        '''
+        Return the first Item with the given title, or None
+        Takes:
+            title (str): Name of the MenuItem to return
+            items (list, MenuItem): List of items to search. Searching all
+                                    items uses the index.
+        '''
+        if items == None:
+            if self.index_stale:
+                self.build_index()
+            return self.titles.get(as_text(title))
+
+        stack = [iter(items)]
+        while stack:
+            for item in stack[-1]:
+                if item.display == title and item.kind != Item.SEPARATOR:
+                    return item
+                elif item.kind == Item.MENU:
+                    stack.append(iter(item.items))
+                    break
+            else:
+                stack.pop()
+
+        return None
+
+    def get_item_by_path(self, path):
+        '''
+        Return the Item at the given menu path, or None
+        Takes:
+            path (str): Path of the item, e.g. 'prod/db/db-01'
+        '''
+
+        if self.index_stale:
+            self.build_index()
+        return self.paths.get(as_text(path))
+
+    def get_path(self, item):
+        '''Return the menu path of an Item or None if it is not in the menu'''
+
+        if self.index_stale:
+            self.build_index()
+        return self.item_paths.get(item)
+
+    def get_global(self, attribute):
+        '''Return a global setting as a boolean'''
+
+        if self.globals.has_key(attribute):
+            return bool(self.globals[attribute])
+        else:
+            return False
+
+    def get_setting(self, attribute, default=None):
+        '''Return a global setting as stored, or default if it is not set'''
+
+        return self.globals.get(attribute, default)
+
+    def set_setting(self, attribute, value):
+        '''Set a global setting that is not a boolean, e.g. a number'''
+
+        self.globals[attribute] = value
+
+    def set_global(self, attribute, value):
+        '''
+        Set a global attribute. Converts from boolean to SSHMenu format (int)
+        '''
+
+        if value == True or value == False:
+            self.globals[attribute] = int(value);
+
+    def backup(self):
+        '''Backup configuration file'''
+
+        if os.path.exists(self.config_file):
+            new_path = self.config_file + '.bak'
+            shutil.copy(self.config_file, new_path)
+
+    def to_yaml(self):
+        '''Create the YAML document representing this object'''
+
+        menu_items = []
+        for item in self.menu_items:
+            menu_items.append(item.to_yaml())
+
+        classes = {}
+        for name, cls in self.classes.items():
+            classes[name] = cls.to_yaml()
+
+        yaml_dict = {'classes' : classes}
+        yaml_dict['items'] = menu_items
+        yaml_dict['global'] = dict(self.globals)
+        return yaml_dict
+
+    def save(self, backup=False, force=False):
+        '''
+        Save the current state of this object to the configuration file.
+        Nothing is written if the state is unchanged since the last load or
+        save, unless force is set. Returns True if the file was written.
+
+        The file is replaced atomically, so a crash never leaves a truncated
+        config behind.
+        '''
+
+        self.reindex()
+        snapshot = self.snapshot()
+        if not force and snapshot == self.saved_snapshot:
+            return False
+
+        if backup:
+            self.backup()
+
+        data = dump_yaml(self.to_yaml())
+        atomic_write(self.config_file, data)
+        self.saved_snapshot = snapshot
+
+        stamp = ConfigCache.stamp(data, os.stat(self.config_file))
+        self.digest = stamp[2]
+        ConfigCache(self.config_file).store(stamp, snapshot)
+        return True
+
+    def have_bcvi(self):
+        '''Whether or not bcvi is enabled'''
+
+        return len(filter(lambda x: os.path.exists(x + '/bcvi'),
+                          os.environ['PATH'].split(':'))) > 0
+
+
+class SSHConfigImporter():
+    '''
+    Builds a submenu from the Host entries of the OpenSSH client
+    configuration, ~/.ssh/config and the files it Includes.
+
+    Only the Host and Include keywords matter, so each file is scanned with
+    one regular expression instead of being parsed line by line. The scan of
+    every file is cached together with its mtime and size, and only files
+    that changed are read again. Host patterns with wildcards or negations
+    are skipped. The hosts are connected to by alias, so ssh applies the rest
+    of their configuration itself.
+    '''
+
+    TITLE = 'SSH config'
+    MAX_DEPTH = 16
+
+    KEYWORDS = r'^[ \t]*(host|include)(?:[ \t]*=[ \t]*|[ \t]+)(.*?)[ \t\r]*$'
+
+    def __init__(self, path=None):
+        '''
+        Takes
+            path (str): The ssh client configuration, ~/.ssh/config by default
+        '''
+
+        self.path = path or os.path.join(os.path.expanduser('~'), '.ssh', 'config')
+        self.directory = os.path.dirname(self.path)
+        self.scans = {}
+        self.stamp = None
+        self.tree = None
+
+    def scan(self, path):
+        '''
+        Return the Host and Include lines of a file as a list of (keyword,
+        [arguments]), from the cache if the file did not change. Returns None
+        if the file cannot be read.
+
+        Takes
+            path (str): The file to scan
+        '''
+
+        try:
+            info = os.stat(path)
+        except OSError:
+            return None
+
+        key = (info.st_mtime, info.st_size)
+        cached = self.scans.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        try:
+            fin = open(path, 'rb')
+            try:
+                text = fin.read().decode('utf-8', 'replace')
+            finally:
+                fin.close()
+        except IOError:
+            return None
+
+        entries = []
+        for match in re.finditer(SSHConfigImporter.KEYWORDS, text, re.I | re.M):
+            arguments = match.group(2)
+            if '"' in arguments:
+                try:
+                    arguments = shlex.split(arguments, comments=True)
+                except ValueError:
+                    continue
+            else:
+                arguments = arguments.split('#', 1)[0].split()
+            entries.append((match.group(1).lower(), arguments))
+
+        self.scans[path] = (key, entries)
+        return entries
+
+    def include(self, pattern):
+        '''Return the files an Include pattern refers to, in the order ssh reads them'''
+
+        pattern = os.path.expanduser(pattern)
+        if not os.path.isabs(pattern):
+            pattern = os.path.join(self.directory, pattern)
+        return sorted(glob.glob(pattern))
+
+    def hosts(self):
+        '''
+        Return the host aliases of the configuration grouped by file, as a
+        list of (path, [alias]) in the order ssh reads the files. Each alias
+        is only listed for the first file it appears in.
+        '''
+
+        groups = []
+        seen = set()
+        visiting = set()
+
+        def visit(path, depth):
+            if path in visiting:
+                return
+            entries = self.scan(path)
+            if entries is None:
+                return
+            visiting.add(path)
+            aliases = []
+            groups.append((path, aliases))
+            for keyword, arguments in entries:
+                if keyword == 'host':
+                    for name in arguments:
+                        if name in seen or '*' in name or '?' in name or name.startswith('!'):
+                            continue
+                        seen.add(name)
+                        aliases.append(intern_string(name))
+                elif depth < SSHConfigImporter.MAX_DEPTH:
+                    for pattern in arguments:
+                        for included in self.include(pattern):
+                            visit(included, depth + 1)
+            visiting.discard(path)
+
+        visit(self.path, 0)
+
+        # Forget files that are no longer included
+        for path in set(self.scans) - set(path for path, aliases in groups):
+            del self.scans[path]
+        return groups
+
+    def items(self):
+        '''
+        Return the generated items: a list holding the 'SSH config' MenuItem,
+        or an empty list if the configuration lists no hosts. The same
+        MenuItem is returned as long as no file changed, so the menu can be
+        updated without rebuilding it.
+        '''
+
+        groups = self.hosts()
+        stamp = tuple((path, self.scans[path][0]) for path, aliases in groups)
+        if stamp == self.stamp:
+            return self.tree
+
+        items = []
+        for path, aliases in groups[1:]:
+            if aliases:
+                title = path
+                if path.startswith(self.directory + os.sep):
+                    title = path[len(self.directory) + 1:]
+                items.append(MenuItem(title, self.host_items(aliases)))
+        if groups:
+            items.extend(self.host_items(groups[0][1]))
+
+        self.stamp = stamp
+        self.tree = [MenuItem(SSHConfigImporter.TITLE, items)] if items else []
+        return self.tree
+
+    @staticmethod
+    def host_items(aliases):
+        '''Return a HostItem for each alias'''
+
+        return [HostItem(alias, {'sshparams': shell_quote(alias)})
+                for alias in aliases]
+
+
+class ConfigCache():
+    '''
+    A compact on-disk cache of the parsed configuration file, so the YAML
+    parser only runs when the file actually changed. The snapshot of the
+    config (see Config.snapshot_of), with one flat row per item, is stored
+    with marshal under $XDG_CACHE_HOME/pysshmenu together with the mtime, size
+    and SHA-1 of the file it was parsed from. A cache whose stamp does not
+    match, or which was written by another Python version, is ignored and
+    rebuilt.
+    '''
+
+    VERSION = 2
+
+    def __init__(self, config_file):
+        '''
+        Takes
+            config_file (str): Path to the config file being cached
+        '''
+
+        cache_home = (os.environ.get('XDG_CACHE_HOME') or
+                      os.path.join(os.path.expanduser('~'), '.cache'))
+        name = hashlib.sha1(os.path.abspath(config_file)).hexdigest()
+        self.path = os.path.join(cache_home, 'pysshmenu', name + '.cache')
+
+    @staticmethod
+    def stamp(data, stat):
+        '''
+        Return the stamp identifying a version of the config file
+
+        Takes
+            data (str): Content of the config file
+            stat (os.stat_result): Result of stat() on the config file
+        '''
+
+        return (stat.st_mtime, stat.st_size, hashlib.sha1(data).hexdigest())
+
+    def header(self, stamp):
+        '''Return the header identifying a valid cache entry for stamp'''
+
+        return (ConfigCache.VERSION, tuple(sys.version_info[:2]), tuple(stamp))
+
+    def load(self, stamp):
+        '''
+        Return the cached snapshot or None if there is no valid cache entry
+
+        Takes
+            stamp (tuple): (mtime, size, sha1) of the config file
+        '''
+
+        try:
+            fin = open(self.path, 'rb')
+            try:
+                header, snapshot = marshal.loads(fin.read())
+            finally:
+                fin.close()
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+
+        if header != self.header(stamp):
+            return None
+        return snapshot
+
+    def store(self, stamp, snapshot):
+        '''
+        Write document to the cache. Failures are ignored, the cache is only
+        an optimisation.
+
+        Takes
+            stamp (tuple): (mtime, size, sha1) of the config file
+            snapshot (tuple): The snapshot of the config file
+        '''
+
+        try:
+            data = marshal.dumps((self.header(stamp), snapshot))
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            atomic_write(self.path, data)
+        except (IOError, OSError, ValueError):
+            pass
+
+
+class HostCache():
+    '''
+    The hosts of a config precompiled for the command line mode: one row of
+    (path, title, profile, geometry, ssh_params) per host, in menu order, with
+    the effective values of host classes applied, and the global settings.
+    Stored with marshal next to the ConfigCache, so listing, searching and
+    connecting neither parse YAML nor build Items.
+
+    The cache is valid while the config file and the ~/.ssh/config files it
+    was built from keep their inode, mtime and size. Otherwise it is rebuilt
+    from a Config.
+    '''
+
+    VERSION = 1
+
+    PATH, TITLE, PROFILE, GEOMETRY, SSH_PARAMS = range(5)
+
+    def __init__(self, config_file):
+        '''
+        Takes
+            config_file (str): Path to the config file
+        '''
+
+        self.config_file = config_file
+        cache = ConfigCache(config_file)
+        self.path = os.path.splitext(cache.path)[0] + '.hosts'
+        self.rows = []
+        self.globals = {}
+
+    @staticmethod
+    def stamp(path):
+        '''Return the (path, inode, mtime, size) of a file, or None'''
+
+        try:
+            info = os.stat(path)
+        except OSError:
+            return None
+        return (path, info.st_ino, info.st_mtime, info.st_size)
+
+    def header(self, files):
+        '''Return the header identifying a valid cache of the given files'''
+
+        return (HostCache.VERSION, tuple(sys.version_info[:2]), tuple(files))
+
+    def load(self):
+        '''
+        Read the hosts from the cache, rebuilding it from the config if it is
+        missing or stale. Returns True if the cache was used as it was.
+        '''
+
+        try:
+            fin = open(self.path, 'rb')
+            try:
+                header, self.globals, self.rows = marshal.loads(fin.read())
+            finally:
+                fin.close()
+            files = header[2]
+            if (header == self.header(files) and files and
+                    files[0][0] == self.config_file and
+                    all(HostCache.stamp(stamp[0]) == tuple(stamp) for stamp in files)):
+                return True
+        except (IOError, OSError, EOFError, ValueError, TypeError, IndexError):
+            pass
+
+        self.build(Config(self.config_file))
+        return False
+
+    def build(self, config):
+        '''
+        Fill the cache from a loaded Config and write it. Write failures are
+        ignored, the cache is only an optimisation.
+
+        Takes
+            config (Config): The config to precompile
+        '''
+
+        rows = []
+        for item in config.walk():
+            if item.kind == Item.HOST:
+                rows.append(HostCache.row(item, config.get_path(item)))
+        self.rows = rows
+        self.globals = dict(config.globals)
+
+        files = [HostCache.stamp(self.config_file)]
+        if config.get_global('import_ssh_config'):
+            files.extend(HostCache.stamp(path) for path in sorted(config.ssh_config.scans))
+        if None in files:
+            return
+
+        try:
+            data = marshal.dumps((self.header(files), self.globals, self.rows))
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            atomic_write(self.path, data)
+        except (IOError, OSError, ValueError):
+            pass
+
+    def get_global(self, attribute):
+        '''Return a global setting as a boolean, like Config.get_global'''
+
+        return bool(self.globals.get(attribute, False))
+
+    def get_setting(self, attribute, default=None):
+        '''Return a global setting as stored, like Config.get_setting'''
+
+        return self.globals.get(attribute, default)
+
+    def find(self, name):
+        '''
+        Return the row of the host with the given menu path, or else the
+        first one with the given title, or None
+
+        Takes
+            name (str): Menu path or title of the host
+        '''
+
+        name = as_text(name)
+        by_title = None
+        for row in self.rows:
+            if row[HostCache.PATH] == name:
+                return row
+            if by_title is None and row[HostCache.TITLE] == name:
+                by_title = row
+        return by_title
+
+    def search(self, query, limit=20):
+        '''
+        Return up to limit rows matching query, best match first, ranked like
+        HostIndex.search but without its typo matching
+
+        Takes
+            query (str): Whitespace separated words to look for
+            limit (int): Maximum number of results
+        '''
+
+        query = as_text(query).lower().strip()
+        words = query.split()
+        if not words:
+            return []
+
+        prefix = []
+        contains = []
+        rest = []
+        for row in self.rows:
+            text = ('%s %s' % (row[HostCache.PATH], row[HostCache.SSH_PARAMS])).lower()
+            for word in words:
+                if word not in text:
+                    break
+            else:
+                title = row[HostCache.TITLE].lower()
+                if title.startswith(query):
+                    prefix.append((title, row))
+                elif query in title:
+                    contains.append(row)
+                else:
+                    rest.append(row)
+
+        prefix.sort(key=lambda entry: entry[0])
+        return ([row for title, row in prefix] + contains + rest)[:limit]
+
+    @staticmethod
+    def row(item, path):
+        '''Return the row of a HostItem at the given menu path'''
+
+        return (path, item.display, item.get_profile(), item.get_geometry(),
+                item.get_ssh_params())
+
+    @staticmethod
+    def host_item(row):
+        '''Return a HostItem with the values of a row'''
+
+        return HostItem(row[HostCache.TITLE],
+                        {'profile': row[HostCache.PROFILE],
+                         'geometry': row[HostCache.GEOMETRY],
+                         'sshparams': row[HostCache.SSH_PARAMS]})
+
+    @staticmethod
+    def describe(row):
+        '''Return a row as a dict for the JSON output'''
+
+        return {'path': row[HostCache.PATH],
+                'title': row[HostCache.TITLE],
+                'profile': row[HostCache.PROFILE],
+                'geometry': row[HostCache.GEOMETRY],
+                'sshparams': row[HostCache.SSH_PARAMS]}
+
+
+class HostIndex():
+    '''
+    Trigram index over the HostItems of a Config, used by the quick connect
+    popup for ranked fuzzy matching on the title, ssh parameters and menu
+    path of a host.
+
+    Every indexed host gets an integer id. Posting lists map each trigram to
+    the ids of the hosts whose text contains it. Removing or changing a host
+    only marks its old id dead; dead ids are skipped by searches and dropped
+    when the index is compacted. Ids follow the order hosts were added in,
+    so the position of each host on the menu is kept apart, as its rank.
+    '''
+
+    MIN_SIMILARITY = 0.5
+    FUZZY_BUDGET = 20000
+
+    def __init__(self):
+        self.items = []
+        self.texts = []
+        self.titles = []
+        self.ranks = []
+        self.ids = {}
+        self.postings = {}
+        self.dead = 0
+        self.sorted_titles = None
+        self.last_query = None
+        self.last_matches = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def trigrams(text):
+        '''Return the set of trigrams in text'''
+
+        return set(text[i:i + 3] for i in range(len(text) - 2))
+
+    @staticmethod
+    def text(item, path):
+        '''Return the searchable text of a HostItem'''
+
+        return ('%s %s' % (path, item.get_ssh_params())).lower()
+
+    def update(self, config):
+        '''
+        Bring the index in line with the hosts of a Config. Only hosts that
+        were added, removed or changed since the last update are touched.
+
+        Takes
+            config (Config): The config to index
+        '''
+
+        hosts = []
+        current = {}
+        for item in config.walk():
+            if item.kind == Item.HOST:
+                text = self.text(item, config.get_path(item))
+                hosts.append((item, text))
+                current[item] = text
+
+        for item in list(self.ids):
+            if current.get(item) != self.texts[self.ids[item]]:
+                self.remove(item)
+
+        ids = self.ids
+        ranks = self.ranks
+        for rank, (item, text) in enumerate(hosts):
+            if item not in ids:
+                self.add(item, text)
+            doc = ids[item]
+            if ranks[doc] != rank:
+                ranks[doc] = rank
+                self.sorted_titles = None
+
+        if self.dead > len(self.ids):
+            self.compact()
+
+    def add(self, item, text):
+        '''Add a HostItem with its searchable text to the index'''
+
+        doc = len(self.items)
+        self.items.append(item)
+        self.texts.append(text)
+        self.titles.append(as_text(item.display).lower())
+        self.ranks.append(doc)
+        self.ids[item] = doc
+        self.sorted_titles = None
+        self.last_query = None
+
+        postings = self.postings
+        for gram in set([text[i:i + 3] for i in range(len(text) - 2)]):
+            try:
+                postings[gram].append(doc)
+            except KeyError:
+                postings[gram] = array('i', [doc])
+
+    def remove(self, item):
+        '''Remove a HostItem from the index'''
+
+        doc = self.ids.pop(item)
+        self.items[doc] = None
+        self.texts[doc] = ''
+        self.titles[doc] = ''
+        self.dead += 1
+        self.sorted_titles = None
+        self.last_query = None
+
+    def compact(self):
+        '''Rebuild the posting lists without the ids of removed hosts'''
+
+        live = sorted((self.ranks[doc], doc, item) for item, doc in self.ids.items())
+        texts = self.texts
+        self.__init__()
+        for rank, doc, item in live:
+            self.add(item, texts[doc])
+            self.ranks[-1] = rank
+
+    def search(self, query, limit=20):
+        '''
+        Return up to limit HostItems matching query, best match first.
+
+        Every whitespace separated word of the query has to occur in the text
+        of a host. If that gives fewer than limit results, hosts sharing most
+        of the query's trigrams are added, so small typos still match.
+
+        Results are ranked in tiers: titles starting with the query (in
+        alphabetical order), titles containing it, other matches and finally
+        typo matches by trigram overlap. Within the last tiers hosts keep
+        their menu order.
+
+        While the user keeps typing, each query extends the previous one and
+        only the previous matches need to be checked again.
+
+        Takes
+            query (str): What the user typed
+            limit (int): Maximum number of results
+        '''
+
+        query = as_text(query).lower().strip()
+        words = query.split()
+        if not words:
+            self.last_query = None
+            return []
+
+        best = []
+        if len(words) == 1:
+            # Prefix matches come straight from the sorted titles, so short
+            # queries matching many hosts do not need a scan at all
+            best = self.title_prefix(query, limit)
+            if len(best) == limit:
+                self.last_query = None
+                return [self.items[doc] for doc in best]
+
+        grams = set()
+        for word in words:
+            grams.update(self.trigrams(word))
+        postings = sorted((self.postings.get(gram, ()) for gram in grams),
+                          key=len)
+
+        texts = self.texts
+        if self.last_query and query.startswith(self.last_query):
+            candidates = self.last_matches
+            words = words[len(self.last_query.split()) - 1:]
+        elif postings:
+            candidates = postings[0]
+        else:
+            # Too short for trigrams, fall back to a plain scan
+            candidates = range(len(texts))
+
+        for word in words:
+            candidates = [doc for doc in candidates if word in texts[doc]]
+        matches = candidates
+        self.last_query = query
+        self.last_matches = matches
+
+        tiers = []
+        rest = matches
+        if best:
+            seen = set(best)
+            titles = self.titles
+            tiers.append([doc for doc in matches
+                          if query in titles[doc] and doc not in seen])
+            if len(best) + len(tiers[0]) < limit:
+                seen.update(tiers[0])
+                rest = [doc for doc in matches if doc not in seen]
+        tiers.append(rest)
+
+        if len(matches) < limit:
+            tiers.extend(self.similar(grams, set(matches)))
+
+        rank = self.ranks.__getitem__
+        for tier in tiers:
+            best.extend(heapq.nsmallest(limit - len(best), tier, key=rank))
+            if len(best) >= limit:
+                break
+        return [self.items[doc] for doc in best]
+
+    def similar(self, grams, exclude):
+        '''
+        Return the hosts sharing at least MIN_SIMILARITY of the given trigrams,
+        as a list of tiers with the most shared trigrams first. Gives up when
+        the trigrams are too common to narrow the search down.
+
+        Takes
+            grams (set [str]): Trigrams of the query
+            exclude (set [int]): Ids of hosts to leave out
+        '''
+
+        # A host sharing at least 'needed' of the trigrams must contain one of
+        # the len(present) - needed + 1 rarest ones that occur at all
+        needed = max(1, int(len(grams) * HostIndex.MIN_SIMILARITY + 0.999))
+        present = sorted((self.postings[gram] for gram in grams
+                          if gram in self.postings), key=len)
+        rare = present[:len(present) - needed + 1]
+        if not rare or sum(map(len, rare)) > HostIndex.FUZZY_BUDGET:
+            return []
+
+        candidates = set()
+        for posting in rare:
+            candidates.update(posting)
+        candidates.difference_update(exclude)
+
+        found = {}
+        texts = self.texts
+        for doc in candidates:
+            text = texts[doc]
+            count = 0
+            for gram in grams:
+                if gram in text:
+                    count += 1
+            if count >= needed:
+                found.setdefault(count, []).append(doc)
+
+        return [found[count] for count in sorted(found, reverse=True)]
+
+    def title_prefix(self, prefix, limit):
+        '''Return the ids of up to limit hosts whose title starts with prefix'''
+
+        if self.sorted_titles is None:
+            self.sorted_titles = sorted((self.titles[doc], self.ranks[doc], doc)
+                                        for doc in self.ids.values())
+
+        result = []
+        start = bisect.bisect_left(self.sorted_titles, (prefix,))
+        for title, rank, doc in self.sorted_titles[start:start + limit]:
+            if not title.startswith(prefix):
+                break
+            result.append(doc)
+        return result
+
+
+class Item(object):
+    '''
+    Base class for the HostItem, MenuItem, and SeparatorItem classes.
+
+    Items use __slots__ instead of an instance __dict__ so that configs with
+    many thousands of hosts stay small in memory. Subclasses must declare
+    __slots__ for any attribute they add.
+    '''
+
+    __slots__ = ('kind', 'display', 'action', 'show_in_tree')
+
+    MENU = "menu"
+    SEPARATOR = "separator"
+    ITEM = "item"
+    HOST = "host"
+
+    def __init__(self, display, action=None, kind=ITEM, show_in_tree=True):
+        '''
+        Takes:
+            display (str): how the menu item will look on the GTK menu
+            action (callable): what happens when the menu item is clicked
+            kind (str): Item Type
+            show_in_tree (bool): Whether or not this item appears on the
+                                 hosts menu. Used for menu items added via
+                                 preferences
+        '''
+        self.kind = kind
+        self.display = display
+        self.action = action
+        self.show_in_tree = show_in_tree
+
+    def __str__(self):
+        return "Item - type: %s Name: %s" % (self.kind, self.display)
+
+
+class HostItem(Item):
+    '''
+    Used as a container for the configuration options associated with a host
+    item on the main menu.
+
+    All HostItems share the same action, HostItem.launch, which builds the
+    command line from the item it is handed.
+
+    profile, geometry and ssh_params are the host's own values, the ones that
+    are edited and saved. A host naming a HostClass in host_class inherits the
+    values it leaves empty from the class, and the ssh parameters of the class
+    come before its own. The get_ methods return these effective values.
+
+    Inherits from Item.
+    '''
+
+    __slots__ = ('profile', 'geometry', 'ssh_params', 'enable_bcvi',
+                 'host_class', 'template')
+
+    NO_PROFILE = "< None> "
+
+    # ssh options that take an argument
+    SSH_ARG_FLAGS = 'BbcDEeFIiJLlmOoPpQRSWw'
+
+    def __init__(self, display, params=None):
+        '''
+        Takes:
+            display (str): string to be displayed in the menu
             params (dict {str:str}): ssh parameters for the host
                 - profile: the ssh profile name to associate with host
                 - geometry: the geometry for the window the host is opened in
                 - sshparams: Additional options for ssh
+                - class: name of the HostClass the host inherits from
+        '''
+
+        Item.__init__(self, display, HostItem.launch, Item.HOST)
+        if not params:
+            params = {'profile' : '',
+                      'geometry' : '',
+                      'sshparams' : ''}
+        # Profiles and geometries repeat across many hosts, share the strings
+        self.profile = intern_string(params.get('profile') or '')
+        self.geometry = intern_string(params.get('geometry') or '')
+        self.ssh_params = params.get('sshparams') or ''
+        self.enable_bcvi = False
+        self.host_class = intern_string(params.get('class') or '')
+        # The HostClass named by host_class, set by Config.parse_items
+        self.template = None
+
+    def get_profile(self):
+        '''Return the profile of the host, or else of its class'''
+
+        # Older configs saved the "no profile" entry of the dialog as is
+        profile = self.profile if self.profile != HostItem.NO_PROFILE else ''
+        if profile or self.template is None:
+            return profile
+        return self.template.resolved[0]
+
+    def get_geometry(self):
+        '''Return the geometry of the host, or else of its class'''
+
+        if self.geometry or self.template is None:
+            return self.geometry
+        return self.template.resolved[1]
+
+    def get_ssh_params(self):
+        '''Return the ssh parameters of the class followed by the host's own'''
+
+        if self.template is None or not self.template.resolved[2]:
+            return self.ssh_params
+        return ' '.join(params for params in
+                        (self.template.resolved[2], self.ssh_params) if params)
+
+    def target(self):
+        '''
+        Return the (host, port) the ssh command of this host connects to,
+        parsed from ssh_params, or None if it names no host. Like ssh, options
+        may also follow the host, up to the remote command.
+        '''
+
+        try:
+            args = shlex.split(self.get_ssh_params())
+        except ValueError:
+            return None
+
+        host = None
+        port = '22'
+        args.reverse()
+        while args:
+            arg = args.pop()
+            if arg == '--':
+                if host is None and args:
+                    host = args.pop()
+                break
+            if not arg.startswith('-') or arg == '-':
+                if host is not None:
+                    # The remote command
+                    break
+                host = arg
+                continue
+
+            flags = arg[1:]
+            while flags:
+                flag, flags = flags[0], flags[1:]
+                if flag not in HostItem.SSH_ARG_FLAGS:
+                    continue
+                value = flags or (args.pop() if args else '')
+                flags = ''
+                if flag == 'p':
+                    port = value
+                elif flag == 'o':
+                    option = value.replace('=', ' ', 1).split(None, 1)
+                    if len(option) == 2 and option[0].lower() == 'port':
+                        port = option[1].strip()
+
+        if not host:
+            return None
+        if host.startswith('ssh://'):
+            host = host[len('ssh://'):].rstrip('/')
+            if host.rfind(':') > host.rfind(']'):
+                host, port = host.rsplit(':', 1)
+        host = host.rpartition('@')[2].strip('[]')
+
+        try:
+            port = int(port)
+        except ValueError:
+            return None
+        if not host or not 0 < port < 65536:
+            return None
+        return host, port
+
+    def command(self):
+        '''Return the command line that opens a terminal connected to the host'''
+
+        cmd = ['gnome-terminal',
+               '--title', self.display,
+               '--geometry', self.get_geometry(),
+               '-e', self.ssh_command()]
+        profile = self.get_profile()
+        if profile and (profile != HostItem.NO_PROFILE):
+            cmd += ['--profile', profile]
+        return cmd
+
+    def tab_args(self):
+        '''Return the gnome-terminal arguments that open the host in a tab'''
+
+        args = ['--tab', '-t', self.display]
+        profile = self.get_profile()
+        if profile and (profile != HostItem.NO_PROFILE):
+            args += ['--profile', profile]
+        return args + ['-e', self.ssh_command()]
+
+    def ssh_command(self):
+        '''
+        Return the ssh command line for the host as one string, including
+        the multiplexing options if they are enabled
+        '''
+
+        options = [shell_quote(arg) for arg in multiplexer.options()]
+        return ' '.join(['ssh'] + options + [self.get_ssh_params()])
+
+    @staticmethod
+    def launch(sender, item):
+        '''
+        Open a terminal connected to a host
+
+        Takes
+            sender (Gtk.Widget): The widget that triggered the action or None
+            item (HostItem): The host to connect to
+        '''
+
+        started = metrics.start()
+        argv = item.command()
+        metrics.stop('launch.argv', started)
+
+        on_exit = None
+        if started is not None:
+            def on_exit(session):
+                metrics.record('launch.terminal', time.time() - session.started)
+
+        try:
+            supervisor.spawn(argv, item.display, on_exit)
+            metrics.stop('launch.dispatch', started)
+            usage.record(item)
+        except OSError as e:
+            ErrorDialog("Unable to start a terminal for %s:\n%s" %
+                        (item.display, e.strerror))
+
+    def to_yaml(self):
+        '''Create YAML representation of this Item'''
+
+        yaml_dict = {}
+        yaml_dict['profile'] = self.profile
+        yaml_dict['sshparams'] = self.ssh_params
+        yaml_dict['type'] = self.kind
+        yaml_dict['geometry'] = self.geometry
+        yaml_dict['title'] = self.display
+        if self.host_class:
+            yaml_dict['class'] = self.host_class
+        return yaml_dict
+
+    def to_row(self):
+        '''Return the ConfigCache row of this host, see from_row'''
+
+        return (Item.HOST, self.display, self.profile, self.geometry,
+                self.ssh_params, self.host_class)
+
+    @staticmethod
+    def from_row(row):
+        '''
+        Return the HostItem of a row made by to_row. Skips __init__, which
+        costs more than the rest of a warm start for large configs.
+        '''
+
+        item = HostItem.__new__(HostItem)
+        (item.kind, item.display, item.profile, item.geometry,
+         item.ssh_params, item.host_class) = row
+        item.action = HostItem.launch
+        item.show_in_tree = True
+        item.enable_bcvi = False
+        item.template = None
+        return item
+
+
+class HostClass(object):
+    '''
+    A named set of host parameters kept in the 'classes' section of the
+    config. HostItems, and other classes, name it with a 'class' key to
+    inherit the profile and geometry they leave empty, and to have its ssh
+    parameters put before their own.
+
+    resolved holds the (profile, geometry, ssh_params) of the class with
+    those of its ancestors applied. Config.resolve_classes computes it once
+    per load, so a host looks its values up without walking the chain.
+    '''
+
+    __slots__ = ('name', 'parent', 'profile', 'geometry', 'ssh_params',
+                 'resolved')
+
+    def __init__(self, name, params):
+        '''
+        Takes:
+            name (str): Name of the class
+            params (dict {str:str}): Parameters of the class
+                - class: name of the class this one inherits from
+                - profile, geometry, sshparams: as for a HostItem
+        '''
+
+        self.name = name
+        self.parent = params.get('class') or ''
+        self.profile = intern_string(params.get('profile') or '')
+        self.geometry = intern_string(params.get('geometry') or '')
+        self.ssh_params = params.get('sshparams') or ''
+        self.resolved = (self.profile, self.geometry, self.ssh_params)
+
+    def __deepcopy__(self, memo):
+        # Copies of a host share its class
+        return self
+
+    def to_yaml(self):
+        '''Create YAML representation of this class, without empty values'''
+
+        yaml_dict = {}
+        for key, value in (('class', self.parent), ('profile', self.profile),
+                           ('geometry', self.geometry),
+                           ('sshparams', self.ssh_params)):
+            if value:
+                yaml_dict[key] = value
+        return yaml_dict
+
+
+class MenuItem(Item):
+    '''
+    Used as a container for the configuration options associated with a
+    sub-menu.  The object's only properties are the title and the list of child
+    items.
+
+    Inherits from Item.
+    '''
+
+    __slots__ = ('items',)
+
+    def __init__(self, display, items=None):
+        '''
+        Takes:
+            display (str): string to be displayed in the menu
+            items (list [Item]): List of children Items to this menu
+        '''
+        Item.__init__(self, display, kind=Item.MENU)
+        self.items = items if items is not None else []
+
+    def __str__(self):
+        return "Item - type: %s Name: %s Items: %s" % (self.kind, self.display,
+                                                       map(str, self.items))
+
+    def has_items(self):
+        '''Determine whether or not this menu has child items'''
+
+        for item in self.items:
+            if item.show_in_tree:
+                return True
+        return False
+
+    def to_yaml(self):
+        '''Create YAML representation of this Item'''
+
+        yaml_dict = {}
+        yaml_dict['type'] = self.kind
+        yaml_dict['title'] = self.display
+        items = []
+        for item in self.items:
+            items.append(item.to_yaml())
+        yaml_dict['items'] = items
+
+        return yaml_dict
+
+    def to_row(self):
+        '''Return the ConfigCache row of this menu and its items'''
+
+        return (Item.MENU, self.display, [item.to_row() for item in self.items])
+
+
+class SeparatorItem(Item):
+    '''
+    Used as a placeholder for menu separators
+
+    Inherits from Item.
+    '''
+
+    __slots__ = ()
+
+    def __init__(self):
+        Item.__init__(self, "_____________________________", kind=Item.SEPARATOR)
+
+    def to_yaml(self):
+        '''Create YAML representation of this Item'''
+
+        return {'type' : 'separator'}
+
+    def to_row(self):
+        '''Return the ConfigCache row of this separator'''
+
+        return (Item.SEPARATOR,)
+
+
+class ErrorDialog():
+    '''A Simple dialog for displaying errors'''
+
+    def __init__(self, error):
+        '''
+        Takes
+            error (str): Error string to be displayed
+        '''
+
+        if Gtk is None:
+            sys.stderr.write('SSHMenu: %s\n' % error)
+            return
+
+        err = Gtk.MessageDialog(type=Gtk.MessageType.ERROR,
+                                buttons=Gtk.ButtonsType.OK,
+                                message_format=error)
+        err.run()
+        err.destroy()
+
+
+class PreferencesDialog():
+    '''
+    Implements the main preferences dialog. Current config is read in from the
+    Config object and written back if the user chooses to save a new config. If
+    the user saves the dialog, True is returned. Otherwise False.
+
+    The dialog user interface comprises a treeview for the menu items and
+    buttons for adding, removing, editing and reordering items.
+
+    Two additional tabs provide access to global option settings and the
+    'About' box.
+    '''
+
+    ITEM_COLUMN = 0
+
+    # Rows added between checks of the time budget while filling the tree
+    FILL_BATCH = 100
+    # Seconds spent filling the tree per turn of the main loop
+    FILL_BUDGET = 0.02
+    # Changes to more rows than this are made with the model detached
+    BULK_DETACH = 100
+
+    def __init__(self, app, config):
+        '''
+        Takes
+            app (App): The application associated with this dialog
+            config (Config): Config object to display/modify
+        '''
+        self.app = app
+        self.config = config
+        self.button = {}
+        self.selected = None
+        self.dialog = None
+        self.filling = None
+        self.updating = False
+
+    def invoke(self):
+        '''Create the menu and return True if settings saved else False'''
+
+        started = metrics.start()
+        dialog = self.build_dialog()
+        metrics.stop('dialog.preferences', started)
+        success = False
+
+        response = dialog.run()
+        self.filling = None
+        if response == Gtk.ResponseType.ACCEPT:
+            self.save_menu_items()
+            self.save_options(dialog)
+            self.config.save(self.config.get_global('back_up_config'))
+            success = True
+        else:
+            # Host and submenu dialogs edit items in place
+            self.config.reindex()
+
+        dialog.destroy()
+        return success
+
+    def save_menu_items(self):
+        '''
+        Convert TreeView to list and overwrite the menu_item list in config
+        '''
+
+        menu_items = self.get_menu_items(self.model.get_iter_first(), [])
+        self.config.set_menu_items(menu_items)
+
+    def save_options(self, dialog):
+        '''
+        Save the selected options on the options pane to the config global
+        options
+
+        Takes:
+            dialog (Gtk.Dialog): The dialog associated with PreferencesDialog
+        '''
+
+        (w, h) = dialog.get_size()
+        self.config.set_global('width', w)
+        self.config.set_global('height', h)
+        self.config.set_global('back_up_config', self.chk_back_up_config.get_active())
+        self.config.set_global('menus_open_all', self.chk_open_all.get_active())
+        self.config.set_global('menus_open_tabs', self.chk_open_tabs.get_active())
+        self.config.set_global('menus_probe', self.chk_probe.get_active())
+        self.config.set_global('ssh_multiplex', self.chk_multiplex.get_active())
+        self.config.set_global('import_ssh_config', self.chk_ssh_config.get_active())
+        self.config.set_global('collect_statistics', self.chk_statistics.get_active())
+        self.config.set_global('menus_frequent', self.chk_frequent.get_active())
+        self.config.set_global('menus_eager', self.chk_eager.get_active())
+        self.config.set_setting('open_all_concurrency',
+                                self.spin_concurrency.get_value_as_int())
+        self.config.set_setting('open_all_rate', self.spin_rate.get_value_as_int())
+        self.config.set_setting('tabs_per_window', self.spin_tabs.get_value_as_int())
+        self.config.set_setting('ssh_control_persist',
+                                self.spin_persist.get_value_as_int())
+
+    def get_menu_items(self, treeiter, items):
+        '''
+        Walk the TreeStore and produce a list of menu_items mirroring its
+        structure. The items of submenus are replaced by their rows.
+
+        Takes
+            treeiter (Gtk.TreeIter): The first node to walk, its following
+                                     siblings and their children are
+                                     walked as well
+            items (list [Item]): List the items are appended to
+        '''
+
+        model = self.model
+        column = PreferencesDialog.ITEM_COLUMN
+        stack = [(treeiter, items)]
+        while stack:
+            treeiter, children = stack.pop()
+            while treeiter is not None:
+                item = model.get_value(treeiter, column)
+                children.append(item)
+                if item.kind == Item.MENU:
+                    item.items = []
+                    stack.append((model.iter_children(treeiter), item.items))
+                treeiter = model.iter_next(treeiter)
+
+        return items
+
+    def build_dialog(self):
+        '''Build the PreferencesDialog'''
+
+        dialog = Gtk.Dialog("Preferences",
+                            None,
+                            Gtk.DialogFlags.MODAL | Gtk.DialogFlags.DESTROY_WITH_PARENT,
+                            (Gtk.STOCK_OK, Gtk.ResponseType.ACCEPT,
+                             Gtk.STOCK_CANCEL, Gtk.ResponseType.REJECT))
+
+        dialog.set_position(Gtk.WindowPosition.MOUSE);
+
+        width = self.config.get_global('width') or 370
+        height = self.config.get_global('height') or 360
+        dialog.resize(width,height)
+
+        notebook = Gtk.Notebook()
+        dialog.vbox.pack_start(notebook, True, True, 0)
+
+        notebook.append_page(self.make_hosts_pane(), Gtk.Label("Hosts"))
+        notebook.append_page(self.make_options_pane(), Gtk.Label("Options"))
+        notebook.append_page(self.make_about_pane(), Gtk.Label("About"))
+
+        self.dialog = dialog
+        self.start_filling()
+        dialog.show_all()
+        return dialog
+
+    def make_hosts_pane(self):
+        '''Create the pane in PreferencesDialog to view/edit Items'''
+
+        pane = Gtk.HBox(False, 12)
+        pane.set_border_width(8)
+
+        list_box = Gtk.VBox(False, 8)
+        pane.pack_start(list_box, True, True, 0)
+
+        sw = Gtk.ScrolledWindow()
+        sw.set_shadow_type(Gtk.ShadowType.ETCHED_IN)
+        sw.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+        list_box.pack_start(sw, True, True, 0)
+
+        # The TreeView scrolls itself, in a viewport it would lay out every row
+        hlist = self.make_hosts_list()
+        sw.add(hlist)
+        hlist.connect('row_activated', self.btn_edit_pressed)
+
+        arrows = Gtk.HBox(True, 10)
+        list_box.pack_start(arrows, False, True, 0)
+
+        buttons = Gtk.VBox(False, 10)
+        pane.pack_start(buttons, True, True, 0)
+
+        self.add_button(arrows, 'up', '', Gtk.STOCK_GO_UP, False)
+        self.add_button(arrows, 'down', '', Gtk.STOCK_GO_DOWN, False)
+        self.add_button(buttons, 'add', 'Add Host', None, False)
+        self.add_button(buttons, 'sep', 'Add Separator', None, False)
+        self.add_button(buttons, 'menu', 'Add Submenu', None, False)
+        self.add_button(buttons, 'edit', 'Edit', None, False)
+        self.add_button(buttons, 'copy', 'Copy Host', None, False)
+        self.add_button(buttons, 'move', 'Move to Submenu', None, False)
+        self.add_button(buttons, 'del', 'Remove', None, False)
+
+        return pane
+
+    def make_options_pane(self):
+        '''Create the pane to view/edit the global options'''
+
+        table = Gtk.Table(1, 1, False)
+        table.set_border_width(10)
+        r = 0
+
+        self.chk_back_up_config = Gtk.CheckButton('back up config file on save')
+        self.chk_back_up_config.set_active(self.config.get_global('back_up_config'))
+        table.attach(self.chk_back_up_config, 0, 1, r, r+1)
+        r += 1
+
+        self.chk_open_all = Gtk.CheckButton('include "Open all windows" selection')
+        self.chk_open_all.set_active(self.config.get_global('menus_open_all'))
+        table.attach(self.chk_open_all, 0, 1, r, r+1)
+        r += 1
+
+        self.chk_open_tabs = Gtk.CheckButton('include "Open all tabs" selection')
+        self.chk_open_tabs.set_active(self.config.get_global('menus_open_tabs'))
+        table.attach(self.chk_open_tabs, 0, 1, r, r+1)
+        r += 1
+
+        self.chk_probe = Gtk.CheckButton('include "Check reachability" selection')
+        self.chk_probe.set_active(self.config.get_global('menus_probe'))
+        table.attach(self.chk_probe, 0, 1, r, r+1)
+        r += 1
+
+        self.chk_multiplex = Gtk.CheckButton('share one connection per host (ssh ControlMaster)')
+        self.chk_multiplex.set_active(self.config.get_global('ssh_multiplex'))
+        table.attach(self.chk_multiplex, 0, 1, r, r+1)
+        r += 1
+
+        self.chk_ssh_config = Gtk.CheckButton('add the hosts from ~/.ssh/config as a submenu')
+        self.chk_ssh_config.set_active(self.config.get_global('import_ssh_config'))
+        table.attach(self.chk_ssh_config, 0, 1, r, r+1)
+        r += 1
+
+        self.chk_statistics = Gtk.CheckButton('collect timing statistics')
+        self.chk_statistics.set_active(self.config.get_global('collect_statistics'))
+        table.attach(self.chk_statistics, 0, 1, r, r+1)
+        r += 1
+
+        self.chk_frequent = Gtk.CheckButton('include "Frequent" submenu (remembers the hosts opened)')
+        self.chk_frequent.set_active(self.config.get_global('menus_frequent'))
+        table.attach(self.chk_frequent, 0, 1, r, r+1)
+        r += 1
+
+        self.chk_eager = Gtk.CheckButton('build all submenus at startup')
+        self.chk_eager.set_active(self.config.get_global('menus_eager'))
+        table.attach(self.chk_eager, 0, 1, r, r+1)
+        r += 1
+
+        self.spin_concurrency = self.add_spin_option(table, r,
+                'windows opened at once by "Open all windows"',
+                self.config.get_setting('open_all_concurrency', 8), 1, 64)
+        r += 1
+
+        self.spin_rate = self.add_spin_option(table, r,
+                'windows opened per second (0 for no limit)',
+                self.config.get_setting('open_all_rate', 20), 0, 1000)
+        r += 1
+
+        self.spin_tabs = self.add_spin_option(table, r,
+                'tabs per window for "Open all as tabs" (0 for no limit)',
+                self.config.get_setting('tabs_per_window', 20), 0, 1000)
+        r += 1
+
+        self.spin_persist = self.add_spin_option(table, r,
+                'seconds an idle shared connection stays open',
+                self.config.get_setting('ssh_control_persist', 600), 1, 86400)
+
+        return table
+
+    def add_spin_option(self, table, row, text, value, lower, upper):
+        '''
+        Add a labelled Gtk.SpinButton for a numeric option and return it
+
+        Takes
+            table (Gtk.Table): The options table
+            row (int): Row of the table to use
+            text (str): Label text
+            value (int): Current value
+            lower (int): Lowest value allowed
+            upper (int): Highest value allowed
+        '''
+
+        box = Gtk.HBox(False, 6)
+        spin = Gtk.SpinButton.new_with_range(lower, upper, 1)
+        spin.set_value(value)
+        box.pack_start(spin, False, False, 0)
+        box.pack_start(Gtk.Label(text), False, False, 0)
+        table.attach(box, 0, 1, row, row+1)
+        return spin
+
+    def make_about_pane(self):
+        '''Create the pane to display version/copyright information'''
+
+        pane = Gtk.VBox(False, 12)
+        panel = Gtk.VBox(False, 12)
+
+        title = Gtk.Label()
+        title.set_markup("<span font_desc='sans bold 36'>pySSHMenu</span>");
+        title.set_selectable(True)
+
+        version = Gtk.Label()
+        version.set_markup("<span font_desc='sans 24'>Version: %s</span>" % self.app.VERSION);
+        version.set_selectable(True)
+
+        author = Gtk.Label()
+        detail = '(c) 2012 Travis Patterson &lt;masslessparticle@gmail.com&gt;'
+        author.set_markup("  <span font_desc='sans 10'>%s</span>  " % detail);
+        author.set_selectable(True)
+
+        attrib = Gtk.Label()
+        attr_detail = 'Based on SSHMenu by Grant McLean &lt;grant@mclean.net.nz&gt;\n\n'
+        attr_detail += 'This attribution is not an endorsement by the author of\n'
+        attr_detail += 'or contributors to SSHMenu'
+        attrib.set_markup("<span font_desc='sans 10'>%s</span>" % attr_detail)
+        attrib.set_selectable(True)
+
+        def open_homepage(window, sender, url):
+            import webbrowser
+            webbrowser.open(url)
+
+        def on_realize(window):
+            hand = Gdk.Cursor(Gdk.CursorType.HAND2)
+            window.get_parent_window().set_cursor(hand)
+
+        site_box = Gtk.EventBox()
+        site_box.connect('button-press-event', open_homepage, self.app.SITE_URL)
+        site_box.connect('realize', on_realize)
+        site_link = Gtk.Label()
+        site_link.set_markup("<span font_desc='sans 10' foreground='#0000FF' " +
+                        "underline='single'>%s</span>" % self.app.SITE_URL)
+        site_box.add(site_link)
+
+        attr_box = Gtk.EventBox()
+        attr_box.connect('button-press-event', open_homepage, self.app.ATTR_URL)
+        attr_box.connect('realize', on_realize)
+        attr_link = Gtk.Label()
+        attr_link.set_markup("<span font_desc='sans 10' foreground='#0000FF' " +
+                        "underline='single'>%s</span>" % self.app.ATTR_URL);
+        attr_box.add(attr_link)
+
+        panel.pack_start(title, False, False, 0)
+        panel.pack_start(version, False, False, 0)
+        panel.pack_start(author, False, False, 10)
+        panel.pack_start(site_box, False, False, 0)
+        panel.pack_start(attrib, False, False, 10)
+        panel.pack_start(attr_box, False, False, 0)
+        pane.pack_start(panel, True, False, 10)
+        return pane
+
+    def make_hosts_list(self):
+        '''Create the TreeStore/TreeView that displays the menu information'''
+
+        def renderer_func(column, cell_renderer, model, iterator, data):
+            item = model.get_value(iterator, 0)
+            cell_renderer.set_property("text", item.display)
+
+        self.model = Gtk.TreeStore(object)
+
+        # The model is attached by start_filling
+        self.view = Gtk.TreeView()
+        self.view.set_rules_hint(False)
+        self.view.set_search_column(0)
+
+        # All rows have the same height, so it need not be measured per row
+        renderer = Gtk.CellRendererText()
+        column = Gtk.TreeViewColumn("Host", renderer)
+        column.set_cell_data_func(renderer, renderer_func)
+        column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        column.set_expand(True)
+        self.view.append_column(column)
+        self.view.set_fixed_height_mode(True)
+
+        selection = self.view.get_selection()
+        selection.set_mode(Gtk.SelectionMode.MULTIPLE)
+        selection.connect('changed', self.on_selection_changed)
+        return self.view
+
+    def start_filling(self):
+        '''
+        Fill the TreeStore with the menu items. The first rows are added
+        while the model is detached from the view, the rest in batches from
+        the main loop, so the dialog opens at once however large the config.
+        Editing and OK are disabled until all rows are in.
+        '''
+
+        self.fill_started = metrics.start()
+        self.dialog.set_response_sensitive(Gtk.ResponseType.ACCEPT, False)
+        self.filling = self.fill_rows(None, self.config.menu_items)
+        more = self.fill_step()
+        self.view.set_model(self.model)
+        if more:
+            GLib.idle_add(self.fill_step)
+
+    def fill_step(self):
+        '''
+        Add rows for up to FILL_BUDGET seconds. Returns True while there are
+        rows left, so it can be used as an idle callback.
+        '''
+
+        filling = self.filling
+        if filling is None:
+            # The dialog was closed
+            return False
+
+        deadline = time.time() + PreferencesDialog.FILL_BUDGET
+        for _ in filling:
+            if time.time() >= deadline:
+                return True
+
+        self.filling = None
+        self.finish_filling()
+        return False
+
+    def finish_filling(self):
+        '''Enable editing once the TreeStore holds all items'''
+
+        self.dialog.set_response_sensitive(Gtk.ResponseType.ACCEPT, True)
+        for key in ('add', 'sep', 'menu'):
+            self.button[key].set_sensitive(True)
+        if GLib.glib_version >= (1, 19, 0): #@UndefinedVariable
+            self.view.set_reorderable(True)
+        self.initialize_buttons()
+        metrics.stop('dialog.preferences_fill', self.fill_started)
+
+    def fill_rows(self, treeiter, items):
+        '''
+        Generator adding Items and the items of submenus to the TreeStore,
+        breadth first, so the top level rows appear first. Yields after every
+        FILL_BATCH rows.
+
+        Takes
+            treeiter (Gtk.TreeIter): The parent node to add Items to
+            items (list [Item]): Items to add to TreeStore
+        '''
+
+        model = self.model
+        queue = deque([(treeiter, items)])
+        added = 0
+        while queue:
+            parent, items = queue.popleft()
+            for item in items:
+                if item.kind == Item.MENU:
+                    menu_iter = model.append(parent, [item])
+                    if item.items:
+                        queue.append((menu_iter, item.items))
+                elif item.show_in_tree:
+                    model.append(parent, [item])
+                else:
+                    continue
+
+                added += 1
+                if added % PreferencesDialog.FILL_BATCH == 0:
+                    yield
+
+    def add_items(self, treeiter, items):
+        '''
+        Add Items to the TreeStore at once
+
+        Takes
+            treeiter (Gtk.TreeIter): The parent node to add Items to
+            items (list [Item]): Items to add to TreeStore
+        '''
+
+        for _ in self.fill_rows(treeiter, items):
+            pass
+
+    def add_button(self, box, key, label, stock_id, sensitive):
+        '''
+        Add a button to the given widget
+
+        Takes
+            box (Gtk.Widget): Widget to add button to
+            key (str): Dictionary key to retrieve button later
+            label (str): Button label
+            stock_id (int): Gtk stock button id or None
+            sensitive (bool): Whether button is enabled
+        '''
+
+        button = None
+        if stock_id:
+            button = Gtk.Button(stock=stock_id)
+        else:
+            button = Gtk.Button(label)
+
+        self.button[key] = button
+        button_action = getattr(self, 'btn_%s_pressed' % key)
+        button.connect('clicked', button_action)
+        button.set_focus_on_click(False)
+        button.set_sensitive(sensitive)
+        box.pack_start(button, True, True, 0)
+
+    def initialize_buttons(self):
+        '''
+        Enable or disable the buttons on the TreeView based on what kinds of
+        Items are selected and where in the TreeView they are.
+        '''
+
+        model = self.model
+        selection = self.view.get_selection()
+        selected = self.get_selected_iters()
+        column = PreferencesDialog.ITEM_COLUMN
+
+        kinds = set()
+        has_children = False
+        up = down = False
+        for treeiter in selected:
+            kind = model.get_value(treeiter, column).kind
+            kinds.add(kind)
+            if kind == Item.MENU and model.iter_has_child(treeiter):
+                has_children = True
+
+            # A row can move if its neighbour does not move along with it
+            previous = model.iter_previous(treeiter)
+            if previous is not None and not selection.iter_is_selected(previous):
+                up = True
+            following = model.iter_next(treeiter)
+            if following is not None and not selection.iter_is_selected(following):
+                down = True
+
+        single = len(selected) == 1
+        self.button['edit'].set_sensitive(single and Item.SEPARATOR not in kinds)
+        self.button['copy'].set_sensitive(kinds == set([Item.HOST]))
+        self.button['del'].set_sensitive(bool(selected) and not has_children)
+        self.button['move'].set_sensitive(bool(selected))
+        self.button['up'].set_sensitive(up)
+        self.button['down'].set_sensitive(down)
+
+    def get_selected_iters(self):
+        '''Return the Gtk.TreeIters of the selected rows in tree order'''
+
+        model, paths = self.view.get_selection().get_selected_rows()
+        return [model.get_iter(path) for path in paths]
+
+    def get_selected(self):
+        '''
+        Return the model and the Gtk.TreeIter of the selected row, or None when
+        no row or more than one row is selected
+        '''
+
+        selected = self.get_selected_iters()
+        return self.model, (selected[0] if len(selected) == 1 else None)
+
+    def get_row_item(self, treeiter):
+        '''
+        Return the Item of a row, with the items of a submenu taken from the
+        rows below it
+
+        Takes
+            treeiter (Gtk.TreeIter): The row to get the Item of
+        '''
+
+        item = self.model.get_value(treeiter, PreferencesDialog.ITEM_COLUMN)
+        if item.kind == Item.MENU:
+            item.items = []
+            self.get_menu_items(self.model.iter_children(treeiter), item.items)
+        return item
+
+    def get_submenus(self):
+        '''
+        Return the titles and Gtk.TreeIters of all submenus in the TreeStore
+        that are not selected or inside a selected submenu, in tree order
+        '''
+
+        model = self.model
+        selection = self.view.get_selection()
+        column = PreferencesDialog.ITEM_COLUMN
+        submenus = []
+        stack = [(model.get_iter_first(), '')]
+        while stack:
+            treeiter, prefix = stack.pop()
+            found = []
+            while treeiter is not None:
+                item = model.get_value(treeiter, column)
+                if item.kind == Item.MENU and not selection.iter_is_selected(treeiter):
+                    title = prefix + item.display
+                    submenus.append((title, treeiter))
+                    found.append((model.iter_children(treeiter), title + ' / '))
+                treeiter = model.iter_next(treeiter)
+            stack.extend(reversed(found))
+
+        return submenus
+
+    def bulk(self, operation, selected, *args):
+        '''
+        Apply an operation to the selected rows as one change of the TreeStore
+        and select the rows it returns. Changes to more than BULK_DETACH rows
+        are made with the model detached from the view, so the view is rebuilt
+        once rather than updated for each row.
+
+        Takes
+            operation (callable): Called with the selected Gtk.TreeIters and
+                                  args, returns the Gtk.TreeIters to select
+            selected (list [Gtk.TreeIter]): The selected rows
+        '''
+
+        model = self.model
+        view = self.view
+        selection = view.get_selection()
+        detach = len(selected) > PreferencesDialog.BULK_DETACH
+
+        self.updating = True
+        try:
+            if detach:
+                expanded = []
+                view.map_expanded_rows(lambda view, path, data:
+                                       expanded.append(Gtk.TreeRowReference.new(model, path)),
+                                       None)
+                view.set_model(None)
+            try:
+                rows = operation(selected, *args)
+            finally:
+                if detach:
+                    view.set_model(model)
+                    for reference in expanded:
+                        if reference.valid():
+                            view.expand_to_path(reference.get_path())
+
+            selection.unselect_all()
+            for treeiter in rows:
+                parent = model.iter_parent(treeiter)
+                if parent is not None:
+                    view.expand_to_path(model.get_path(parent))
+                selection.select_iter(treeiter)
+            if rows:
+                view.scroll_to_cell(model.get_path(rows[0]), None, False, 0, 0)
+        finally:
+            self.updating = False
+
+        self.initialize_buttons()
+
+    def move_rows(self, selected, up):
+        '''
+        Move the rows one place up or down among their siblings, returning
+        them. Rows next to each other move as a block.
+
+        Takes
+            selected (list [Gtk.TreeIter]): The rows to move
+            up (bool): Move up if True, down otherwise
+        '''
+
+        model = self.model
+        selection = self.view.get_selection()
+
+        for treeiter in (selected if up else reversed(selected)):
+            if up:
+                neighbour = model.iter_previous(treeiter)
+            else:
+                neighbour = model.iter_next(treeiter)
+            if neighbour is not None and not selection.iter_is_selected(neighbour):
+                model.swap(treeiter, neighbour)
+        return selected
+
+    def copy_rows(self, selected):
+        '''
+        Insert a copy of each row right after it, returning the copies
+
+        Takes
+            selected (list [Gtk.TreeIter]): The rows to copy
+        '''
+
+        model = self.model
+        column = PreferencesDialog.ITEM_COLUMN
+        return [model.insert_after(None, treeiter,
+                                   [copy.deepcopy(model.get_value(treeiter, column))])
+                for treeiter in selected]
+
+    def remove_rows(self, selected):
+        '''
+        Remove the rows
+
+        Takes
+            selected (list [Gtk.TreeIter]): The rows to remove
+        '''
+
+        for treeiter in selected:
+            self.model.remove(treeiter)
+        return []
+
+    def move_to_submenu(self, selected, target):
+        '''
+        Move the rows, with the rows below them, to the end of a submenu,
+        returning the moved rows
+
+        Takes
+            selected (list [Gtk.TreeIter]): The rows to move
+            target (Gtk.TreeIter): The submenu to move to, None for the top
+                                   level
+        '''
+
+        model = self.model
+        selection = self.view.get_selection()
+
+        # Rows inside a selected submenu move along with it
+        tops = []
+        for treeiter in selected:
+            parent = model.iter_parent(treeiter)
+            while parent is not None and not selection.iter_is_selected(parent):
+                parent = model.iter_parent(parent)
+            if parent is None:
+                tops.append(treeiter)
+
+        items = [self.get_row_item(treeiter) for treeiter in tops]
+        for treeiter in tops:
+            model.remove(treeiter)
+
+        rows = []
+        for item in items:
+            treeiter = model.append(target, [item])
+            if item.kind == Item.MENU:
+                self.add_items(treeiter, item.items)
+            rows.append(treeiter)
+        return rows
+
+    def add_new(self, model, treeiter, item):
+        '''
+        Add a new node to the TreeStore/TreeView
+
+        takes
+            model (Gtk.TreeStore): Model to add the item to
+            treeiter (Gtk.TreeIter): Parent node item will be added to
+            item (Item): The Item to add to the Model
+        '''
+
+        if treeiter:
+            current_item = model[treeiter][PreferencesDialog.ITEM_COLUMN]
+            if current_item.kind != Item.MENU:
+                treeiter = model.iter_parent(treeiter)
+        self.add_items(treeiter, [item])
+
+
+    def on_selection_changed(self, sender):
+        '''Fired when the selection in the TreeView changes'''
+
+        if self.filling is not None or self.updating:
+            return
+        self.initialize_buttons()
+
+    def btn_up_pressed(self, sender):
+        '''Fired when the 'up' Button is pressed'''
+
+        self.bulk(self.move_rows, self.get_selected_iters(), True)
+
+    def btn_down_pressed(self, sender):
+        '''Fired when the 'down' Button is pressed'''
+
+        self.bulk(self.move_rows, self.get_selected_iters(), False)
+
+    def btn_add_pressed(self, sender):
+        '''Fired when the 'add host' Button is pressed'''
+
+        dialog = HostDialog(HostItem(""), self.config)
+        item = dialog.invoke()
+        if item:
+            model, treeiter = self.get_selected()
+            self.add_new(model, treeiter, item)
+
+    def btn_menu_pressed(self, sender):
+        '''Fired when the 'add menu' Button is pressed'''
+        dialog = SubmenuDialog(MenuItem(""))
+        item = dialog.invoke()
+        if item:
+            model, treeiter = self.get_selected()
+            self.add_new(model, treeiter, item)
+
+    def btn_sep_pressed(self, sender):
+        '''Fired when the 'add separator' Button is pressed'''
+
+        item = SeparatorItem()
+        model, treeiter = self.get_selected()
+
+        if treeiter is None:
+            model.insert(None, 0, [item])
+        elif model[treeiter][PreferencesDialog.ITEM_COLUMN].kind == Item.MENU:
+            model.insert(treeiter, 0, [item])
+        else:
+            model.insert_after(None, treeiter, [item])
+
+    def btn_edit_pressed(self, sender, *args):
+        '''Fired when the 'edit' Button is pressed or a row is activated'''
+
+        model, treeiter = self.get_selected()
+        if treeiter and self.filling is None:
+            selected_item = model[treeiter][PreferencesDialog.ITEM_COLUMN]
+            if selected_item.kind == Item.HOST:
+                dialog = HostDialog(selected_item, self.config)
+            elif selected_item.kind == Item.MENU:
+                dialog = SubmenuDialog(selected_item)
+            else:
+                return
+
+            # The row keeps its place and the rows below it
+            item = dialog.invoke()
+            if item:
+                model.set_value(treeiter, PreferencesDialog.ITEM_COLUMN, item)
+
+    def btn_copy_pressed(self, sender):
+        '''Fired when the 'copy' Button is pressed'''
+
+        selected = self.get_selected_iters()
+        if len(selected) > 1:
+            self.bulk(self.copy_rows, selected)
+        elif selected:
+            treeiter = selected[0]
+            model = self.model
+            item = model[treeiter][PreferencesDialog.ITEM_COLUMN]
+            new_item = copy.deepcopy(item)
+
+            dialog = HostDialog(new_item, self.config)
+            new_item = dialog.invoke()
+
+            if new_item:
+                model.insert_after(None, treeiter, [new_item])
+
+    def btn_move_pressed(self, sender):
+        '''Fired when the 'move to submenu' Button is pressed'''
+
+        selected = self.get_selected_iters()
+        if selected:
+            submenus = [('(top level)', None)] + self.get_submenus()
+            dialog = MoveDialog([title for title, treeiter in submenus])
+            index = dialog.invoke()
+            if index is not None:
+                self.bulk(self.move_to_submenu, selected, submenus[index][1])
+
+    def btn_del_pressed(self, sender):
+        '''Fired when the 'delete' Button is pressed'''
+
+        selected = self.get_selected_iters()
+        if selected:
+            self.bulk(self.remove_rows, selected)
+
+
+class MoveDialog():
+    '''
+    Implements the dialog for choosing the submenu to move Items to. Once the
+    MoveDialog object has been constructed, its invoke method is called to
+    display the dialog. When the user dismisses the dialog, the invoke method
+    will return None on cancel or the index of the chosen submenu on OK.
+    '''
+
+    def __init__(self, titles):
+        '''
+        Takes
+            titles (list [str]): Titles of the submenus to choose from
+        '''
+
+        self.titles = titles
+
+    def invoke(self):
+        '''Invoke the MoveDialog'''
+
+        started = metrics.start()
+        dialog = self.build_dialog()
+        metrics.stop('dialog.move', started)
+        response = dialog.run()
+        index = self.submenu.get_active()
+        dialog.destroy()
+
+        if response == Gtk.ResponseType.ACCEPT and index >= 0:
+            return index
+
+    def build_dialog(self):
+        '''Build the dialog associated with MoveDialog'''
+
+        dialog = Gtk.Dialog("Move to Submenu",
+                            None,
+                            Gtk.DialogFlags.MODAL | Gtk.DialogFlags.DESTROY_WITH_PARENT,
+                            (Gtk.STOCK_OK, Gtk.ResponseType.ACCEPT,
+                             Gtk.STOCK_CANCEL, Gtk.ResponseType.REJECT))
+
+        dialog.set_default_response(Gtk.ResponseType.ACCEPT)
+        dialog.set_position(Gtk.WindowPosition.MOUSE)
+
+        body = Gtk.VBox(False, 0)
+        body.set_border_width(4)
+        dialog.vbox.add(body)
+
+        label = Gtk.Label('Submenu')
+        label.set_alignment(0, 1)
+        body.pack_start(label, False, True, 0)
+
+        widget = Gtk.ComboBoxText()
+        for title in self.titles:
+            widget.append_text(title)
+        widget.set_active(0)
+
+        self.submenu = widget
+
+        body.pack_start(widget, False, True, 0)
+
+        dialog.show_all()
+
+        return dialog
+
+
+class HostDialog():
+    '''
+    Implements the dialog for editing a HostItem. Once the HostDialog object has
+    been constructed, its invoke method is called to display the dialog.  When
+    the user dismisses the dialog, the invoke method will return None on cancel
+    or the edited host item on OK.
+    '''
+
+    TESTRESPONSE = 42
+
+    def __init__(self, item, config):
+        '''
+        Takes
+            item (HostItem): The HostItem to fill in
+            config (Config): The config object associated with this application
         '''
+        self.host = item
+        self.config = config
+        self.class_entry = None
 
-        Item.__init__(self, display, kind=Item.HOST)
-        if not params:
-            params = {'profile' : '',
-                      'geometry' : '',
-                      'sshparams' : ''}
-        self.profile = params.get('profile', '')
-        self.geometry = params.get('geometry', '')
-        self.ssh_params = params['sshparams']
-        self.enable_bcvi = False
-        self.action = self.create_action()
+    def invoke(self):
+        '''Invoke the HostDialog'''
+
+        started = metrics.start()
+        dialog = self.build_dialog()
+        metrics.stop('dialog.host', started)
+
+        while True:
+            response = dialog.run()
+            if response == Gtk.ResponseType.ACCEPT:
+                if self.inputs_valid():
+                    self.dialog_to_host(self.host)
+                    dialog.destroy()
+                    return self.host
+            elif response == HostDialog.TESTRESPONSE:
+                self.test_host()
+            else:
+                break
+
+        dialog.destroy()
+
+    def inputs_valid(self):
+        '''Check HostDialog inputs for valadidity'''
+
+        if len(self.title_entry.get_text().strip()) == 0:
+            ErrorDialog("You must enter a title")
+            return False
+        elif len(self.params_entry.get_text().strip()) == 0:
+            ErrorDialog("You must enter a hostname")
+            return False
+        else:
+            return True
+
+    def dialog_to_host(self, host=None):
+        '''Dump the infromation from the HostDialog into the HostItem'''
+        if host == None:
+            host = HostItem(self.title_entry.get_text())
+        else:
+            host.display = self.title_entry.get_text()
+
+        host.ssh_params = self.params_entry.get_text()
+        host.geometry = self.geometry_entry.get_text()
+        host.enable_bcvi = True if self.config.have_bcvi() else False
+        profile = self.profile_entry.get_active_text() or ''
+        host.profile = profile if profile != HostItem.NO_PROFILE else ''
+        if self.class_entry is not None:
+            host.host_class = self.class_entry.get_active_text() or ''
+            host.template = self.config.classes.get(host.host_class)
+        return host
+
+    def test_host(self):
+        '''Run the HostItem's action'''
+
+        host = self.dialog_to_host()
+        host.action(None, host)
+
+    def build_dialog(self):
+        '''Build the dialog associated with the HostDialog'''
+
+        dialog = Gtk.Dialog("Host Connection details",
+                            None,
+                            Gtk.DialogFlags.MODAL | Gtk.DialogFlags.DESTROY_WITH_PARENT,
+                            ('Test', HostDialog.TESTRESPONSE,
+                             Gtk.STOCK_OK, Gtk.ResponseType.ACCEPT,
+                             Gtk.STOCK_CANCEL, Gtk.ResponseType.REJECT))
+
+        dialog.set_default_response(Gtk.ResponseType.ACCEPT)
+        dialog.set_position(Gtk.WindowPosition.MOUSE)
+
+        self.body = Gtk.VBox(False, 0)
+        self.body.set_border_width(4)
+        dialog.vbox.add(self.body)
+
+        self.add_title_input()
+        self.add_class_input()
+        self.add_hostname_input()
+        self.add_geometry_input()
+        self.add_profile_input()
+        self.add_other_inputs()
+
+        dialog.show_all()
+        return dialog
+
+    def add_title_input(self):
+        '''Add a 'title' text input to the HostDialog'''
+        self.title_entry = self.add_input('Title', self.host.display)
+
+    def add_class_input(self):
+        '''
+        Add a 'class' combobox input to the HostDialog, if there are classes
+        or the host names one
+        '''
+
+        self.class_entry = None
+        names = sorted(self.config.classes)
+        if not names and not self.host.host_class:
+            return
+
+        self.class_entry = Gtk.ComboBoxText.new_with_entry()
+        self.class_entry.append_text('')
+        for name in names:
+            self.class_entry.append_text(name)
+        # An unknown class is kept as it is, like an unknown profile
+        self.class_entry.get_child().set_text(self.host.host_class)
+        self.add_input('Class', widget=self.class_entry)
+
+    def add_hostname_input(self):
+        '''Add a 'hostname' text input to the HostDialog'''
+        self.params_entry = self.add_input('Hostname (etc)', self.host.ssh_params)
+
+    def add_geometry_input(self):
+        '''Add a 'geometry' text/button input to the HostDialog'''
+        box = Gtk.HBox(False, 4)
+
+        self.geometry_entry = Gtk.Entry()
+        self.geometry_entry.set_text(self.host.geometry)
+        self.geometry_entry.set_activates_default(True)
+        box.pack_start(self.geometry_entry, True, True, 0)
+
+        def grab_clicked(sender):
+            self.geometry_entry.set_text(GeoGrabber.grab())
+
+        btn = Gtk.Button('Grab')
+        btn.set_sensitive(GeoGrabber().can_grab())
+        btn.connect('clicked', grab_clicked)
+
+        box.pack_start(btn, False, False, 0)
+
+        self.add_input('Geometry', self.host.geometry, box)
+
+    def add_profile_input(self):
+        '''Add a 'profile' combobox input to the HostDialog'''
+
+        self.profile_entry = Gtk.ComboBoxText.new_with_entry()
+        self.profile_entry.append_text(HostItem.NO_PROFILE)
+        for name in profiles.names():
+            self.profile_entry.append_text(name)
+
+        profile = self.host.profile
+        if profile == '' or profile == HostItem.NO_PROFILE:
+            self.profile_entry.set_active(0)
+        elif profiles.position(profile) is not None:
+            self.profile_entry.set_active(profiles.position(profile) + 1)
+        else:
+            # A profile this terminal does not know, keep it as it is
+            self.profile_entry.get_child().set_text(profile)
+
+        self.add_input('Profile', widget=self.profile_entry)
+
+    def add_other_inputs(self):
+        '''Add a 'bcvi' checkbox input to the HostDialog'''
+
+        if self.config.have_bcvi():
+            self.enable_bcvi = Gtk.CheckButton("Enable 'bcvi' forwarding?", False)
+            self.enable_bcvi.set_active(self.host.enable_bcvi)
+            self.body.pack_start(self.enable_bcvi, False, True, 0)
+
+    def add_input(self, text, content="", widget=None):
+        '''
+        Add a generic widget to the HostDialog
+
+        Takes
+            text (str): Lable text for the widget
+            content (str): Starting text for Gtk.Entry widgets
+            widget (Gtk.Widget): The widget to add, it None add Gtk.Entry
+        '''
+
+        label = Gtk.Label(text)
+        label.set_alignment(0,1)
+        self.body.pack_start(label, False, True, 0)
+
+        if not widget:
+            widget = Gtk.Entry()
+            widget.set_width_chars(36)
+            widget.set_text(content)
+            widget.set_activates_default(True)
+
+        self.body.pack_start(widget, False, True, 0)
+        return widget
+
+
+class SubmenuDialog():
+    '''
+    Implements the dialog for editing a MenuItem. Once the MenuDialog object has
+    been constructed, its invoke method is called to display the dialog.
+    When the user dismisses the dialog, the invoke method will return None on
+    cancel or the edited menu item on OK.
+    '''
+
+    def __init__(self, menu_item):
+        '''
+        Takes
+            menu_item (MenuItem): The MenuItem associated with this Dialog
+        '''
+
+        self.menu_item = menu_item
+
+    def invoke(self):
+        '''Invoke the MenuDialog'''
+
+        started = metrics.start()
+        dialog = self.build_dialog()
+        metrics.stop('dialog.submenu', started)
+        response = dialog.run()
+
+        while response == Gtk.ResponseType.ACCEPT:
+            if self.inputs_valid():
+                self.menu_item.display = self.title.get_text()
+                dialog.destroy()
+                return self.menu_item
+            else:
+                response = dialog.run()
+
+        dialog.destroy()
+
+    def inputs_valid(self):
+        '''Check that the inputs for the MenuDialog are valid'''
+
+        if len(self.title.get_text().strip()) == 0:
+            ErrorDialog("You Must enter a title")
+            return False
+        return True
+
+    def build_dialog(self):
+        '''Build the dialog associated with MenuDialog'''
+
+        dialog = Gtk.Dialog("Submenu Name",
+                            None,
+                            Gtk.DialogFlags.MODAL | Gtk.DialogFlags.DESTROY_WITH_PARENT,
+                            (Gtk.STOCK_OK, Gtk.ResponseType.ACCEPT,
+                             Gtk.STOCK_CANCEL, Gtk.ResponseType.REJECT))
+
+        dialog.set_default_response(Gtk.ResponseType.ACCEPT)
+        dialog.set_position(Gtk.WindowPosition.MOUSE)
+
+        body = Gtk.VBox(False, 0)
+        body.set_border_width(4)
+        dialog.vbox.add(body)
 
-    def create_action(self):
-        '''Create an action to connect to menu signals'''
+        label = Gtk.Label('Title')
+        label.set_alignment(0, 1)
+        body.pack_start(label, False, True, 0)
 
-        def ssh_command(sender, item):
-            cmd = ['gnome-terminal',
-                   '--title', self.display,
-                   '--geometry', self.geometry,
-                    '-e','ssh ' + self.ssh_params]
-            if self.profile and (self.profile != "< None> "):
-                cmd += ['--profile', self.profile]
-            subprocess.Popen(cmd, shell=False,stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE)
+        widget = Gtk.Entry()
+        widget.set_width_chars(36)
+        widget.set_text(self.menu_item.display)
+        widget.set_activates_default(True)
 
-        return ssh_command
+        self.title = widget
 
-    def to_yaml(self):
-        '''Create YAML representation of this Item'''
+        body.pack_start(widget, False, True, 0)
 
-        yaml_dict = {}
-        yaml_dict['profile'] = self.profile
-        yaml_dict['sshparams'] = self.ssh_params
-        yaml_dict['type'] = self.kind
-        yaml_dict['geometry'] = self.geometry
-        yaml_dict['title'] = self.display
-        return yaml_dict
+        dialog.show_all()
 
+        return dialog
 
-class MenuItem(Item):
-    '''
-    Used as a container for the configuration options associated with a
-    sub-menu.  The object's only properties are the title and the list of child
-    items.
 
-    Inherits from Item.
+class QuickConnect():
+    '''
+    Implements the quick connect popup: a text entry over a list of the hosts
+    matching what has been typed so far, best match first. Enter or a double
+    click connects to the selected host and closes the popup, Escape closes
+    it.
     '''
-    def __init__(self, display, items=[]):
+
+    LIMIT = 20
+    ITEM_COLUMN = 2
+
+    def __init__(self, app):
         '''
-        Takes:
-            display (str): string to be displayed in the menu
-            items (list [Item]): List of children Items to this menu
+        Takes
+            app (App): The application whose hosts are searched
         '''
-        Item.__init__(self, display, kind=Item.MENU)
-        self.items = items
+        self.app = app
+        self.window = None
 
-    def __str__(self):
-        return "Item - type: %s Name: %s Items: %s" % (self.kind, self.display,
-                                                       map(str, self.items))
+    def invoke(self):
+        '''Show the popup, or raise it if it is already open'''
+
+        if not self.window:
+            started = metrics.start()
+            self.window = self.build_window()
+            metrics.stop('dialog.quick_connect', started)
+            self.window.show_all()
+        self.window.present()
+
+    def build_window(self):
+        '''Build the window associated with QuickConnect'''
+
+        window = Gtk.Window(Gtk.WindowType.TOPLEVEL)
+        window.set_title("Quick Connect")
+        window.set_position(Gtk.WindowPosition.CENTER_ALWAYS)
+        window.set_keep_above(True)
+        window.set_default_size(420, 300)
+        window.connect('key-press-event', self.on_key_press)
+        window.connect('destroy', self.on_destroy)
+
+        body = Gtk.VBox(False, 4)
+        body.set_border_width(4)
+        window.add(body)
 
-    def has_items(self):
-        '''Determine whether or not this menu has child items'''
+        self.entry = Gtk.Entry()
+        self.entry.connect('changed', self.on_changed)
+        self.entry.connect('activate', self.on_activate)
+        body.pack_start(self.entry, False, True, 0)
+
+        self.model = Gtk.ListStore(str, str, object)
+        self.view = Gtk.TreeView(self.model)
+        self.view.set_headers_visible(False)
+        self.view.set_enable_search(False)
+        self.view.connect('row_activated', self.on_row_activated)
+
+        for index in range(2):
+            column = Gtk.TreeViewColumn(None, Gtk.CellRendererText(), text=index)
+            self.view.append_column(column)
+
+        sw = Gtk.ScrolledWindow()
+        sw.set_shadow_type(Gtk.ShadowType.ETCHED_IN)
+        sw.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+        sw.add(self.view)
+        body.pack_start(sw, True, True, 0)
+
+        return window
+
+    def on_changed(self, entry):
+        '''Fired when the text in the entry changes. Refills the match list'''
+
+        self.model.clear()
+        config = self.app.config
+        for item in self.app.get_host_index().search(entry.get_text(),
+                                                     QuickConnect.LIMIT):
+            self.model.append([item.display, config.get_path(item), item])
+
+        if len(self.model) > 0:
+            self.view.set_cursor(Gtk.TreePath.new_first(), None, False)
+
+    def on_key_press(self, window, event):
+        '''Handle Escape and moving through the matches from the entry'''
+
+        if event.keyval == Gdk.KEY_Escape:
+            window.destroy()
+            return True
+
+        if event.keyval in (Gdk.KEY_Up, Gdk.KEY_Down) and len(self.model) > 0:
+            path, column = self.view.get_cursor()
+            position = path.get_indices()[0] if path else 0
+            if event.keyval == Gdk.KEY_Up:
+                position = max(0, position - 1)
+            else:
+                position = min(len(self.model) - 1, position + 1)
+            self.view.set_cursor(Gtk.TreePath(position), None, False)
+            return True
 
-        for item in self.items:
-            if item.show_in_tree:
-                return True
         return False
 
-    def to_yaml(self):
-        '''Create YAML representation of this Item'''
+    def on_activate(self, entry):
+        '''Fired when Enter is pressed in the entry'''
 
-        yaml_dict = {}
-        yaml_dict['type'] = self.kind
-        yaml_dict['title'] = self.display
-        items = []
-        for item in self.items:
-            items.append(item.to_yaml())
-        yaml_dict['items'] = items
+        path, column = self.view.get_cursor()
+        if path:
+            self.connect(self.model[path][QuickConnect.ITEM_COLUMN])
 
-        return yaml_dict
+    def on_row_activated(self, view, path, column):
+        '''Fired when a match is double clicked'''
 
+        self.connect(self.model[path][QuickConnect.ITEM_COLUMN])
 
-class SeparatorItem(Item):
-    '''
-    Used as a placeholder for menu separators
+    def on_destroy(self, window):
+        '''Forget the window so the next invoke builds a fresh one'''
 
-    Inherits from Item.
+        self.window = None
+
+    def connect(self, item):
+        '''Close the popup and connect to the given HostItem'''
+
+        self.window.destroy()
+        item.action(None, item)
+
+
+class RollingHistogram():
+    '''
+    Keeps the last SIZE samples of a timing, so its percentiles follow
+    recent behaviour, along with the count and total of all samples
     '''
 
+    SIZE = 1024
+
     def __init__(self):
-        Item.__init__(self, "_____________________________", kind=Item.SEPARATOR)
+        self.samples = deque(maxlen=RollingHistogram.SIZE)
+        self.count = 0
+        self.total = 0.0
 
-    def to_yaml(self):
-        '''Create YAML representation of this Item'''
+    def add(self, value):
+        '''
+        Record a sample
 
-        return {'type' : 'separator'}
+        Takes
+            value (float): The sample, in seconds
+        '''
 
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
 
-class ErrorDialog():
-    '''A Simple dialog for displaying errors'''
+    def summary(self):
+        '''
+        Return the count, mean, p50, p95, p99 and max in milliseconds. The
+        percentiles and max cover the recent samples only.
+        '''
 
-    def __init__(self, error):
+        ordered = sorted(self.samples)
+
+        def percentile(p):
+            return ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+
+        return {'count': self.count,
+                'mean': self.total / self.count * 1000,
+                'p50': percentile(0.50),
+                'p95': percentile(0.95),
+                'p99': percentile(0.99),
+                'max': ordered[-1] * 1000}
+
+
+class Metrics():
+    '''
+    Collects timings of the hot paths in RollingHistograms when enabled by
+    the 'collect_statistics' global or --statistics.
+
+    Timed code calls start() and hands the result to stop(). While disabled,
+    start() returns None and stop() returns at once, so the cost is two
+    function calls. May be used from any thread.
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.requested = False
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def configure(self, config):
         '''
+        Enable collection if the 'collect_statistics' global is set or it was
+        requested with --statistics, otherwise disable it
+
         Takes
-            error (str): Error string to be displayed
+            config (Config): The configuration
         '''
 
-        err = Gtk.MessageDialog(type=Gtk.MessageType.ERROR,
-                                buttons=Gtk.ButtonsType.OK,
-                                message_format=error)
-        err.run()
-        err.destroy()
+        self.enabled = self.requested or config.get_global('collect_statistics')
 
+    def start(self):
+        '''Return the start time for stop(), None if disabled'''
 
-class PreferencesDialog():
-    '''
-    Implements the main preferences dialog. Current config is read in from the
-    Config object and written back if the user chooses to save a new config. If
-    the user saves the dialog, True is returned. Otherwise False.
+        if self.enabled:
+            return time.time()
+        return None
 
-    The dialog user interface comprises a treeview for the menu items and
-    buttons for adding, removing, editing and reordering items.
+    def stop(self, name, started):
+        '''
+        Record the time since started under name
 
-    Two additional tabs provide access to global option settings and the
-    'About' box.
-    '''
+        Takes
+            name (str): The timing, e.g. 'launch.spawn'
+            started (float): What start() returned
+        '''
 
-    ITEM_COLUMN = 0
+        if started is not None:
+            self.record(name, time.time() - started)
 
-    def __init__(self, app, config):
+    def record(self, name, seconds):
         '''
+        Record a timing
+
         Takes
-            app (App): The application associated with this dialog
-            config (Config): Config object to display/modify
+            name (str): The timing
+            seconds (float): How long it took
         '''
-        self.app = app
-        self.config = config
-        self.button = {}
-        self.selected = None
 
-    def invoke(self):
-        '''Create the menu and return True if settings saved else False'''
+        self.lock.acquire()
+        try:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = RollingHistogram()
+            histogram.add(seconds)
+        finally:
+            self.lock.release()
 
-        dialog = self.build_dialog()
-        success = False
+    def summary(self):
+        '''Return the summary of every timing, keyed by name'''
 
-        if dialog.run() == Gtk.ResponseType.ACCEPT:
-            self.save_menu_items()
-            self.save_options(dialog)
-            self.config.save(self.config.get_global('back_up_config'))
-            success = True
+        self.lock.acquire()
+        try:
+            return dict((name, histogram.summary())
+                        for name, histogram in self.histograms.items())
+        finally:
+            self.lock.release()
 
-        dialog.destroy()
-        return success
+    def describe(self):
+        '''Return a line per timing for the statistics menu'''
 
-    def save_menu_items(self):
+        lines = []
+        for name, summary in sorted(self.summary().items()):
+            lines.append('%s: %d, p50 %.2f, p95 %.2f, p99 %.2f ms' %
+                         (name, summary['count'], summary['p50'],
+                          summary['p95'], summary['p99']))
+        return lines
+
+    @staticmethod
+    def dump_path():
+        '''Return the file written by dump'''
+
+        cache_home = (os.environ.get('XDG_CACHE_HOME') or
+                      os.path.join(os.path.expanduser('~'), '.cache'))
+        return os.path.join(cache_home, 'pysshmenu', 'statistics.json')
+
+    def dump(self):
+        '''Write the summaries as JSON to dump_path() and return the path'''
+
+        import json
+        path = Metrics.dump_path()
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        document = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'pid': os.getpid(),
+                    'timings': self.summary()}
+        atomic_write(path, json.dumps(document, indent=2, sort_keys=True))
+        return path
+
+
+metrics = Metrics()
+
+
+class UsageLog():
+    '''
+    Remembers which hosts are opened, for the 'Frequent' submenu, ranked by
+    frecency: every launch counts with a weight that halves every HALF_LIFE
+    seconds.
+
+    Rather than decaying every score as time passes, a launch at time t is
+    given the weight 2 ** (t / HALF_LIFE). That keeps the order of the
+    scores the same, and they are kept as natural logarithms so they do not
+    overflow. A launch then updates one score and the bounded list of the
+    TOP best hosts in place, however long the history is.
+
+    The log in $XDG_DATA_HOME/pysshmenu is only ever appended to, one line
+    of log weight and menu path per launch. Once it has more than twice as
+    many lines as hosts (plus COMPACT_SLACK), it is rewritten with one line
+    per host, dropping hosts that are no longer on the menu or were last used
+    more than FORGET seconds ago.
+    '''
+
+    HALF_LIFE = 7 * 86400
+    FORGET = 365 * 86400
+    TOP = 10
+    COMPACT_SLACK = 1000
+
+    def __init__(self, path=None):
         '''
-        Convert TreeView to list and overwrite the menu_item list in config
+        Takes
+            path (str): The usage log, in $XDG_DATA_HOME/pysshmenu by default
         '''
 
-        menu_items = self.get_menu_items(self.model.get_iter_first(), [])
-        self.config.menu_items = menu_items
+        if path is None:
+            data_home = (os.environ.get('XDG_DATA_HOME') or
+                         os.path.join(os.path.expanduser('~'), '.local', 'share'))
+            path = os.path.join(data_home, 'pysshmenu', 'usage.log')
+        self.path = path
+        self.enabled = False
+        self.config = None
+        self.scores = None
+        self.top = []
+        self.lines = 0
+
+    def configure(self, config):
+        '''
+        Enable or disable recording from the 'menus_frequent' global setting
 
-    def save_options(self, dialog):
+        Takes
+            config (Config): The configuration, used to find the menu path
+                             of the hosts
         '''
-        Save the selected options on the options pane to the config global
-        options
 
-        Takes:
-            dialog (Gtk.Dialog): The dialog associated with PreferencesDialog
+        self.enabled = config.get_global('menus_frequent')
+        self.config = config
+
+    @staticmethod
+    def weight(when):
+        '''Return the log weight of a launch at time when'''
+
+        return when * math.log(2) / UsageLog.HALF_LIFE
+
+    @staticmethod
+    def add(score, weight):
+        '''Return the log of exp(score) + exp(weight), score may be None'''
+
+        if score is None:
+            return weight
+        high, low = max(score, weight), min(score, weight)
+        return high + math.log1p(math.exp(low - high))
+
+    def load(self):
+        '''Read the scores from the log, compacting it if it grew too long'''
+
+        scores = {}
+        lines = 0
+        try:
+            fin = open(self.path, 'rb')
+            try:
+                for line in fin:
+                    try:
+                        weight, path = line.decode('utf-8').rstrip('\n').split(' ', 1)
+                        weight = float(weight)
+                    except (ValueError, UnicodeError):
+                        continue
+                    scores[path] = UsageLog.add(scores.get(path), weight)
+                    lines += 1
+            finally:
+                fin.close()
+        except IOError:
+            pass
+
+        self.scores = scores
+        self.lines = lines
+        self.top = heapq.nlargest(UsageLog.TOP,
+                                  [(score, path) for path, score in scores.items()])
+        if self.lines > 2 * len(self.scores) + UsageLog.COMPACT_SLACK:
+            self.compact()
+
+    def record(self, item):
         '''
+        Count a launch of a HostItem, if recording is enabled
 
-        (w, h) = dialog.get_size()
-        self.config.set_global('width', w)
-        self.config.set_global('height', h)
-        self.config.set_global('back_up_config', self.chk_back_up_config.get_active())
-        self.config.set_global('menus_open_all', self.chk_open_all.get_active())
-        self.config.set_global('menus_open_tabs', self.chk_open_tabs.get_active())
+        Takes
+            item (HostItem): The host that was opened
+        '''
 
-    def get_menu_items(self, treeiter, items):
+        if not self.enabled or self.config is None:
+            return
+        path = self.config.get_path(item)
+        if path is None:
+            return
+        path = as_text(path)
+        if self.scores is None:
+            self.load()
+
+        weight = UsageLog.weight(time.time())
+        self.append(path, weight)
+        score = UsageLog.add(self.scores.get(path), weight)
+        self.scores[path] = score
+        self.lines += 1
+
+        # Scores only grow, so only the launched host can enter the list
+        top = [entry for entry in self.top if entry[1] != path]
+        if len(top) < UsageLog.TOP or score > top[-1][0]:
+            top.append((score, path))
+            top.sort(reverse=True)
+            del top[UsageLog.TOP:]
+        self.top = top
+
+        if self.lines > 2 * len(self.scores) + UsageLog.COMPACT_SLACK:
+            self.compact()
+
+    def append(self, path, weight):
         '''
-        Recursively walk the TreeStore and produce a list of menu_items
-        mirroring its structure
+        Append a launch to the log. Failures are ignored.
 
         Takes
-            treeiter (Gtk.TreeIter): Iterator representing current node in
-                                     TreeStore
-            items (list [Item]): Accumulated list of items as you walk the
-                                 TreeStore
+            path (str): Menu path of the host
+            weight (float): Log weight of the launch
         '''
 
-        if treeiter:
-            item = self.model[treeiter][PreferencesDialog.ITEM_COLUMN]
-            if item.kind == Item.MENU:
-                child_iter = self.get_0th_child(treeiter)
-                item.items = self.get_menu_items(child_iter, [])
+        line = u'%.6f %s\n' % (weight, as_text(path).replace(u'\n', u' '))
+        if not isinstance(line, bytes):
+            line = line.encode('utf-8')
+        try:
+            directory = os.path.dirname(self.path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+
+    def compact(self):
+        '''Rewrite the log with one line per host that is still worth keeping'''
+
+        horizon = UsageLog.weight(time.time() - UsageLog.FORGET)
+        scores = {}
+        for path, score in self.scores.items():
+            if score >= horizon and (self.config is None or
+                                     self.config.get_item_by_path(path) is not None):
+                scores[path] = score
+
+        data = u''.join(u'%.6f %s\n' % (score, path.replace(u'\n', u' '))
+                        for path, score in scores.items())
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        try:
+            atomic_write(self.path, data)
+        except (IOError, OSError):
+            return
 
-            items.append(item)
-            return self.get_menu_items(self.model.iter_next(treeiter), items)
+        self.scores = scores
+        self.lines = len(scores)
+        self.top = heapq.nlargest(UsageLog.TOP,
+                                  [(score, path) for path, score in scores.items()])
 
-        return items
+    def frequent(self):
+        '''Return the menu paths of the TOP hosts opened most, best first'''
 
-    def build_dialog(self):
-        '''Build the PreferencesDialog'''
+        if self.scores is None:
+            self.load()
+        return [path for score, path in self.top]
 
-        dialog = Gtk.Dialog("Preferences",
-                            None,
-                            Gtk.DialogFlags.MODAL | Gtk.DialogFlags.DESTROY_WITH_PARENT,
-                            (Gtk.STOCK_OK, Gtk.ResponseType.ACCEPT,
-                             Gtk.STOCK_CANCEL, Gtk.ResponseType.REJECT))
 
-        dialog.set_position(Gtk.WindowPosition.MOUSE);
+usage = UsageLog()
 
-        width = self.config.get_global('width') or 370
-        height = self.config.get_global('height') or 360
-        dialog.resize(width,height)
 
-        notebook = Gtk.Notebook()
-        dialog.vbox.pack_start(notebook, True, True, 0)
+class Session():
+    '''A child process started through the ProcessSupervisor'''
 
-        notebook.append_page(self.make_hosts_pane(), Gtk.Label("Hosts"))
-        notebook.append_page(self.make_options_pane(), Gtk.Label("Options"))
-        notebook.append_page(self.make_about_pane(), Gtk.Label("About"))
+    def __init__(self, pid, title, process):
+        '''
+        Takes
+            pid (int): Process id of the child
+            title (str): What the child is, e.g. the title of the host
+            process (subprocess.Popen): The child process
+        '''
+        self.pid = pid
+        self.title = title
+        self.process = process
+        self.started = time.time()
+        self.status = None
 
-        dialog.show_all()
-        return dialog
+    def is_running(self):
+        '''Whether the child has not exited yet'''
 
-    def make_hosts_pane(self):
-        '''Create the pane in PreferencesDialog to view/edit Items'''
+        return self.process is not None
 
-        pane = Gtk.HBox(False, 12)
-        pane.set_border_width(8)
+    def describe(self):
+        '''Return a one line description for the sessions menu'''
 
-        list_box = Gtk.VBox(False, 8)
-        pane.pack_start(list_box, True, True, 0)
+        started = time.strftime('%H:%M:%S', time.localtime(self.started))
+        if self.is_running():
+            state = 'running'
+        elif self.status < 0:
+            state = 'killed by signal %d' % -self.status
+        else:
+            state = 'exited with %d' % self.status
+        return '%s (pid %d, %s, %s)' % (self.title, self.pid, started, state)
 
-        sw = Gtk.ScrolledWindow()
-        sw.set_shadow_type(Gtk.ShadowType.ETCHED_IN)
-        sw.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
-        list_box.pack_start(sw, True, True, 0)
 
-        hlist = self.make_hosts_list()
-        sw.add_with_viewport(hlist)
-        hlist.connect('row_activated', self.btn_edit_pressed)
+class ProcessSupervisor():
+    '''
+    Starts the child processes of the application and keeps track of them.
 
-        arrows = Gtk.HBox(True, 10)
-        list_box.pack_start(arrows, False, True, 0)
+    Children get /dev/null as stdin, stdout and stderr and inherit no other
+    file descriptors. spawn may be called from any thread. They are reaped
+    from the GLib main loop through GLib.child_watch_add, so the long running
+    indicator collects neither pipes nor zombies. Without GLib, in the command
+    line mode, children are left running and never reaped; the short lived
+    process exits first.
 
-        buttons = Gtk.VBox(False, 10)
-        pane.pack_start(buttons, True, True, 0)
+    The sessions are kept in start order: every child that is still running
+    and the most recent ones that exited, with their exit status.
+    '''
 
-        self.add_button(arrows, 'up', '', Gtk.STOCK_GO_UP, False)
-        self.add_button(arrows, 'down', '', Gtk.STOCK_GO_DOWN, False)
-        self.add_button(buttons, 'add', 'Add Host', None, True)
-        self.add_button(buttons, 'sep', 'Add Separator', None, True)
-        self.add_button(buttons, 'menu', 'Add Submenu', None, True)
-        self.add_button(buttons, 'edit', 'Edit', None, False)
-        self.add_button(buttons, 'copy', 'Copy Host', None, False)
-        self.add_button(buttons, 'del', 'Remove', None, False)
+    KEEP_FINISHED = 10
+
+    def __init__(self):
+        self.running = {}
+        self.finished = deque(maxlen=ProcessSupervisor.KEEP_FINISHED)
+        self.lock = threading.Lock()
+
+    def spawn(self, argv, title=None, on_exit=None):
+        '''
+        Start a child process and return its Session. Raises OSError if the
+        program cannot be started.
+
+        Takes
+            argv (list [str]): The command line to run
+            title (str): Name of the session, the program name by default
+            on_exit (callable): Called with the Session once the child exited
+        '''
+
+        started = metrics.start()
+        devnull = open(os.devnull, 'r+b')
+        try:
+            process = subprocess.Popen(argv, shell=False, stdin=devnull,
+                                       stdout=devnull, stderr=devnull,
+                                       close_fds=True)
+        finally:
+            devnull.close()
+        metrics.stop('spawn.popen', started)
+
+        session = Session(process.pid, title or argv[0], process)
+        self.lock.acquire()
+        self.running[session.pid] = session
+        self.lock.release()
+        if GLib is not None:
+            GLib.child_watch_add(GLib.PRIORITY_DEFAULT, session.pid,
+                                 self.on_child_exit, (session, on_exit))
+        return session
+
+    def on_child_exit(self, pid, status, data):
+        '''Called from the main loop when a child has been reaped'''
+
+        session, on_exit = data
+        if os.WIFSIGNALED(status):
+            session.status = -os.WTERMSIG(status)
+        else:
+            session.status = os.WEXITSTATUS(status)
+
+        # GLib already reaped the child, keep subprocess from trying again
+        session.process.returncode = session.status
+        session.process = None
+
+        self.lock.acquire()
+        self.running.pop(pid, None)
+        self.finished.append(session)
+        self.lock.release()
+        if on_exit:
+            on_exit(session)
+
+    def sessions(self):
+        '''Return all known Sessions, oldest first'''
+
+        self.lock.acquire()
+        sessions = list(self.running.values()) + list(self.finished)
+        self.lock.release()
+        return sorted(sessions, key=lambda session: session.started)
 
-        return pane
 
-    def make_options_pane(self):
-        '''Create the pane to view/edit the global options'''
+supervisor = ProcessSupervisor()
 
-        table = Gtk.Table(1, 1, False)
-        table.set_border_width(10)
-        r = 0
 
-        self.chk_back_up_config = Gtk.CheckButton('back up config file on save')
-        self.chk_back_up_config.set_active(self.config.get_global('back_up_config'))
-        table.attach(self.chk_back_up_config, 0, 1, r, r+1)
-        r += 1
+class AgentError(Exception):
+    '''Raised when the ssh-agent cannot be reached or refuses a request'''
 
-        self.chk_open_all = Gtk.CheckButton('include "Open all windows" selection')
-        self.chk_open_all.set_active(self.config.get_global('menus_open_all'))
-        table.attach(self.chk_open_all, 0, 1, r, r+1)
-        r += 1
 
-        self.chk_open_tabs = Gtk.CheckButton('include "Open all tabs" selection')
-        self.chk_open_tabs.set_active(self.config.get_global('menus_open_tabs'))
-        table.attach(self.chk_open_tabs, 0, 1, r, r+1)
+class SSHAgent():
+    '''
+    A minimal client for the ssh-agent protocol, spoken over the UNIX socket
+    in $SSH_AUTH_SOCK. Lists and removes identities without running ssh-add.
 
-        return table
+    The identities seen by the last request are cached for TTL seconds so
+    the menu can show the key status without asking the agent every time.
+    '''
 
-    def make_about_pane(self):
-        '''Create the pane to display version/copyright information'''
+    REQUEST_IDENTITIES = 11
+    IDENTITIES_ANSWER = 12
+    REMOVE_IDENTITY = 18
+    REMOVE_ALL_IDENTITIES = 19
+    FAILURE = 5
+    SUCCESS = 6
 
-        pane = Gtk.VBox(False, 12)
-        panel = Gtk.VBox(False, 12)
+    TIMEOUT = 2.0
+    TTL = 5.0
 
-        title = Gtk.Label()
-        title.set_markup("<span font_desc='sans bold 36'>pySSHMenu</span>");
-        title.set_selectable(True)
+    def __init__(self, path=None):
+        '''
+        Takes
+            path (str): The agent socket, $SSH_AUTH_SOCK by default
+        '''
 
-        version = Gtk.Label()
-        version.set_markup("<span font_desc='sans 24'>Version: %s</span>" % self.app.VERSION);
-        version.set_selectable(True)
+        self.path = path
+        self.keys = None
+        self.checked = 0
 
-        author = Gtk.Label()
-        detail = '(c) 2012 Travis Patterson &lt;masslessparticle@gmail.com&gt;'
-        author.set_markup("  <span font_desc='sans 10'>%s</span>  " % detail);
-        author.set_selectable(True)
+    def socket_path(self):
+        '''Return the path of the agent socket. Raises AgentError if unusable'''
 
-        attrib = Gtk.Label()
-        attr_detail = 'Based on SSHMenu by Grant McLean &lt;grant@mclean.net.nz&gt;\n\n'
-        attr_detail += 'This attribution is not an endorsement by the author of\n'
-        attr_detail += 'or contributors to SSHMenu'
-        attrib.set_markup("<span font_desc='sans 10'>%s</span>" % attr_detail)
-        attrib.set_selectable(True)
+        path = self.path or os.environ.get('SSH_AUTH_SOCK')
+        if not path:
+            raise AgentError("$SSH_AUTH_SOCK is not set.\n"
+                             "Is the ssh-agent running?")
+        if not os.path.exists(path):
+            raise AgentError("$SSH_AUTH_SOCK points to " + path +
+                             ",\n but it does not exist!")
+        return path
 
-        def open_homepage(window, sender, url):
-            webbrowser.open(url)
+    def request(self, kind, payload=b''):
+        '''
+        Send one message to the agent and return the type and payload of the
+        reply
 
-        def on_realize(window):
-            hand = Gdk.Cursor(Gdk.CursorType.HAND2)
-            window.get_parent_window().set_cursor(hand)
+        Takes
+            kind (int): The message type
+            payload (bytes): The message contents
+        '''
 
-        site_box = Gtk.EventBox()
-        site_box.connect('button-press-event', open_homepage, self.app.SITE_URL)
-        site_box.connect('realize', on_realize)
-        site_link = Gtk.Label()
-        site_link.set_markup("<span font_desc='sans 10' foreground='#0000FF' " +
-                        "underline='single'>%s</span>" % self.app.SITE_URL)
-        site_box.add(site_link)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(SSHAgent.TIMEOUT)
+        try:
+            sock.connect(self.socket_path())
+            sock.sendall(struct.pack('>IB', len(payload) + 1, kind) + payload)
+            length = struct.unpack('>I', self.receive(sock, 4))[0]
+            reply = self.receive(sock, length)
+        except (socket.error, struct.error) as e:
+            raise AgentError("Unable to talk to the ssh-agent:\n%s" % e)
+        finally:
+            sock.close()
+
+        if not reply:
+            raise AgentError("The ssh-agent sent an empty reply")
+        return ord(reply[0:1]), reply[1:]
 
-        attr_box = Gtk.EventBox()
-        attr_box.connect('button-press-event', open_homepage, self.app.ATTR_URL)
-        attr_box.connect('realize', on_realize)
-        attr_link = Gtk.Label()
-        attr_link.set_markup("<span font_desc='sans 10' foreground='#0000FF' " +
-                        "underline='single'>%s</span>" % self.app.ATTR_URL);
-        attr_box.add(attr_link)
+    @staticmethod
+    def receive(sock, size):
+        '''Read exactly size bytes from a socket'''
+
+        chunks = []
+        while size > 0:
+            chunk = sock.recv(min(size, 65536))
+            if not chunk:
+                raise AgentError("The ssh-agent closed the connection")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
 
-        panel.pack_start(title, False, False, 0)
-        panel.pack_start(version, False, False, 0)
-        panel.pack_start(author, False, False, 10)
-        panel.pack_start(site_box, False, False, 0)
-        panel.pack_start(attrib, False, False, 10)
-        panel.pack_start(attr_box, False, False, 0)
-        pane.pack_start(panel, True, False, 10)
-        return pane
+    @staticmethod
+    def pack_string(data):
+        '''Encode bytes as an SSH string'''
 
-    def make_hosts_list(self):
-        '''Create the TreeStore/TreeView that displays the menu information'''
+        return struct.pack('>I', len(data)) + data
 
-        def renderer_func(column, cell_renderer, model, iterator, data):
-            item = model.get_value(iterator, 0)
-            cell_renderer.set_property("text", item.display)
+    @staticmethod
+    def unpack_string(data, offset):
+        '''Decode the SSH string at offset. Returns it and the next offset'''
 
-        self.model = Gtk.TreeStore(object)
+        length = struct.unpack_from('>I', data, offset)[0]
+        start = offset + 4
+        if start + length > len(data):
+            raise AgentError("The ssh-agent sent a truncated reply")
+        return data[start:start + length], start + length
 
-        self.view = Gtk.TreeView(self.model)
-        self.view.set_rules_hint(False)
-        self.view.set_search_column(0)
+    def identities(self, refresh=False):
+        '''
+        Return the identities held by the agent as a list of (key blob,
+        comment). The cached list is used unless it is older than TTL.
 
-        if GLib.glib_version >= (1, 19, 0): #@UndefinedVariable
-            self.view.set_reorderable(True)
+        Takes
+            refresh (bool): Ask the agent even if the cache is fresh
+        '''
 
-        renderer = Gtk.CellRendererText()
-        column = Gtk.TreeViewColumn("Host", renderer)
-        column.set_cell_data_func(renderer, renderer_func)
-        self.view.append_column(column)
+        if (not refresh and self.keys is not None and
+                time.time() - self.checked < SSHAgent.TTL):
+            return self.keys
 
-        selection = self.view.get_selection()
-        selection.connect('changed', self.on_selection_changed)
-        self.add_items(self.model.get_iter_first(), self.config.menu_items)
-        return self.view
+        kind, reply = self.request(SSHAgent.REQUEST_IDENTITIES)
+        if kind != SSHAgent.IDENTITIES_ANSWER:
+            raise AgentError("The ssh-agent refused to list the keys")
 
-    def add_items(self, treeiter, items):
+        try:
+            count = struct.unpack_from('>I', reply)[0]
+            keys = []
+            offset = 4
+            for i in range(count):
+                blob, offset = self.unpack_string(reply, offset)
+                comment, offset = self.unpack_string(reply, offset)
+                keys.append((blob, comment.decode('utf-8', 'replace')))
+        except struct.error:
+            raise AgentError("The ssh-agent sent a truncated reply")
+
+        self.keys = keys
+        self.checked = time.time()
+        return keys
+
+    def remove(self, blob):
         '''
-        Recursively add Items to the TreeStore
+        Remove one identity from the agent
 
         Takes
-            treeiter (Gtk.TreeIter): The parent node to add Items to
-            items (list [Item]): Items to add to TreeStore
+            blob (bytes): The public key blob, as returned by identities
         '''
 
-        for item in items:
-            if item.kind == Item.MENU:
-                menu_iter = self.model.append(treeiter, [item])
-                self.add_items(menu_iter, item.items)
-            else:
-                if item.show_in_tree:
-                    self.model.append(treeiter, [item])
+        self.simple_request(SSHAgent.REMOVE_IDENTITY, self.pack_string(blob))
 
-    def add_button(self, box, key, label, stock_id, sensitive):
+    def remove_all(self):
+        '''Remove all identities from the agent'''
+
+        self.simple_request(SSHAgent.REMOVE_ALL_IDENTITIES)
+
+    def simple_request(self, kind, payload=b''):
+        '''Send a request that is answered with SUCCESS or FAILURE'''
+
+        self.keys = None
+        reply, data = self.request(kind, payload)
+        if reply != SSHAgent.SUCCESS:
+            raise AgentError("The ssh-agent refused to remove the key")
+
+
+class Multiplexer():
+    '''
+    Shares one SSH connection per host between sessions with OpenSSH's
+    ControlMaster. When enabled, every ssh command gets ControlMaster=auto,
+    a ControlPath in a private directory and ControlPersist, so the first
+    session to a host becomes the master and later ones skip the TCP, key
+    exchange and authentication round trips.
+
+    Masters can be started ahead of time with prewarm, listed with masters
+    and shut down with close.
+    '''
+
+    # Seconds a prewarming ssh may take to connect and authenticate
+    CONNECT_TIMEOUT = 10
+
+    def __init__(self):
+        self.persist = None
+        self.concurrency = 8
+        self.rate = 20
+
+    def configure(self, config):
         '''
-        Add a button to the given widget
+        Enable or disable multiplexing from the 'ssh_multiplex' and
+        'ssh_control_persist' global settings. prewarm is limited like
+        "Open all" by 'open_all_concurrency' and 'open_all_rate'.
 
         Takes
-            box (Gtk.Widget): Widget to add button to
-            key (str): Dictionary key to retrieve button later
-            label (str): Button label
-            stock_id (int): Gtk stock button id or None
-            sensitive (bool): Whether button is enabled
+            config (Config): The configuration
         '''
 
-        button = None
-        if stock_id:
-            button = Gtk.Button(stock=stock_id)
+        if config.get_global('ssh_multiplex') and self.directory():
+            self.persist = config.get_setting('ssh_control_persist', 600)
         else:
-            button = Gtk.Button(label)
+            self.persist = None
+        self.concurrency = config.get_setting('open_all_concurrency', 8)
+        self.rate = config.get_setting('open_all_rate', 20)
 
-        self.button[key] = button
-        button_action = getattr(self, 'btn_%s_pressed' % key)
-        button.connect('clicked', button_action)
-        button.set_focus_on_click(False)
-        button.set_sensitive(sensitive)
-        box.pack_start(button, True, True, 0)
+    def enabled(self):
+        '''Whether ssh commands are multiplexed'''
 
-    def initialize_buttons(self, model, treeiter):
-        '''
-        Enable or disable the buttons on the TreeView based on what kind of Item
-        and where in the TreeView and Item is.
+        return self.persist is not None
 
-        Takes:
-            model (Gtk.TreeStore): The datamodel for this TreeView
-            treeiter (Gtk.TreeIter): The Gtk.TreeIter for the selected node
+    def directory(self):
+        '''
+        Return the directory holding the control sockets, creating it if
+        needed, or None if there is no directory only the user can access
         '''
 
-        if treeiter:
-            selected = model[treeiter][PreferencesDialog.ITEM_COLUMN]
-
-            if selected.kind == Item.HOST:
-                self.button['edit'].set_sensitive(True)
-                self.button['copy'].set_sensitive(True)
-                self.button['del'].set_sensitive(True)
-            elif selected.kind == Item.MENU:
-                self.button['edit'].set_sensitive(True)
-                self.button['copy'].set_sensitive(False)
-                self.button['del'].set_sensitive(not selected.has_items())
-            elif selected.kind == Item.SEPARATOR:
-                self.button['edit'].set_sensitive(False)
-                self.button['copy'].set_sensitive(False)
-                self.button['del'].set_sensitive(True)
-
-            iter_next = model.iter_next(treeiter)
-            if iter_next:
-                self.button['down'].set_sensitive(True)
-            else:
-                self.button['down'].set_sensitive(False)
+        return private_directory('sshmenu-cm')
 
-            parent = model.iter_parent(treeiter)
-            first = self.get_0th_child(parent)
+    def options(self):
+        '''
+        Return the ssh arguments that turn on multiplexing, if enabled.
+        Multiplexing is turned off if the directory is no longer usable.
+        '''
 
-            first_item = model[first][PreferencesDialog.ITEM_COLUMN]
-            current_item = model[treeiter][PreferencesDialog.ITEM_COLUMN]
-            if first_item == current_item:
-                self.button['up'].set_sensitive(False)
-            else:
-                self.button['up'].set_sensitive(True)
+        if self.persist is None:
+            return []
+
+        directory = self.directory()
+        if directory is None:
+            self.persist = None
+            return []
+        control_path = os.path.join(directory, '%r@%h:%p')
+        return ['-o', 'ControlMaster=auto',
+                '-o', 'ControlPath=' + control_path,
+                '-o', 'ControlPersist=%d' % self.persist]
 
-    def get_0th_child(self, parent):
+    def prewarm(self, hosts, on_done=None):
         '''
-        Return the 0th child of the given parent
+        Start master connections for hosts in the background through a
+        FanOut, so only so many connect at a time. Hosts that already have
+        one are left alone. Authentication must not need a password, as
+        there is no terminal to ask for it.
 
         Takes
-            parent (Gtk.TreeIter): Node to find 0th child
+            hosts (list [HostItem]): The hosts to connect to
+            on_done (callable): Called from the main loop once all hosts have
+                                been tried, with a list of (title, message)
+                                for each host that failed
         '''
-        if parent:
-            return self.model.iter_nth_child(parent, 0)
-        else:
-            return self.model.get_iter_first()
 
-    def get_position(self, treeiter):
+        options = self.options() + ['-o', 'BatchMode=yes', '-o',
+                                    'ConnectTimeout=%d' % Multiplexer.CONNECT_TIMEOUT]
+        jobs = []
+        failures = []
+        for host in hosts:
+            # Becomes the master, or rides on the existing one, runs 'true'
+            # and leaves the master behind thanks to ControlPersist
+            try:
+                jobs.append((host.display, ['ssh'] + options +
+                             shlex.split(host.get_ssh_params()) + ['true']))
+            except ValueError as e:
+                failures.append((host.display, str(e)))
+
+        # Done once every ssh exited, or could not be started at all
+        pending = [len(jobs)]
+
+        def finish():
+            if pending[0] == 0:
+                pending[0] = -1
+                if on_done:
+                    on_done(failures)
+
+        def on_exit(session):
+            if session.status != 0:
+                failures.append((session.title, 'ssh exited with %d' %
+                                                session.status))
+            pending[0] -= 1
+            finish()
+
+        def on_started(fan_out):
+            failures.extend(fan_out.failures)
+            pending[0] -= len(fan_out.failures)
+            finish()
+
+        # A slot is held until the ssh exits, as connecting is the work
+        FanOut(jobs, self.concurrency, self.rate, on_done=on_started,
+               on_exit=on_exit, settle=Multiplexer.CONNECT_TIMEOUT * 2).start()
+
+    def masters(self):
         '''
-        Get the position in the TreeView of the given treeiter
-
-        Takes
-            treeiter (Gtk.TreeIter): Gtk.TreeIter of the node whose position to
-                                     get
+        Return a sorted list of (name, control path) for the live master
+        connections. Sockets left behind by dead masters are removed.
         '''
 
-        if treeiter:
-            parent = self.model.iter_parent(treeiter)
-        else:
-            parent = self.model.get_iter_first()
-            treeiter = parent
-
-        first = self.get_0th_child(parent)
-        iter_next = first
-        position = 0
-
-        while iter_next:
-            next_item = self.model[iter_next][PreferencesDialog.ITEM_COLUMN]
-            current_item = self.model[treeiter][PreferencesDialog.ITEM_COLUMN]
-            if next_item == current_item:
-                return parent, position
-            else:
-                iter_next = self.model.iter_next(iter_next)
-                position += 1
+        path = self.directory()
+        if path is None:
+            return []
 
-    def add_new(self, model, treeiter, item):
+        masters = []
+        for name in os.listdir(path):
+            control_path = os.path.join(path, name)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(control_path)
+            except socket.error as e:
+                if e.errno == errno.ECONNREFUSED:
+                    try:
+                        os.unlink(control_path)
+                    except OSError:
+                        pass
+                continue
+            finally:
+                sock.close()
+            masters.append((name, control_path))
+        return sorted(masters)
+
+    def close(self, control_path):
         '''
-        Add a new node to the TreeStore/TreeView
+        Ask a master connection to exit. Sessions using it are closed too.
 
-        takes
-            model (Gtk.TreeStore): Model to add the item to
-            treeiter (Gtk.TreeIter): Parent node item will be added to
-            item (Item): The Item to add to the Model
+        Takes
+            control_path (str): The control socket of the master
         '''
 
-        if treeiter:
-            current_item = model[treeiter][PreferencesDialog.ITEM_COLUMN]
-            if current_item.kind != Item.MENU:
-                treeiter = model.iter_parent(treeiter)
-        self.add_items(treeiter, [item])
+        supervisor.spawn(['ssh', '-S', control_path, '-O', 'exit', 'master'],
+                         'close ' + os.path.basename(control_path))
 
 
-    def on_selection_changed(self, sender):
-        '''Fired when the selection in the TreeView changes'''
+multiplexer = Multiplexer()
 
-        model, treeiter = sender.get_selected()
-        self.initialize_buttons(model, treeiter)
 
-    def btn_up_pressed(self, sender):
-        '''Fired when the 'up' Button is pressed'''
+class ControlServer():
+    '''
+    Local API of the running indicator on a UNIX socket, in a directory only
+    the user can access. Connections from processes of other users are
+    refused after an SO_PEERCRED check. Requests and responses are JSON
+    objects, one per line:
+
+        {"command": "list"}
+        {"command": "query", "text": "db prod", "limit": 20}
+        {"command": "connect", "host": "prod/db1"}
+        {"command": "open_all", "menu": "prod", "tabs": true}
+        {"command": "quick_connect"}
+        {"command": "ping"}
+
+    Hosts are given by menu path or else title, the top level menu by "".
+    Responses carry "ok" and the "hosts" concerned, or an "error".
+
+    The sockets are served from the GLib main loop, so requests work on the
+    Config, the host index and the menu actions of the App directly.
+    '''
 
-        model, treeiter = self.view.get_selection().get_selected()
-        parent = model.iter_parent(treeiter)
-        first = self.get_0th_child(parent)
+    # Longest request line accepted
+    MAX_REQUEST = 65536
+    # Seconds a client gets to take a response
+    TIMEOUT = 5
+    # From <asm-generic/socket.h>, Python 2 does not define it
+    SO_PEERCRED = getattr(socket, 'SO_PEERCRED', 17)
 
-        last = first
-        iter_next = model.iter_next(first)
-        while iter_next:
-            next_item = model[iter_next][PreferencesDialog.ITEM_COLUMN]
-            current_item = model[treeiter][PreferencesDialog.ITEM_COLUMN]
+    COMMANDS = ('list', 'query', 'connect', 'open_all', 'quick_connect', 'ping')
 
-            if next_item == current_item:
-                break
-            else:
-                last = iter_next
-                iter_next = model.iter_next(iter_next)
+    def __init__(self, app):
+        '''
+        Takes
+            app (App): The application requests are served from
+        '''
 
-        model.swap(treeiter, last)
-        self.initialize_buttons(model, treeiter)
+        self.app = app
+        self.server = None
+        self.path = None
+        self.inode = None
+        self.clients = {}
 
-    def btn_down_pressed(self, sender):
-        '''Fired when the 'down' Button is pressed'''
+    @staticmethod
+    def socket_path():
+        '''Return the path of the control socket, or None if there is none'''
 
-        model, treeiter = self.view.get_selection().get_selected()
-        iter_next = model.iter_next(treeiter)
-        if iter_next:
-            model.swap(treeiter, iter_next)
-            self.initialize_buttons(model, treeiter)
+        directory = private_directory('sshmenu')
+        if directory is None:
+            return None
+        return os.path.join(directory, 'control')
 
-    def btn_add_pressed(self, sender):
-        '''Fired when the 'add host' Button is pressed'''
+    def start(self):
+        '''
+        Listen on the control socket. Returns False if there is no private
+        directory for it or another instance is listening.
+        '''
 
-        dialog = HostDialog(HostItem(""), self.config)
-        item = dialog.invoke()
-        if item:
-            model, treeiter = self.view.get_selection().get_selected()
-            self.add_new(model, treeiter, item)
+        path = ControlServer.socket_path()
+        if path is None:
+            return False
 
-    def btn_menu_pressed(self, sender):
-        '''Fired when the 'add menu' Button is pressed'''
-        dialog = SubmenuDialog(MenuItem(""))
-        item = dialog.invoke()
-        if item:
-            model, treeiter = self.view.get_selection().get_selected()
-            self.add_new(model, treeiter, item)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            try:
+                server.bind(path)
+            except socket.error as e:
+                if e.errno != errno.EADDRINUSE:
+                    raise
+                if not ControlServer.abandoned(path):
+                    server.close()
+                    return False
+                os.unlink(path)
+                server.bind(path)
+            server.listen(16)
+            self.inode = os.stat(path).st_ino
+        except (socket.error, OSError):
+            server.close()
+            return False
 
-    def btn_sep_pressed(self, sender):
-        '''Fired when the 'add separator' Button is pressed'''
+        server.setblocking(False)
+        self.server = server
+        self.path = path
+        GLib.io_add_watch(server.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN,
+                          self.on_accept)
+        return True
 
-        item = SeparatorItem()
-        parent = None
-        position = 0
-        model, treeiter = self.view.get_selection().get_selected()
+    @staticmethod
+    def abandoned(path):
+        '''Whether a socket was left behind by an instance that died'''
 
-        if treeiter:
-            parent = treeiter
-            selected_item = model[treeiter][PreferencesDialog.ITEM_COLUMN]
-            if selected_item.kind != Item.MENU:
-                parent, position = self.get_position(treeiter)
-                position += 1
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            return False
+        except socket.error as e:
+            return e.errno == errno.ECONNREFUSED
+        finally:
+            probe.close()
+
+    def stop(self):
+        '''Close the control socket and remove it, unless it was replaced'''
+
+        if self.server is None:
+            return
+        self.server.close()
+        self.server = None
+        try:
+            if os.stat(self.path).st_ino == self.inode:
+                os.unlink(self.path)
+        except OSError:
+            pass
 
-        model.insert(parent, position, [item])
+    def on_accept(self, fd, condition):
+        '''Fired from the main loop when a client connects'''
 
-    def btn_edit_pressed(self, sender):
-        '''Fired when the 'edit' Button is pressed'''
+        if self.server is None:
+            return False
+        try:
+            conn = self.server.accept()[0]
+        except socket.error:
+            return True
 
-        model, treeiter = self.view.get_selection().get_selected()
-        if treeiter:
-            selected_item = model[treeiter][PreferencesDialog.ITEM_COLUMN]
-            if selected_item.kind == Item.HOST:
-                dialog = HostDialog(selected_item, self.config)
-            else:
-                dialog = SubmenuDialog(selected_item)
+        if not ControlServer.peer_allowed(conn):
+            conn.close()
+            return True
 
-            item = dialog.invoke()
-            if item:
-                parent, position = self.get_position(treeiter)
-                model.remove(treeiter)
-                model.insert(parent, position, [item])
-                if selected_item.kind == Item.MENU:
-                    menu_iter = model.iter_nth_child(parent, position)
-                    self.add_items(menu_iter, selected_item.items)
+        conn.setblocking(False)
+        self.clients[conn.fileno()] = [conn, b'']
+        GLib.io_add_watch(conn.fileno(), GLib.PRIORITY_DEFAULT,
+                          GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR,
+                          self.on_readable)
+        return True
 
-    def btn_copy_pressed(self, sender):
-        '''Fired when the 'copy' Button is pressed'''
+    @staticmethod
+    def peer_allowed(conn):
+        '''Whether the process at the other end belongs to the same user'''
 
-        model, treeiter = self.view.get_selection().get_selected()
-        if treeiter:
-            item = model[treeiter][PreferencesDialog.ITEM_COLUMN]
-            new_item = copy.deepcopy(item)
+        size = struct.calcsize('3i')
+        try:
+            credentials = conn.getsockopt(socket.SOL_SOCKET,
+                                          ControlServer.SO_PEERCRED, size)
+            pid, uid, gid = struct.unpack('3i', credentials)
+        except (socket.error, struct.error):
+            return False
+        return uid == os.getuid()
 
-            dialog = HostDialog(new_item, self.config)
-            new_item = dialog.invoke()
+    def on_readable(self, fd, condition):
+        '''Fired from the main loop when a client sent data or went away'''
 
-            if new_item:
-                parent, position = self.get_position(treeiter)
-                model.insert(parent, position + 1, [new_item])
+        conn, buffer = self.clients[fd]
+        try:
+            data = conn.recv(ControlServer.MAX_REQUEST)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return True
+            data = b''
 
-    def btn_del_pressed(self, sender):
-        '''Fired when the 'delete' Button is pressed'''
+        if not data:
+            self.close(fd)
+            return False
 
-        model, treeiter = self.view.get_selection().get_selected()
-        if treeiter:
-            item = self.model[treeiter][PreferencesDialog.ITEM_COLUMN]
-            parent = self.model.iter_parent(treeiter)
+        buffer += data
+        while b'\n' in buffer:
+            line, buffer = buffer.split(b'\n', 1)
+            try:
+                response = self.handle(line)
+            except Exception:
+                # An escaping exception would drop the watch, not the client
+                self.close(fd)
+                return False
+            if not self.send(conn, response):
+                self.close(fd)
+                return False
+
+        if len(buffer) > ControlServer.MAX_REQUEST:
+            self.close(fd)
+            return False
+        self.clients[fd][1] = buffer
+        return True
+
+    def close(self, fd):
+        '''Forget a client and close its connection'''
+
+        conn = self.clients.pop(fd)[0]
+        conn.close()
+
+    def send(self, conn, response):
+        '''Send a response, returns False if the client did not take it'''
+
+        import json
+        data = (json.dumps(response) + '\n').encode('utf-8')
+        conn.settimeout(ControlServer.TIMEOUT)
+        try:
+            conn.sendall(data)
+            return True
+        except socket.error:
+            return False
+        finally:
+            conn.setblocking(False)
+
+    def handle(self, line):
+        '''
+        Run one request and return the response
+
+        Takes
+            line (str): The request, a JSON object
+        '''
+
+        import json
+        try:
+            request = json.loads(line.decode('utf-8'))
+            command = request['command']
+        except (ValueError, KeyError, TypeError):
+            return {'ok': False, 'error': 'malformed request'}
 
-            if parent:
-                parentitem = self.model[parent][PreferencesDialog.ITEM_COLUMN]
-                if parentitem.kind == Item.MENU:
-                    if item in parentitem.items:
-                        parentitem.items.remove(item)
+        if command not in ControlServer.COMMANDS:
+            return {'ok': False, 'error': 'unknown command %s' % command}
+        try:
+            return getattr(self, 'do_' + command)(request)
+        except (KeyError, TypeError, ValueError) as e:
+            return {'ok': False, 'error': 'bad %s request: %s' % (command, e)}
 
-            model.remove(treeiter)
+    def describe(self, items):
+        '''Return the response listing the given HostItems'''
 
+        config = self.app.config
+        return {'ok': True,
+                'hosts': [HostCache.describe(HostCache.row(item, config.get_path(item)))
+                          for item in items]}
 
-class HostDialog():
-    '''
-    Implements the dialog for editing a HostItem. Once the HostDialog object has
-    been constructed, its invoke method is called to display the dialog.  When
-    the user dismisses the dialog, the invoke method will return None on cancel
-    or the edited host item on OK.
-    '''
+    def find(self, name, kind):
+        '''Return the Item of the given kind with a menu path or title, or None'''
 
-    TESTRESPONSE = 42
+        config = self.app.config
+        item = config.get_item_by_path(name) or config.get_item(name)
+        if item is None or item.kind != kind:
+            return None
+        return item
 
-    def __init__(self, item, config):
+    @staticmethod
+    def text_field(request, name, default=None):
         '''
-        Takes
-            item (HostItem): The HostItem to fill in
-            config (Config): The config object associated with this application
+        Return a string field of a request. Raises KeyError if it is missing
+        and has no default, ValueError if it is not a string.
         '''
-        self.host = item
-        self.config = config
 
-    def invoke(self):
-        '''Invoke the HostDialog'''
+        value = request.get(name, default) if default is not None else request[name]
+        if not isinstance(value, (str, type(u''))):
+            raise ValueError('%s must be a string' % name)
+        return value
+
+    def do_list(self, request):
+        return self.describe(item for item in self.app.config.walk()
+                             if item.kind == Item.HOST)
+
+    def do_query(self, request):
+        text = ControlServer.text_field(request, 'text')
+        limit = int(request.get('limit', 20))
+        return self.describe(self.app.get_host_index().search(text, limit))
+
+    def do_connect(self, request):
+        name = ControlServer.text_field(request, 'host')
+        item = self.find(name, Item.HOST)
+        if item is None:
+            return {'ok': False, 'error': 'no host %s' % name}
+        item.action(None, item)
+        return self.describe([item])
+
+    def do_open_all(self, request):
+        name = ControlServer.text_field(request, 'menu', '')
+        if name:
+            menu_item = self.find(name, Item.MENU)
+            if menu_item is None:
+                return {'ok': False, 'error': 'no submenu %s' % name}
+        else:
+            menu_item = MenuItem('SSH', self.app.config.all_items())
 
-        dialog = self.build_dialog()
+        if request.get('tabs'):
+            self.app.open_all_tabs(None, menu_item)
+        else:
+            self.app.open_all_windows(None, menu_item)
+        return self.describe(item for item in menu_item.items
+                             if item.kind == Item.HOST)
 
-        while True:
-            response = dialog.run()
-            if response == Gtk.ResponseType.ACCEPT:
-                if self.inputs_valid():
-                    self.dialog_to_host(self.host)
-                    dialog.destroy()
-                    return self.host
-            elif response == HostDialog.TESTRESPONSE:
-                self.test_host()
-            else:
-                break
+    def do_quick_connect(self, request):
+        self.app.quick_connect.invoke()
+        return {'ok': True}
 
-        dialog.destroy()
+    def do_ping(self, request):
+        return {'ok': True}
 
-    def inputs_valid(self):
-        '''Check HostDialog inputs for valadidity'''
 
-        if len(self.title_entry.get_text().strip()) == 0:
-            ErrorDialog("You must enter a title")
-            return False
-        elif len(self.params_entry.get_text().strip()) == 0:
-            ErrorDialog("You must enter a hostname")
-            return False
-        else:
-            return True
+class ControlClient():
+    '''Sends requests to the ControlServer of a running indicator'''
 
-    def dialog_to_host(self, host=None):
-        '''Dump the infromation from the HostDialog into the HostItem'''
-        if host == None:
-            host = HostItem(self.title_entry.get_text())
-        else:
-            host.display = self.title_entry.get_text()
+    TIMEOUT = 5
 
-        host.ssh_params = self.params_entry.get_text()
-        host.geometry = self.geometry_entry.get_text()
-        host.enable_bcvi = True if self.config.have_bcvi() else False
-        host.profile = self.profile_entry.get_active_text()
-        host.action = host.create_action()
-        return host
+    def __init__(self, path=None):
+        '''
+        Takes
+            path (str): The control socket, ControlServer.socket_path() by
+                        default
+        '''
 
-    def test_host(self):
-        '''Run the HostItem's action'''
+        self.path = path or ControlServer.socket_path()
 
-        host = self.dialog_to_host()
-        host.action(None, None)
+    def request(self, request):
+        '''
+        Send a request and return the response, or None if no indicator is
+        listening
 
-    def build_dialog(self):
-        '''Build the dialog associated with the HostDialog'''
+        Takes
+            request (dict): The request, see ControlServer
+        '''
 
-        dialog = Gtk.Dialog("Host Connection details",
-                            None,
-                            Gtk.DialogFlags.MODAL | Gtk.DialogFlags.DESTROY_WITH_PARENT,
-                            ('Test', HostDialog.TESTRESPONSE,
-                             Gtk.STOCK_OK, Gtk.ResponseType.ACCEPT,
-                             Gtk.STOCK_CANCEL, Gtk.ResponseType.REJECT))
+        import json
+        if self.path is None:
+            return None
 
-        dialog.set_default_response(Gtk.ResponseType.ACCEPT)
-        dialog.set_position(Gtk.WindowPosition.MOUSE)
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.settimeout(ControlClient.TIMEOUT)
+        try:
+            conn.connect(self.path)
+            conn.sendall((json.dumps(request) + '\n').encode('utf-8'))
+            chunks = []
+            while True:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                if b'\n' in chunk:
+                    break
+            response = b''.join(chunks).split(b'\n', 1)[0]
+            return json.loads(response.decode('utf-8'))
+        except (socket.error, ValueError):
+            return None
+        finally:
+            conn.close()
+
+
+class FanOut():
+    '''
+    Starts a batch of programs from worker threads so the main loop stays
+    responsive while many terminals open.
 
-        self.body = Gtk.VBox(False, 0)
-        self.body.set_border_width(4)
-        dialog.vbox.add(self.body)
+    At most 'concurrency' launches are in flight at a time. A launch is in
+    flight until its process exits or SETTLE seconds have passed, whichever
+    comes first, so a terminal server is not flooded with requests. Launches
+    are also spaced out so no more than 'rate' start per second.
 
-        self.add_title_input()
-        self.add_hostname_input()
-        self.add_geometry_input()
-        self.add_profile_input()
-        self.add_other_inputs()
+    on_progress and on_done are called from the main loop with the FanOut,
+    on_exit with the Session of each program that exits.
+    '''
 
-        dialog.show_all()
-        return dialog
+    SETTLE = 2.0
 
-    def add_title_input(self):
-        '''Add a 'title' text input to the HostDialog'''
-        self.title_entry = self.add_input('Title', self.host.display)
+    def __init__(self, jobs, concurrency=8, rate=20, on_progress=None,
+                 on_done=None, on_exit=None, settle=None):
+        '''
+        Takes
+            jobs (list [(str, list [str])]): Title and command line of each
+                                             program to start
+            concurrency (int): Maximum number of launches in flight
+            rate (float): Maximum number of launches per second, 0 for no
+                          limit
+            on_progress (callable): Called after each launch
+            on_done (callable): Called once all workers have finished
+            on_exit (callable): Called when a program exits
+            settle (float): Seconds a launch stays in flight unless its
+                            program exits first, SETTLE by default
+        '''
 
-    def add_hostname_input(self):
-        '''Add a 'hostname' text input to the HostDialog'''
-        self.params_entry = self.add_input('Hostname (etc)', self.host.ssh_params)
+        self.jobs = deque(jobs)
+        self.total = len(self.jobs)
+        self.done = 0
+        self.failures = []
+        self.concurrency = max(1, int(concurrency))
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_start = 0
+        self.workers = 0
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.on_exit = on_exit
+        self.settle = FanOut.SETTLE if settle is None else settle
+
+    def start(self):
+        '''Start the worker threads'''
+
+        self.workers = min(self.concurrency, len(self.jobs))
+        if self.workers == 0:
+            GLib.idle_add(self.finish)
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+
+    def cancel(self):
+        '''Stop starting new programs. Launches in flight are not undone'''
+
+        self.cancelled.set()
+
+    def next_job(self):
+        '''Return the next job and how long to wait before starting it'''
+
+        self.lock.acquire()
+        try:
+            if self.cancelled.is_set() or not self.jobs:
+                return None, 0
+            now = time.time()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+            return self.jobs.popleft(), start - now
+        finally:
+            self.lock.release()
+
+    def work(self):
+        '''Body of a worker thread'''
 
-    def add_geometry_input(self):
-        '''Add a 'geometry' text/button input to the HostDialog'''
-        box = Gtk.HBox(False, 4)
+        while True:
+            job, delay = self.next_job()
+            if job is None or (delay > 0 and self.cancelled.wait(delay)):
+                break
 
-        self.geometry_entry = Gtk.Entry()
-        self.geometry_entry.set_text(self.host.geometry)
-        self.geometry_entry.set_activates_default(True)
-        box.pack_start(self.geometry_entry, True, True, 0)
+            title, argv = job
+            exited = threading.Event()
+            try:
+                # Bind this job's event, the terminal may outlive the loop
+                supervisor.spawn(argv, title,
+                                 lambda session, exited=exited:
+                                     self.exited(session, exited))
+            except OSError as e:
+                self.failures.append((title, e.strerror))
+            else:
+                exited.wait(self.settle)
 
-        def grab_clicked(sender):
-            self.geometry_entry.set_text(GeoGrabber.grab())
+            self.lock.acquire()
+            self.done += 1
+            self.lock.release()
+            GLib.idle_add(self.report)
 
-        btn = Gtk.Button('Grab')
-        btn.set_sensitive(GeoGrabber().can_grab())
-        btn.connect('clicked', grab_clicked)
+        self.lock.acquire()
+        self.workers -= 1
+        last = self.workers == 0
+        self.lock.release()
+        if last:
+            GLib.idle_add(self.finish)
 
-        box.pack_start(btn, False, False, 0)
+    def exited(self, session, event):
+        '''Release the launch waiting on event and tell on_exit about it'''
 
-        self.add_input('Geometry', self.host.geometry, box)
+        event.set()
+        if self.on_exit:
+            self.on_exit(session)
 
-    def add_profile_input(self):
-        '''Add a 'profile' combobox input to the HostDialog'''
+    def report(self):
+        '''Tell on_progress about a finished launch, from the main loop'''
 
-        client = GConf.client_get_default()
-        list_key = '/apps/gnome-terminal/global/profile_list'
-        name_key = '/apps/gnome-terminal/profiles/%s/visible_name'
-        prof_names = [client.get_string(name_key % name) for name in
-                      client.get_list(list_key, 'string')]
+        if self.on_progress:
+            self.on_progress(self)
+        return False
 
-        self.profile_entry = Gtk.ComboBoxText.new_with_entry()
-        self.profile_entry.append_text("< None> ")
-        for name in prof_names:
-            self.profile_entry.append_text(name)
+    def finish(self):
+        '''Tell on_done that all workers are finished, from the main loop'''
 
-        index = 0
-        if self.host.profile != '' and self.host.profile != "< None> ":
-            index = prof_names.index(self.host.profile) + 1
+        if self.on_done:
+            self.on_done(self)
+        return False
 
-        self.profile_entry.set_active(index)
-        self.add_input('Profile', widget=self.profile_entry)
 
-    def add_other_inputs(self):
-        '''Add a 'bcvi' checkbox input to the HostDialog'''
+class ReachabilityProber():
+    '''
+    Checks whether hosts accept TCP connections, typically on their SSH port.
 
-        if self.config.have_bcvi():
-            self.enable_bcvi = Gtk.CheckButton("Enable 'bcvi' forwarding?", False)
-            self.enable_bcvi.set_active(self.host.enable_bcvi)
-            self.body.pack_start(self.enable_bcvi, False, True, 0)
+    Names are resolved by a small pool of threads, then up to max_in_flight
+    non-blocking connects are multiplexed with poll() in one thread. A host
+    is up if the connect completes within 'timeout' seconds. Results are
+    kept for 'ttl' seconds, as the connect time in seconds or None for a host
+    that is down, and are not probed again until they expire.
 
-    def add_input(self, text, content="", widget=None):
-        '''
-        Add a generic widget to the HostDialog
+    run() probes in the calling thread and returns the results; start() does
+    the same in the background and reports through callbacks, which are
+    called from the probing thread.
+    '''
 
+    def __init__(self, max_in_flight=512, timeout=1.0, ttl=60, resolvers=8):
+        '''
         Takes
-            text (str): Lable text for the widget
-            content (str): Starting text for Gtk.Entry widgets
-            widget (Gtk.Widget): The widget to add, it None add Gtk.Entry
+            max_in_flight (int): Maximum number of connects at a time
+            timeout (float): Seconds to wait for a connect
+            ttl (float): Seconds a result stays valid
+            resolvers (int): Number of threads resolving host names
         '''
 
-        label = Gtk.Label(text)
-        label.set_alignment(0,1)
-        self.body.pack_start(label, False, True, 0)
-
-        if not widget:
-            widget = Gtk.Entry()
-            widget.set_width_chars(36)
-            widget.set_text(content)
-            widget.set_activates_default(True)
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.ttl = ttl
+        self.resolvers = resolvers
+        self.cache = {}
+        self.lock = threading.Lock()
 
-        self.body.pack_start(widget, False, True, 0)
-        return widget
+    def cached(self, target):
+        '''
+        Return (True, result) for a target with a valid result in the cache,
+        otherwise (False, None)
 
+        Takes
+            target (tuple (str, int)): Host name and port
+        '''
 
-class SubmenuDialog():
-    '''
-    Implements the dialog for editing a MenuItem. Once the MenuDialog object has
-    been constructed, its invoke method is called to display the dialog.
-    When the user dismisses the dialog, the invoke method will return None on
-    cancel or the edited menu item on OK.
-    '''
+        self.lock.acquire()
+        entry = self.cache.get(target)
+        self.lock.release()
+        if entry and time.time() - entry[0] < self.ttl:
+            return True, entry[1]
+        return False, None
 
-    def __init__(self, menu_item):
+    def expiry(self, target):
         '''
+        Return the time the cached result of a target expires, or None if it
+        has none
+
         Takes
-            menu_item (MenuItem): The MenuItem associated with this Dialog
+            target (tuple (str, int)): Host name and port
         '''
 
-        self.menu_item = menu_item
+        self.lock.acquire()
+        entry = self.cache.get(target)
+        self.lock.release()
+        if entry is None:
+            return None
+        return entry[0] + self.ttl
 
-    def invoke(self):
-        '''Invoke the MenuDialog'''
+    def start(self, targets, on_result=None, on_done=None):
+        '''
+        Probe targets in a background thread
 
-        dialog = self.build_dialog()
-        response = dialog.run()
+        Takes
+            targets (iterable [(str, int)]): Host names and ports to probe
+            on_result (callable): Called with each target and its result
+            on_done (callable): Called with a dict of all results at the end
+        '''
 
-        while response == Gtk.ResponseType.ACCEPT:
-            if self.inputs_valid():
-                self.menu_item.display = self.title.get_text()
-                dialog.destroy()
-                return self.menu_item
-            else:
-                response = dialog.run()
+        def work():
+            results = self.run(targets, on_result)
+            if on_done:
+                on_done(results)
 
-        dialog.destroy()
+        thread = threading.Thread(target=work)
+        thread.daemon = True
+        thread.start()
 
-    def inputs_valid(self):
-        '''Check that the inputs for the MenuDialog are valid'''
+    def run(self, targets, on_result=None):
+        '''
+        Probe targets and return a dict from target to result
 
-        if len(self.title.get_text().strip()) == 0:
-            ErrorDialog("You Must enter a title")
-            return False
-        return True
+        Takes
+            targets (iterable [(str, int)]): Host names and ports to probe
+            on_result (callable): Called with each target and its result
+        '''
 
-    def build_dialog(self):
-        '''Build the dialog associated with MenuDialog'''
+        results = {}
 
-        dialog = Gtk.Dialog("Submenu Name",
-                            None,
-                            Gtk.DialogFlags.MODAL | Gtk.DialogFlags.DESTROY_WITH_PARENT,
-                            (Gtk.STOCK_OK, Gtk.ResponseType.ACCEPT,
-                             Gtk.STOCK_CANCEL, Gtk.ResponseType.REJECT))
+        def report(target, result):
+            results[target] = result
+            if on_result:
+                on_result(target, result)
 
-        dialog.set_default_response(Gtk.ResponseType.ACCEPT)
-        dialog.set_position(Gtk.WindowPosition.MOUSE)
+        pending = []
+        for target in set(targets):
+            fresh, result = self.cached(target)
+            if fresh:
+                report(target, result)
+            else:
+                pending.append(target)
 
-        body = Gtk.VBox(False, 0)
-        body.set_border_width(4)
-        dialog.vbox.add(body)
+        if pending:
+            def finish(target, result):
+                self.lock.acquire()
+                self.cache[target] = (time.time(), result)
+                self.lock.release()
+                report(target, result)
 
-        label = Gtk.Label('Title')
-        label.set_alignment(0, 1)
-        body.pack_start(label, False, True, 0)
+            self.connect_all(self.resolve_all(pending), len(pending), finish)
 
-        widget = Gtk.Entry()
-        widget.set_width_chars(36)
-        widget.set_text(self.menu_item.display)
-        widget.set_activates_default(True)
+        return results
 
-        self.title = widget
+    def resolve_all(self, targets):
+        '''
+        Resolve targets with a pool of threads. Returns a Queue receiving
+        (target, addrinfo) with addrinfo None if the name does not resolve.
+        '''
 
-        body.pack_start(widget, False, True, 0)
+        todo = Queue.Queue()
+        resolved = Queue.Queue()
+        for target in targets:
+            todo.put(target)
+
+        def work():
+            while True:
+                try:
+                    target = todo.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    info = socket.getaddrinfo(target[0], target[1], 0,
+                                              socket.SOCK_STREAM)[0]
+                except (socket.error, UnicodeError):
+                    info = None
+                resolved.put((target, info))
+
+        for i in range(min(self.resolvers, len(targets))):
+            thread = threading.Thread(target=work)
+            thread.daemon = True
+            thread.start()
+        return resolved
+
+    def connect_all(self, resolved, count, finish):
+        '''
+        Connect to count resolved targets from a Queue, at most max_in_flight
+        at a time, and call finish(target, result) for each
+        '''
 
-        dialog.show_all()
+        poller = select.poll()
+        in_flight = {}
+        limit = min(self.max_in_flight, self.descriptor_budget())
+        remaining = count
+
+        while remaining:
+            while len(in_flight) < limit and remaining > len(in_flight):
+                try:
+                    block = not in_flight
+                    target, info = resolved.get(block, 0.1)
+                except Queue.Empty:
+                    break
+
+                if info is None:
+                    remaining -= 1
+                    finish(target, None)
+                    continue
+
+                family, socktype, proto, canonname, address = info
+                sock = socket.socket(family, socktype, proto)
+                sock.setblocking(0)
+                error = sock.connect_ex(address)
+                if error in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    in_flight[sock.fileno()] = (sock, target, time.time())
+                    poller.register(sock, select.POLLOUT)
+                else:
+                    sock.close()
+                    remaining -= 1
+                    finish(target, None)
+
+            if not in_flight:
+                continue
+
+            now = time.time()
+            deadline = min(started for s, t, started in in_flight.values())
+            wait = max(0, deadline + self.timeout - now)
+            events = poller.poll(min(wait, 0.1) * 1000)
+
+            now = time.time()
+            done = [fd for fd, event in events]
+            done += [fd for fd, (s, t, started) in in_flight.items()
+                     if now - started >= self.timeout and fd not in done]
+            for fd in done:
+                sock, target, started = in_flight.pop(fd)
+                poller.unregister(fd)
+                result = None
+                if now - started < self.timeout:
+                    if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                        result = now - started
+                sock.close()
+                remaining -= 1
+                finish(target, result)
 
-        return dialog
+    @staticmethod
+    def descriptor_budget():
+        '''
+        Return how many sockets may be open at once. Raises the soft limit on
+        open files towards the hard limit if needed.
+        '''
+
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        wanted = 4096 if hard == resource.RLIM_INFINITY else min(hard, 4096)
+        if soft != resource.RLIM_INFINITY and soft < wanted:
+            try:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+                soft = wanted
+            except (ValueError, resource.error):
+                pass
+        if soft == resource.RLIM_INFINITY:
+            return 4096
+        return max(1, soft - 64)
 
 
 class GeoGrabber():
@@ -1263,8 +5509,9 @@ class GeoGrabber():
         '''Invoke the xwininfo program to grap a screen's gemoetry'''
 
         if GeoGrabber.can_grab():
-            proc = subprocess.Popen('xwininfo', stdout=subprocess.PIPE)
-            output = proc.stdout.read()
+            proc = subprocess.Popen('xwininfo', stdout=subprocess.PIPE,
+                                    close_fds=True)
+            output = proc.communicate()[0]
             geometry = re.search('-geometry\s+([\d+x-]+)', output)
             if geometry:
                 return geometry.group(1)
@@ -1272,6 +5519,118 @@ class GeoGrabber():
                 return ''
 
 
+class ProfileCatalogue():
+    '''
+    The names of the gnome-terminal profiles offered by the HostDialog. They
+    are read once, from GSettings or else from GConf, and kept until the
+    backend reports a change to them.
+    '''
+
+    GSETTINGS_LIST = 'org.gnome.Terminal.ProfilesList'
+    GSETTINGS_PROFILE = 'org.gnome.Terminal.Legacy.Profile'
+    GSETTINGS_PATH = '/org/gnome/terminal/legacy/profiles:/:%s/'
+    GCONF_DIR = '/apps/gnome-terminal'
+    GCONF_LIST = '/apps/gnome-terminal/global/profile_list'
+    GCONF_NAME = '/apps/gnome-terminal/profiles/%s/visible_name'
+
+    def __init__(self):
+        self.profiles = None
+        self.positions = {}
+        self.backend = None
+        self.settings = None
+        self.profile_settings = []
+        self.gconf = None
+
+    def names(self):
+        '''Return the profile names, reading them if they are not cached'''
+
+        if self.profiles is None:
+            self.load()
+        return self.profiles
+
+    def position(self, name):
+        '''
+        Return the position of a profile in names(), or None if there is no
+        such profile
+
+        Takes
+            name (str): Name of the profile
+        '''
+
+        self.names()
+        return self.positions.get(name)
+
+    def load(self):
+        '''Read the profile names from the first backend that has them'''
+
+        self.profiles = []
+        self.backend = None
+        for backend, read in (('gsettings', self.read_gsettings),
+                              ('gconf', self.read_gconf)):
+            try:
+                names = read()
+            except Exception:
+                names = None
+            if names is not None:
+                self.profiles = [name for name in names if name]
+                self.backend = backend
+                break
+
+        self.positions = {}
+        for position, name in enumerate(self.profiles):
+            self.positions.setdefault(name, position)
+
+    def read_gsettings(self):
+        '''
+        Return the profile names from GSettings, or None if the schemas of
+        gnome-terminal are not installed
+        '''
+
+        source = Gio.SettingsSchemaSource.get_default()
+        if (source is None or
+                source.lookup(ProfileCatalogue.GSETTINGS_LIST, True) is None or
+                source.lookup(ProfileCatalogue.GSETTINGS_PROFILE, True) is None):
+            return None
+
+        if self.settings is None:
+            self.settings = Gio.Settings.new(ProfileCatalogue.GSETTINGS_LIST)
+            self.settings.connect('changed::list', self.on_changed)
+
+        # The Settings objects are kept, they only notify while they exist
+        self.profile_settings = []
+        names = []
+        for uuid in self.settings.get_strv('list'):
+            settings = Gio.Settings.new_with_path(ProfileCatalogue.GSETTINGS_PROFILE,
+                                                  ProfileCatalogue.GSETTINGS_PATH % uuid)
+            settings.connect('changed::visible-name', self.on_changed)
+            self.profile_settings.append(settings)
+            names.append(settings.get_string('visible-name'))
+        return names
+
+    def read_gconf(self):
+        '''Return the profile names from GConf'''
+
+        from gi.repository import GConf
+        if self.gconf is None:
+            client = GConf.client_get_default()
+            # One round trip for the whole directory instead of one per key
+            client.add_dir(ProfileCatalogue.GCONF_DIR,
+                           GConf.ClientPreloadType.PRELOAD_RECURSIVE)
+            client.notify_add(ProfileCatalogue.GCONF_DIR, self.on_changed, None)
+            self.gconf = client
+
+        return [self.gconf.get_string(ProfileCatalogue.GCONF_NAME % name)
+                for name in self.gconf.get_list(ProfileCatalogue.GCONF_LIST, 'string')]
+
+    def on_changed(self, *args):
+        '''Fired when the backend reports a change, drops the cached names'''
+
+        self.profiles = None
+
+
+profiles = ProfileCatalogue()
+
+
 class Indicator():
     '''
     Fallback class for linux installations that do not have python-appindicator
@@ -1293,8 +5652,10 @@ class Indicator():
         self.name = name
         self.icon = icon
         self.status = Indicator.STATUS_INACTIVE
+        self.menu = None
         self.status_icon = Gtk.StatusIcon()
         self.status_icon.set_from_icon_name(self.icon)
+        self.status_icon.connect("activate", self.show_menu)
         self.set_label(self.name)
 
     def set_icon(self, icon_name):
@@ -1316,7 +5677,6 @@ class Indicator():
         '''
 
         self.menu = menu
-        self.status_icon.connect("activate", self.show_menu)
 
     def set_label(self, label):
         '''
@@ -1344,19 +5704,39 @@ class Indicator():
     def show_menu(self, sender):
         '''
         Method invoked when the user left-clicks the StatusIcon. Shows
-        The menu associated with this Indicator
+        The menu associated with this Indicator. Menu items are shown as they
+        are created, so popping up the menu does not walk the whole tree.
         '''
 
         if self.menu:
             now = Gtk.get_current_event_time()
-            self.menu.show_all()
 
             def pos(menu, icon):
                 return (Gtk.StatusIcon.position_menu(menu, icon))
 
             self.menu.popup(None, None, pos, self.status_icon, 0, now)
 
+mark_startup('define classes')
+
+
 if __name__ == '__main__':
+    if HEADLESS:
+        sys.exit(run_cli(sys.argv[1:]))
+    if hasattr(GLib, 'threads_init'):
+        GLib.threads_init()
+    if '--profile-startup' in sys.argv[1:]:
+        GLib.idle_add(report_startup)
+    if '--statistics' in sys.argv[1:]:
+        metrics.requested = metrics.enabled = True
+    # A second launch hands its request to the running indicator and exits
+    if '--quick-connect' in sys.argv[1:]:
+        handoff = {'command': 'quick_connect'}
+    else:
+        handoff = {'command': 'ping'}
+    if ControlClient().request(handoff) is not None:
+        sys.exit(0)
     app = App()
+    if '--quick-connect' in sys.argv[1:]:
+        app.quick_connect.invoke()
     Gtk.main()
 
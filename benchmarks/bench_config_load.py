@@ -0,0 +1,65 @@
+'''
+Benchmark for Config.load_config: compares the old pure-Python YAML load with
+a cold load through the libyaml loader and a warm load from the parse cache.
+
+Usage: python benchmarks/bench_config_load.py [hosts] [repeat]
+'''
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import yaml
+import SSHMenu
+import synthetic
+
+
+def best_of(repeat, func):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def main():
+    hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    workdir = tempfile.mkdtemp()
+    os.environ['XDG_CACHE_HOME'] = os.path.join(workdir, 'cache')
+    config_file = os.path.join(workdir, 'sshmenu')
+    synthetic.write_config(config_file, hosts)
+
+    try:
+        config = SSHMenu.Config(config_file)
+
+        def uncached_pure_python():
+            document = yaml.load(open(config_file).read(), Loader=yaml.SafeLoader)
+            config.parse_items(document['items'])
+
+        def cold():
+            shutil.rmtree(os.environ['XDG_CACHE_HOME'], True)
+            SSHMenu.Config(config_file)
+
+        def warm():
+            SSHMenu.Config(config_file)
+
+        print('hosts: %d  libyaml: %s' % (hosts, yaml.__with_libyaml__))
+        print('pure-Python loader : %8.1f ms' % best_of(repeat, uncached_pure_python))
+        print('cold (cache miss)  : %8.1f ms' % best_of(repeat, cold))
+        print('warm (cache hit)   : %8.1f ms' % best_of(repeat, warm))
+    finally:
+        shutil.rmtree(workdir, True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+'''
+Memory benchmark for the Item model: reports the bytes retained per host by
+the Item tree of a synthetic config at 10k and 100k hosts.
+
+The size is the sum of sys.getsizeof over every distinct object reachable
+from the items (items, their attribute values and child lists), so shared
+strings are only counted once. A dict-backed item with a per-host closure,
+as used before the model moved to __slots__, is measured for comparison.
+
+Usage: python benchmarks/bench_memory.py [hosts ...]
+'''
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import SSHMenu
+import synthetic
+
+
+class LegacyHostItem:
+    '''Dict-backed host item with its own action closure'''
+
+    def __init__(self, display, params):
+        self.kind = 'host'
+        self.display = display
+        self.show_in_tree = True
+        self.profile = params.get('profile', '')
+        self.geometry = params.get('geometry', '')
+        self.ssh_params = params['sshparams']
+        self.enable_bcvi = False
+
+        def ssh_command(sender, item):
+            return self.display
+        self.action = ssh_command
+
+
+def fresh_copy(value):
+    '''
+    Copy a document so that every string is a separate object, as it is
+    after a YAML load
+    '''
+
+    if isinstance(value, dict):
+        return dict((fresh_copy(k), fresh_copy(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [fresh_copy(v) for v in value]
+    if isinstance(value, str) and len(value) > 1:
+        return value[:1] + value[1:]
+    return value
+
+
+def deep_size(roots):
+    '''Return the total size of the objects reachable from roots'''
+
+    seen = set()
+    total = 0
+    stack = list(roots)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or obj is None or isinstance(obj, (bool, int)):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+
+        if isinstance(obj, list):
+            stack.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            total += sys.getsizeof(obj.__dict__)
+            stack.extend(obj.__dict__.values())
+            closure = getattr(obj, '__closure__', None)
+            if closure:
+                stack.extend(closure)
+        for cls in type(obj).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                value = getattr(obj, name, None)
+                if not callable(value):
+                    stack.append(value)
+    return total
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+
+    workdir = tempfile.mkdtemp()
+    os.environ['XDG_CACHE_HOME'] = os.path.join(workdir, 'cache')
+    try:
+        config = SSHMenu.Config(os.path.join(workdir, 'sshmenu'))
+        for hosts in sizes:
+            document = fresh_copy(synthetic.make_items(hosts))
+            items = config.parse_items(document)
+            size = deep_size(items)
+
+            legacy = []
+            stack = list(document)
+            while stack:
+                entry = stack.pop()
+                if entry['type'] == 'menu':
+                    stack.extend(entry['items'])
+                elif entry['type'] == 'host':
+                    legacy.append(LegacyHostItem(entry['title'], dict(entry)))
+            legacy_size = deep_size(legacy)
+
+            print('%7d hosts: %6.0f bytes/host (dict-backed with closure: %6.0f)' %
+                  (hosts, float(size) / hosts, float(legacy_size) / hosts))
+    finally:
+        shutil.rmtree(workdir, True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+'''
+Throughput benchmark for "Open all windows". A fake 'gnome-terminal' that
+just sleeps for a moment is put first on the PATH, then a submenu of hosts
+is opened the old way (one launch after another on the main loop) and with
+FanOut at several concurrency limits.
+
+For each run it reports the time until every fake terminal has exited and
+the longest the main loop went without running, i.e. how long the UI would
+have been frozen. Gtk is stubbed (see stubgtk.py) and the main loop is the
+stub's, which polls the children instead of waiting for SIGCHLD, so neither
+PyGObject nor a display is needed.
+
+Usage: python benchmarks/bench_open_all.py [hosts] [terminal delay (s)]
+'''
+
+from __future__ import print_function
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, HERE)
+
+import stubgtk
+stubgtk.install()
+
+from gi.repository import GLib
+import SSHMenu
+
+
+def make_fake_terminal(directory, delay):
+    '''Create a fake gnome-terminal in directory'''
+
+    path = os.path.join(directory, 'gnome-terminal')
+    fout = open(path, 'w')
+    fout.write('#!/bin/sh\nsleep %s\n' % delay)
+    fout.close()
+    os.chmod(path, stat.S_IRWXU)
+
+
+def run(start, hosts):
+    '''
+    Run the main loop while start(done) opens the windows and return the
+    time until done was called and all fake terminals exited, and the
+    longest main loop stall
+    '''
+
+    loop = GLib.MainLoop()
+    state = {'last': time.time(), 'stall': 0.0, 'done': False}
+
+    def heartbeat():
+        now = time.time()
+        state['stall'] = max(state['stall'], now - state['last'])
+        state['last'] = now
+        return True
+
+    def done(*args):
+        state['done'] = True
+
+    def check_done():
+        exited = [s for s in SSHMenu.supervisor.sessions() if not s.is_running()]
+        if (state['done'] and len(exited) >= hosts and
+                not SSHMenu.supervisor.running):
+            loop.quit()
+            return False
+        return True
+
+    SSHMenu.supervisor.finished = SSHMenu.deque(maxlen=hosts)
+    heartbeat_id = GLib.timeout_add(5, heartbeat)
+    check_id = GLib.timeout_add(10, check_done)
+
+    begin = time.time()
+    state['last'] = begin
+    GLib.idle_add(lambda: start(done) and False)
+    loop.run()
+    elapsed = time.time() - begin
+
+    GLib.source_remove(heartbeat_id)
+    return elapsed, state['stall']
+
+
+def main():
+    hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    delay = sys.argv[2] if len(sys.argv) > 2 else '0.05'
+
+    workdir = tempfile.mkdtemp()
+    make_fake_terminal(workdir, delay)
+    os.environ['PATH'] = workdir + os.pathsep + os.environ['PATH']
+
+    items = [SSHMenu.HostItem('host-%d' % n, {'sshparams': 'host-%d' % n})
+             for n in range(hosts)]
+    jobs = [(item.display, item.command()) for item in items]
+
+    try:
+        def sequential(done):
+            for title, argv in jobs:
+                SSHMenu.supervisor.spawn(argv, title)
+            done()
+
+        elapsed, stall = run(sequential, hosts)
+        print('%-22s %7.2f s  %6.1f launches/s  max UI stall %6.0f ms' %
+              ('sequential (old)', elapsed, hosts / elapsed, stall * 1000))
+
+        for concurrency in (1, 4, 16, 64):
+            def fan_out(done):
+                SSHMenu.FanOut(jobs, concurrency, 0, on_done=done).start()
+
+            elapsed, stall = run(fan_out, hosts)
+            print('%-22s %7.2f s  %6.1f launches/s  max UI stall %6.0f ms' %
+                  ('FanOut concurrency %d' % concurrency, elapsed,
+                   hosts / elapsed, stall * 1000))
+    finally:
+        shutil.rmtree(workdir, True)
+
+
+if __name__ == '__main__':
+    main()
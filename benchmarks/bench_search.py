@@ -0,0 +1,70 @@
+'''
+Benchmark for the quick connect search: builds a HostIndex over a synthetic
+config and times a sequence of queries as they would be typed.
+
+Usage: python benchmarks/bench_search.py [hosts] [repeat]
+'''
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import SSHMenu
+import synthetic
+
+QUERIES = ['h', 'ho', 'host', 'host-0', 'host-01234', 'group3 host-0309',
+           'group7/group2', 'admin@group1', 'hots-01234', '-p 24', 'nomatch']
+TYPED = 'group3 example 1234'
+
+
+def main():
+    hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    workdir = tempfile.mkdtemp()
+    os.environ['XDG_CACHE_HOME'] = os.path.join(workdir, 'cache')
+    try:
+        config = SSHMenu.Config(os.path.join(workdir, 'sshmenu'))
+        config.set_menu_items(config.parse_items(synthetic.make_items(hosts)))
+
+        start = time.time()
+        index = SSHMenu.HostIndex()
+        index.update(config)
+        print('hosts: %d  index build: %.1f ms' %
+              (len(index), (time.time() - start) * 1000))
+
+        start = time.time()
+        index.update(config)
+        print('no-op update: %.1f ms' % ((time.time() - start) * 1000))
+
+        for query in QUERIES:
+            best = None
+            for _ in range(repeat):
+                index.last_query = None
+                start = time.time()
+                results = index.search(query)
+                elapsed = time.time() - start
+                best = elapsed if best is None else min(best, elapsed)
+            top = results[0].display if results else '-'
+            print('%-20r %8.2f ms  %2d results  top: %s' %
+                  (query, best * 1000, len(results), top))
+
+        times = []
+        for length in range(1, len(TYPED) + 1):
+            start = time.time()
+            index.search(TYPED[:length])
+            times.append((time.time() - start) * 1000)
+        print('typing %r: mean %.2f ms, max %.2f ms per keystroke' %
+              (TYPED, sum(times) / len(times), max(times)))
+    finally:
+        shutil.rmtree(workdir, True)
+
+
+if __name__ == '__main__':
+    main()
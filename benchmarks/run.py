@@ -0,0 +1,235 @@
+'''
+Benchmark suite: times the main operations of pySSHMenu on synthetic
+~/.sshmenu files of growing size and writes the results as JSON, so runs on
+different commits can be compared.
+
+For every size it measures, in milliseconds (best of --repeat runs):
+
+    load_cold        Config.load_config with an empty parse cache
+    load_warm        Config.load_config from the parse cache
+    parse_items      Config.parse_items on the loaded document
+    menu_lazy        App.initialize_menu with submenus built on first use
+    menu_eager       App.initialize_menu with all submenus built up front
+    prefs_add_items  PreferencesDialog.add_items into an empty TreeStore
+    prefs_get_items  PreferencesDialog.get_menu_items back from the TreeStore
+    save             Config.save of the whole document
+    get_item         Config.get_item for 1000 titles through the index
+    get_item_scan    Config.get_item for 10 titles by scanning the items
+
+Gtk is stubbed by default (see stubgtk.py), so it runs headless without
+PyGObject. --gtk real uses the real Gtk instead, which needs a display or a
+virtual one, e.g. xvfb-run.
+
+Usage:
+    python benchmarks/run.py [--hosts 1000,10000,100000] [--depth 2]
+                             [--fanout 10] [--repeat 3] [--gtk stub|real]
+                             [--output results.json] [--compare old.json]
+'''
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+import synthetic
+
+METRICS = ['load_cold', 'load_warm', 'parse_items', 'menu_lazy', 'menu_eager',
+           'prefs_add_items', 'prefs_get_items', 'save', 'get_item',
+           'get_item_scan']
+
+# Slower by more than this fraction is flagged by --compare
+THRESHOLD = 0.10
+
+
+def best_of(repeat, func, setup=None):
+    '''Return the best time of func in milliseconds, calling setup before each run'''
+
+    best = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def record(results, metric, repeat, func, setup=None):
+    '''
+    Store the best time of func under metric. A failure, e.g. running out of
+    recursion depth on a large config, is stored as None and reported.
+    '''
+
+    try:
+        results[metric] = best_of(repeat, func, setup)
+    except Exception as e:
+        sys.stderr.write('%s failed: %r\n' % (metric, e))
+        results[metric] = None
+
+
+def commit():
+    '''Return the current git commit of the repository, or None'''
+
+    try:
+        devnull = open(os.devnull, 'w')
+        try:
+            output = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                             cwd=HERE, stderr=devnull)
+        finally:
+            devnull.close()
+        return output.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(SSHMenu, hosts, depth, fanout, repeat):
+    '''Run all measurements for one config size and return them as a dict'''
+
+    workdir = tempfile.mkdtemp()
+    cache = os.path.join(workdir, 'cache')
+    os.environ['HOME'] = workdir
+    os.environ['XDG_CACHE_HOME'] = cache
+    os.environ.pop('SSH_AUTH_SOCK', None)
+    config_file = os.path.join(workdir, '.sshmenu')
+    results = {}
+
+    try:
+        synthetic.write_config(config_file, hosts, depth, fanout)
+        config = SSHMenu.Config(config_file)
+
+        def clear_cache():
+            shutil.rmtree(cache, True)
+
+        record(results, 'load_cold', repeat, config.load_config, clear_cache)
+        record(results, 'load_warm', repeat, config.load_config)
+
+        document = config.to_yaml()['items']
+        record(results, 'parse_items', repeat,
+               lambda: config.parse_items(document))
+
+        app = SSHMenu.App()
+        config = app.config
+        for eager, metric in ((0, 'menu_lazy'), (1, 'menu_eager')):
+            config.set_global('menus_eager', eager)
+            record(results, metric, repeat, app.initialize_menu)
+
+        dialog = SSHMenu.PreferencesDialog(app, config)
+
+        def new_model():
+            dialog.model = SSHMenu.Gtk.TreeStore(object)
+
+        record(results, 'prefs_add_items', repeat,
+               lambda: dialog.add_items(None, config.menu_items), new_model)
+        record(results, 'prefs_get_items', repeat,
+               lambda: dialog.get_menu_items(dialog.model.get_iter_first(), []))
+
+        record(results, 'save', repeat, lambda: config.save(force=True))
+
+        rng = random.Random(hosts)
+        titles = [item.display for item in config.walk()]
+        lookups = [rng.choice(titles) for _ in range(1000)]
+        record(results, 'get_item', repeat,
+               lambda: [config.get_item(title) for title in lookups])
+        record(results, 'get_item_scan', repeat,
+               lambda: [config.get_item(title, config.menu_items)
+                        for title in lookups[:10]])
+    finally:
+        shutil.rmtree(workdir, True)
+
+    return results
+
+
+def format_time(value):
+    '''Format a time for the results table'''
+
+    return '%15s' % 'failed' if value is None else '%15.2f' % value
+
+
+def compare(old, new):
+    '''Print the change of every metric between two result documents'''
+
+    print()
+    print('compared with %s (%s)' % (old['meta'].get('commit'),
+                                     old['meta'].get('time')))
+    for key in ('python', 'gtk', 'depth', 'fanout'):
+        if old['meta'].get(key) != new['meta'].get(key):
+            print('note: %s differs: %s -> %s' % (key, old['meta'].get(key),
+                                                  new['meta'].get(key)))
+    for size in sorted(new['results'], key=int):
+        if size not in old['results']:
+            continue
+        for metric in METRICS:
+            before = old['results'][size].get(metric)
+            after = new['results'][size].get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            flag = '  SLOWER' if change > THRESHOLD else ''
+            print('%7s %-16s %10.2f -> %10.2f ms  %+6.1f%%%s' %
+                  (size, metric, before, after, change * 100, flag))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='pySSHMenu benchmark suite')
+    parser.add_argument('--hosts', default='1000,10000,100000',
+                        help='comma separated config sizes')
+    parser.add_argument('--depth', type=int, default=2,
+                        help='submenu levels above the hosts')
+    parser.add_argument('--fanout', type=int, default=10,
+                        help='submenus per level')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per measurement, the best one counts')
+    parser.add_argument('--gtk', choices=['stub', 'real'], default='stub')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results to compare with')
+    args = parser.parse_args()
+
+    if args.gtk == 'stub':
+        import stubgtk
+        stubgtk.install()
+    import SSHMenu
+
+    sizes = [int(size) for size in args.hosts.split(',')]
+    document = {'meta': {'commit': commit(),
+                         'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                         'python': platform.python_version(),
+                         'gtk': args.gtk,
+                         'depth': args.depth,
+                         'fanout': args.fanout,
+                         'repeat': args.repeat},
+                'results': {}}
+
+    print('%7s %s' % ('hosts', ' '.join('%15s' % metric for metric in METRICS)))
+    for hosts in sizes:
+        results = measure(SSHMenu, hosts, args.depth, args.fanout, args.repeat)
+        document['results'][str(hosts)] = results
+        print('%7d %s' % (hosts, ' '.join(format_time(results[metric])
+                                          for metric in METRICS)))
+        sys.stdout.flush()
+
+    if args.output:
+        fout = open(args.output, 'w')
+        json.dump(document, fout, indent=2, sort_keys=True)
+        fout.close()
+
+    if args.compare:
+        fin = open(args.compare)
+        old = json.load(fin)
+        fin.close()
+        compare(old, document)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,377 @@
+'''
+A stand-in for gi.repository, so the benchmarks can build menus and fill the
+preferences tree without a display or even PyGObject.
+
+Menus and the TreeStore keep just enough state for SSHMenu to work on them,
+and GLib has a small main loop for idle and timeout callbacks and child
+watches; every other Gtk, Gdk, Gio, GLib or GConf call is accepted and
+ignored. The
+numbers measure SSHMenu's own work, not Gtk's, so use --gtk real as well
+before drawing conclusions about a change that moves work into Gtk.
+
+install() must be called before SSHMenu is imported.
+'''
+
+import os
+import sys
+import threading
+import time
+import types
+
+
+class Anything(object):
+    '''Accepts any attribute access or call'''
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return Anything()
+
+    def __call__(self, *args, **kwargs):
+        return Anything()
+
+    def __iter__(self):
+        return iter([])
+
+    def __int__(self):
+        return 0
+
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return False
+
+    def __ge__(self, other):
+        return True
+
+    def __le__(self, other):
+        return True
+
+    def __bool__(self):
+        return True
+    __nonzero__ = __bool__
+
+
+class Widget(Anything):
+    '''A menu, menu item or any other widget'''
+
+    def __init__(self, label=None, *args, **kwargs):
+        self.label = label
+        self.parent = None
+        self.children = []
+        self.submenu = None
+        self.handlers = []
+
+    def get_label(self):
+        return self.label
+
+    def set_label(self, label):
+        self.label = label
+
+    def set_submenu(self, menu):
+        self.submenu = menu
+        menu.parent = self
+
+    def get_submenu(self):
+        return self.submenu
+
+    def connect(self, signal, callback, *data):
+        self.handlers.append((signal, callback, data))
+        return len(self.handlers)
+
+    def disconnect_by_func(self, callback):
+        self.handlers = [h for h in self.handlers if h[1] != callback]
+
+    def emit(self, signal):
+        for name, callback, data in list(self.handlers):
+            if name == signal:
+                callback(self, *data)
+
+    def insert(self, widget, position):
+        if position < 0:
+            self.children.append(widget)
+        else:
+            self.children.insert(position, widget)
+        widget.parent = self
+
+    def append(self, widget):
+        self.insert(widget, -1)
+
+    def reorder_child(self, widget, position):
+        self.children.remove(widget)
+        self.children.insert(position, widget)
+
+    def get_children(self):
+        return list(self.children)
+
+    def destroy(self):
+        if self.parent is not None and self in self.parent.children:
+            self.parent.children.remove(self)
+
+
+class TreeIter(object):
+    '''A row of the TreeStore'''
+
+    __slots__ = ('parent', 'row', 'children')
+
+    def __init__(self, parent, row):
+        self.parent = parent
+        self.row = row
+        self.children = []
+
+
+class TreeStore(object):
+    '''A TreeStore holding Python objects, with the calls SSHMenu makes'''
+
+    def __init__(self, *types):
+        self.root = TreeIter(None, None)
+
+    def node(self, treeiter):
+        return treeiter if treeiter is not None else self.root
+
+    def append(self, parent, row):
+        parent = self.node(parent)
+        child = TreeIter(parent, list(row))
+        parent.children.append(child)
+        return child
+
+    def insert(self, parent, position, row):
+        parent = self.node(parent)
+        child = TreeIter(parent, list(row))
+        if position < 0:
+            parent.children.append(child)
+        else:
+            parent.children.insert(position, child)
+        return child
+
+    def insert_after(self, parent, sibling, row):
+        if sibling is None:
+            return self.insert(parent, 0, row)
+        siblings = sibling.parent.children
+        return self.insert(sibling.parent, siblings.index(sibling) + 1, row)
+
+    def insert_before(self, parent, sibling, row):
+        if sibling is None:
+            return self.insert(parent, -1, row)
+        siblings = sibling.parent.children
+        return self.insert(sibling.parent, siblings.index(sibling), row)
+
+    def swap(self, a, b):
+        siblings = a.parent.children
+        i, j = siblings.index(a), siblings.index(b)
+        siblings[i], siblings[j] = b, a
+
+    def remove(self, treeiter):
+        treeiter.parent.children.remove(treeiter)
+        return False
+
+    def clear(self):
+        self.root = TreeIter(None, None)
+
+    def __getitem__(self, treeiter):
+        return treeiter.row
+
+    def __len__(self):
+        return len(self.root.children)
+
+    def get_value(self, treeiter, column):
+        return treeiter.row[column]
+
+    def set_value(self, treeiter, column, value):
+        treeiter.row[column] = value
+
+    def get_iter(self, path):
+        treeiter = self.root
+        for index in path:
+            treeiter = treeiter.children[index]
+        return treeiter
+
+    def get_iter_first(self):
+        return self.root.children[0] if self.root.children else None
+
+    def iter_next(self, treeiter):
+        siblings = treeiter.parent.children
+        position = siblings.index(treeiter) + 1
+        return siblings[position] if position < len(siblings) else None
+
+    def iter_previous(self, treeiter):
+        siblings = treeiter.parent.children
+        position = siblings.index(treeiter) - 1
+        return siblings[position] if position >= 0 else None
+
+    def iter_children(self, treeiter):
+        children = self.node(treeiter).children
+        return children[0] if children else None
+
+    def iter_nth_child(self, treeiter, n):
+        children = self.node(treeiter).children
+        return children[n] if 0 <= n < len(children) else None
+
+    def iter_n_children(self, treeiter):
+        return len(self.node(treeiter).children)
+
+    def iter_has_child(self, treeiter):
+        return len(treeiter.children) > 0
+
+    def iter_parent(self, treeiter):
+        parent = treeiter.parent
+        return parent if parent is not self.root else None
+
+    def get_path(self, treeiter):
+        path = []
+        while treeiter is not self.root:
+            path.append(treeiter.parent.children.index(treeiter))
+            treeiter = treeiter.parent
+        return tuple(reversed(path))
+
+    def move_before(self, treeiter, position):
+        siblings = treeiter.parent.children
+        siblings.remove(treeiter)
+        if position is None:
+            siblings.append(treeiter)
+        else:
+            siblings.insert(siblings.index(position), treeiter)
+
+    def move_after(self, treeiter, position):
+        siblings = treeiter.parent.children
+        siblings.remove(treeiter)
+        if position is None:
+            siblings.insert(0, treeiter)
+        else:
+            siblings.insert(siblings.index(position) + 1, treeiter)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return Anything()
+
+
+class MainContext(object):
+    '''
+    The sources of the stub main loop. Callbacks may be added from any
+    thread; they are run by MainLoop.run, in the thread that called it.
+    '''
+
+    def __init__(self):
+        self.sources = {}
+        self.last_id = 0
+        self.lock = threading.Lock()
+
+    def add(self, source):
+        self.lock.acquire()
+        self.last_id += 1
+        self.sources[self.last_id] = source
+        self.lock.release()
+        return self.last_id
+
+    def idle_add(self, callback, *data):
+        return self.add(['idle', 0, None, callback, data])
+
+    def timeout_add(self, interval, callback, *data):
+        interval = interval / 1000.0
+        return self.add(['timeout', time.time() + interval, interval,
+                         callback, data])
+
+    def child_watch_add(self, priority, pid, callback, data=None):
+        return self.add(['child', pid, None, callback, data])
+
+    def source_remove(self, source_id):
+        self.lock.acquire()
+        found = self.sources.pop(source_id, None) is not None
+        self.lock.release()
+        return found
+
+    def iteration(self):
+        '''Dispatch every source that is ready and return how many were'''
+
+        self.lock.acquire()
+        sources = sorted(self.sources.items())
+        self.lock.release()
+
+        dispatched = 0
+        for source_id, source in sources:
+            kind, due, interval, callback, data = source
+            if kind == 'child':
+                pid, status = os.waitpid(due, os.WNOHANG)
+                if pid == 0:
+                    continue
+                self.source_remove(source_id)
+                callback(pid, status, data)
+            elif kind == 'timeout' and due > time.time():
+                continue
+            elif callback(*data):
+                if interval is not None:
+                    source[1] = time.time() + interval
+            else:
+                self.source_remove(source_id)
+            dispatched += 1
+        return dispatched
+
+
+context = MainContext()
+
+
+class MainLoop(object):
+    '''Runs the stub main context until quit is called'''
+
+    def __init__(self, *args):
+        self.running = False
+
+    def run(self):
+        self.running = True
+        while self.running:
+            if not context.iteration():
+                time.sleep(0.001)
+
+    def quit(self):
+        self.running = False
+
+    def is_running(self):
+        return self.running
+
+
+class Module(types.ModuleType):
+    '''A gi.repository module whose unknown attributes are Anything'''
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return Anything()
+
+
+def install():
+    '''Put the stub gi modules into sys.modules'''
+
+    gi = types.ModuleType('gi')
+    gi.require_version = lambda namespace, version: None
+    repository = types.ModuleType('gi.repository')
+    gi.repository = repository
+
+    Gtk = Module('gi.repository.Gtk')
+    for name in ('Menu', 'MenuItem', 'SeparatorMenuItem', 'StatusIcon',
+                 'Window', 'Dialog', 'TreeView'):
+        setattr(Gtk, name, Widget)
+    Gtk.TreeStore = TreeStore
+    Gtk.ListStore = TreeStore
+
+    GLib = Module('gi.repository.GLib')
+    GLib.MainLoop = MainLoop
+    GLib.idle_add = context.idle_add
+    GLib.timeout_add = context.timeout_add
+    GLib.source_remove = context.source_remove
+    GLib.child_watch_add = context.child_watch_add
+    GLib.glib_version = (2, 40, 0)
+
+    repository.Gtk = Gtk
+    repository.GLib = GLib
+    for name in ('Gdk', 'Gio', 'GConf'):
+        setattr(repository, name, Module('gi.repository.' + name))
+
+    sys.modules['gi'] = gi
+    sys.modules['gi.repository'] = repository
+    for name in ('Gtk', 'GLib', 'Gdk', 'Gio', 'GConf'):
+        sys.modules['gi.repository.' + name] = getattr(repository, name)
@@ -0,0 +1,75 @@
+'''
+Generator for synthetic SSHMenu configuration files, used by the benchmarks
+to measure how pySSHMenu scales with the size of ~/.sshmenu.
+
+Hosts are spread evenly over a tree of submenus that is 'depth' levels deep
+with 'fanout' submenus per level.
+'''
+
+import yaml
+
+
+def make_items(hosts, depth=2, fanout=10):
+    '''
+    Return the 'items' list of a config with the given number of hosts
+
+    Takes
+        hosts (int): Total number of hosts
+        depth (int): Number of submenu levels above the hosts
+        fanout (int): Number of submenus per level
+    '''
+
+    leaves = fanout ** depth
+    per_leaf = max(1, -(-hosts // leaves))
+    counter = [0]
+
+    def host(path):
+        n = counter[0]
+        counter[0] += 1
+        return {'type': 'host',
+                'title': 'host-%06d' % n,
+                'sshparams': '-p %d admin@%s-%06d.example.com' %
+                             (22 + n % 3, '-'.join(path) or 'top', n),
+                'profile': 'Default' if n % 2 else '',
+                'geometry': '80x25+0+0' if n % 5 == 0 else ''}
+
+    def level(path, remaining_depth):
+        if remaining_depth == 0:
+            items = []
+            for _ in range(per_leaf):
+                if counter[0] >= hosts:
+                    break
+                items.append(host(path))
+            return items
+
+        items = []
+        for i in range(fanout):
+            if counter[0] >= hosts:
+                break
+            name = 'group%d' % i
+            items.append({'type': 'menu',
+                          'title': name,
+                          'items': level(path + [name], remaining_depth - 1)})
+            if i % 4 == 3:
+                items.append({'type': 'separator'})
+        return items
+
+    return level([], depth)
+
+
+def make_config(hosts, depth=2, fanout=10):
+    '''Return a complete config document with the given number of hosts'''
+
+    return {'classes': {},
+            'global': {'back_up_config': 0,
+                       'menus_open_all': 1,
+                       'menus_open_tabs': 1},
+            'items': make_items(hosts, depth, fanout)}
+
+
+def write_config(path, hosts, depth=2, fanout=10):
+    '''Write a synthetic config file to path'''
+
+    fout = open(path, 'w')
+    yaml.dump(make_config(hosts, depth, fanout), fout, default_flow_style=False)
+    fout.close()
@@ -0,0 +1,97 @@
+'''
+Tests of the ranking of HostIndex.search, in particular that hosts which
+match equally well keep their menu order as the menu changes. Gtk is stubbed
+(see benchmarks/stubgtk.py), so they run headless:
+
+    python -m pytest tests
+'''
+
+import os
+import sys
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, os.path.join(HERE, '..', 'benchmarks'))
+
+import stubgtk
+stubgtk.install()
+
+import SSHMenu
+
+
+def host(title):
+    return SSHMenu.HostItem(title, {'sshparams': title + '.example.com'})
+
+
+def titles(items):
+    return [item.display for item in items]
+
+
+class Menu(object):
+    '''The part of Config that HostIndex.update uses, for a flat menu'''
+
+    def __init__(self):
+        self.items = []
+
+    def walk(self):
+        return iter(self.items)
+
+    def get_path(self, item):
+        return item.display
+
+
+class HostIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Menu()
+
+    def index(self, items):
+        self.config.items = items
+        index = SSHMenu.HostIndex()
+        index.update(self.config)
+        return index
+
+    def update(self, index, items):
+        self.config.items = items
+        index.update(self.config)
+
+    def test_prefix_matches_first(self):
+        index = self.index([host('web2'), host('db-web'), host('web1')])
+        self.assertEqual(titles(index.search('web')), ['web1', 'web2', 'db-web'])
+
+    def test_ties_keep_menu_order(self):
+        index = self.index([host('gamma'), host('alpha'), host('beta')])
+        self.assertEqual(titles(index.search('example')), ['gamma', 'alpha', 'beta'])
+
+    def test_host_added_in_the_middle_keeps_menu_order(self):
+        hosts = [host('gamma'), host('alpha'), host('beta')]
+        index = self.index(hosts)
+        self.update(index, [hosts[0], host('delta'), hosts[1], hosts[2]])
+        self.assertEqual(titles(index.search('example')),
+                         ['gamma', 'delta', 'alpha', 'beta'])
+
+    def test_moved_host_keeps_menu_order(self):
+        hosts = [host('gamma'), host('alpha'), host('beta')]
+        index = self.index(hosts)
+        self.update(index, [hosts[2], hosts[0], hosts[1]])
+        self.assertEqual(titles(index.search('example')), ['beta', 'gamma', 'alpha'])
+
+    def test_compaction_keeps_menu_order(self):
+        hosts = [host('h%02d' % i) for i in range(20)]
+        index = self.index(hosts)
+        # Removing most hosts makes the index compact itself
+        kept = hosts[::-1][:5]
+        self.update(index, kept)
+        self.assertEqual(len(index), 5)
+        self.assertEqual(len(index.items), 5)
+        self.assertEqual(titles(index.search('example')), titles(kept))
+
+    def test_typo_matches_keep_menu_order(self):
+        index = self.index([host('webserver-b'), host('webserver-a')])
+        self.assertEqual(titles(index.search('webservr')),
+                         ['webserver-b', 'webserver-a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+'''
+Tests of HostItem.target and ReachabilityProber against sockets on the
+loopback interface. Gtk is stubbed (see benchmarks/stubgtk.py), so they run
+headless:
+
+    python -m pytest tests
+'''
+
+import os
+import socket
+import sys
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, os.path.join(HERE, '..', 'benchmarks'))
+
+import stubgtk
+stubgtk.install()
+
+import SSHMenu
+
+
+def host(ssh_params):
+    return SSHMenu.HostItem('test', {'sshparams': ssh_params})
+
+
+class TargetTest(unittest.TestCase):
+
+    def test_default_port(self):
+        self.assertEqual(host('example.com').target(), ('example.com', 22))
+
+    def test_port_before_host(self):
+        self.assertEqual(host('-p 2222 user@example.com').target(),
+                         ('example.com', 2222))
+
+    def test_port_after_host(self):
+        self.assertEqual(host('example.com -p 2222').target(),
+                         ('example.com', 2222))
+        self.assertEqual(host('example.com -oPort=2200 -A').target(),
+                         ('example.com', 2200))
+
+    def test_remote_command_is_not_parsed(self):
+        self.assertEqual(host('example.com uptime -p 2222').target(),
+                         ('example.com', 22))
+
+    def test_url(self):
+        self.assertEqual(host('ssh://user@[::1]:2022').target(), ('::1', 2022))
+
+    def test_no_host(self):
+        self.assertEqual(host('-A -p 2222').target(), None)
+        self.assertEqual(host('example.com -p nonsense').target(), None)
+
+
+class ProberTest(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(16)
+        self.open = self.listener.getsockname()
+
+        # A port that was just free and has nothing listening on it
+        closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        closed.bind(('127.0.0.1', 0))
+        self.closed = closed.getsockname()
+        closed.close()
+
+    def tearDown(self):
+        self.listener.close()
+
+    def test_listening_and_closed_ports(self):
+        prober = SSHMenu.ReachabilityProber(timeout=2.0)
+        results = prober.run([self.open, self.closed])
+
+        self.assertEqual(set(results), set([self.open, self.closed]))
+        self.assertTrue(results[self.open] is not None)
+        self.assertTrue(0 <= results[self.open] < 2.0)
+        self.assertEqual(results[self.closed], None)
+
+    def test_unresolvable_host(self):
+        prober = SSHMenu.ReachabilityProber()
+        target = ('no-such-host.invalid', 22)
+        self.assertEqual(prober.run([target]), {target: None})
+
+    def test_results_are_cached_until_they_expire(self):
+        prober = SSHMenu.ReachabilityProber(ttl=60)
+        prober.run([self.open])
+        fresh, latency = prober.cached(self.open)
+        self.assertTrue(fresh)
+        self.assertTrue(latency is not None)
+        self.assertEqual(prober.cached(self.closed), (False, None))
+        self.assertEqual(prober.expiry(self.closed), None)
+
+        prober.ttl = 0
+        self.assertEqual(prober.cached(self.open), (False, None))
+        self.assertTrue(prober.expiry(self.open) is not None)
+
+    def test_many_targets_with_few_in_flight(self):
+        prober = SSHMenu.ReachabilityProber(max_in_flight=4, timeout=2.0)
+        targets = [self.open, self.closed]
+        for i in range(20):
+            # Other loopback addresses, where nothing listens on that port
+            targets.append(('127.0.0.%d' % (i + 2), self.open[1]))
+        results = prober.run(targets)
+
+        self.assertEqual(len(results), len(targets))
+        self.assertTrue(results[self.open] is not None)
+        self.assertEqual(results[self.closed], None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+'''
+Tests of SSHAgent against the fake agent in tools/fake_ssh_agent.py, which
+serves the agent protocol on a UNIX socket in a temporary directory. Gtk is
+stubbed (see benchmarks/stubgtk.py), so they run headless:
+
+    python -m pytest tests
+'''
+
+import os
+import struct
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, os.path.join(HERE, '..', 'benchmarks'))
+sys.path.insert(0, os.path.join(HERE, '..', 'tools'))
+
+import stubgtk
+stubgtk.install()
+
+import SSHMenu
+import fake_ssh_agent
+from fake_ssh_agent import FakeAgent
+
+
+class RefusingAgent(FakeAgent):
+    '''Answers every request with FAILURE'''
+
+    def answer(self, kind, payload):
+        self.requests.append(kind)
+        return struct.pack('>B', fake_ssh_agent.FAILURE)
+
+
+class TruncatingAgent(FakeAgent):
+    '''Lists more identities than it sends'''
+
+    def answer(self, kind, payload):
+        self.requests.append(kind)
+        return (struct.pack('>BI', fake_ssh_agent.IDENTITIES_ANSWER, 2) +
+                fake_ssh_agent.pack_string(b'blob') +
+                struct.pack('>I', 100) + b'comment')
+
+
+class SSHAgentTest(unittest.TestCase):
+
+    def start(self, agent_class=FakeAgent, keys=2):
+        agent = agent_class(keys=keys).start()
+        self.addCleanup(agent.stop)
+        return agent, SSHMenu.SSHAgent(agent.path)
+
+    def test_identities(self):
+        agent, client = self.start()
+        self.assertEqual(client.identities(),
+                         [(b'fake-key-blob-0', u'fake key 0'),
+                          (b'fake-key-blob-1', u'fake key 1')])
+
+    def test_no_identities(self):
+        agent, client = self.start(keys=0)
+        self.assertEqual(client.identities(), [])
+
+    def test_identities_are_cached_for_ttl(self):
+        agent, client = self.start()
+        client.identities()
+        agent.keys = agent.keys[:1]
+        self.assertEqual(len(client.identities()), 2)
+        self.assertEqual(len(agent.requests), 1)
+
+        self.assertEqual(len(client.identities(refresh=True)), 1)
+        self.assertEqual(len(agent.requests), 2)
+
+        agent.keys = []
+        client.checked -= SSHMenu.SSHAgent.TTL
+        self.assertEqual(client.identities(), [])
+        self.assertEqual(len(agent.requests), 3)
+
+    def test_remove_all(self):
+        agent, client = self.start()
+        client.identities()
+        client.remove_all()
+        self.assertEqual(agent.keys, [])
+        # The cache is dropped, the next call asks the agent
+        self.assertEqual(client.identities(), [])
+        self.assertEqual(agent.requests[-2:], [fake_ssh_agent.REMOVE_ALL_IDENTITIES,
+                                               fake_ssh_agent.REQUEST_IDENTITIES])
+
+    def test_remove(self):
+        agent, client = self.start()
+        client.remove(b'fake-key-blob-0')
+        self.assertEqual(client.identities(), [(b'fake-key-blob-1', u'fake key 1')])
+
+    def test_remove_unknown_key_fails(self):
+        agent, client = self.start()
+        self.assertRaises(SSHMenu.AgentError, client.remove, b'no-such-blob')
+        self.assertEqual(len(agent.keys), 2)
+
+    def test_auth_sock_not_set(self):
+        saved = os.environ.pop('SSH_AUTH_SOCK', None)
+        try:
+            self.assertRaises(SSHMenu.AgentError, SSHMenu.SSHAgent().identities)
+        finally:
+            if saved is not None:
+                os.environ['SSH_AUTH_SOCK'] = saved
+
+    def test_missing_socket(self):
+        path = os.path.join(tempfile.mkdtemp(), 'agent.sock')
+        client = SSHMenu.SSHAgent(path)
+        self.assertRaises(SSHMenu.AgentError, client.identities)
+        self.assertRaises(SSHMenu.AgentError, client.remove_all)
+
+    def test_failure_reply(self):
+        agent, client = self.start(RefusingAgent)
+        self.assertRaises(SSHMenu.AgentError, client.identities)
+        self.assertRaises(SSHMenu.AgentError, client.remove_all)
+
+    def test_truncated_reply(self):
+        agent, client = self.start(TruncatingAgent)
+        self.assertRaises(SSHMenu.AgentError, client.identities)
+        self.assertEqual(client.keys, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+'''
+A stand-in for ssh-agent that speaks enough of the agent protocol to try
+SSHAgent and the key entries of the menu without touching real keys. It holds
+made up identities in memory and answers list and remove requests; anything
+else gets a failure reply.
+
+Usage: python tools/fake_ssh_agent.py [socket] [keys]
+
+Prints the SSH_AUTH_SOCK line to evaluate in the shell, like ssh-agent, and
+serves until interrupted. FakeAgent can also be started from Python.
+'''
+
+from __future__ import print_function
+
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+
+REQUEST_IDENTITIES = 11
+IDENTITIES_ANSWER = 12
+REMOVE_IDENTITY = 18
+REMOVE_ALL_IDENTITIES = 19
+FAILURE = 5
+SUCCESS = 6
+
+
+def pack_string(data):
+    return struct.pack('>I', len(data)) + data
+
+
+class FakeAgent(object):
+    '''Serves the agent protocol on a UNIX socket from a background thread'''
+
+    def __init__(self, path=None, keys=2):
+        if path is None:
+            path = os.path.join(tempfile.mkdtemp(), 'agent.sock')
+        self.path = path
+        self.keys = [(b'fake-key-blob-%d' % i, 'fake key %d' % i)
+                     for i in range(keys)]
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    def start(self):
+        self.server.bind(self.path)
+        self.server.listen(16)
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def serve(self):
+        while True:
+            try:
+                conn, address = self.server.accept()
+            except socket.error:
+                return
+            thread = threading.Thread(target=self.handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def handle(self, conn):
+        try:
+            while True:
+                header = self.receive(conn, 4)
+                if header is None:
+                    return
+                message = self.receive(conn, struct.unpack('>I', header)[0])
+                if not message:
+                    return
+                reply = self.answer(ord(message[0:1]), message[1:])
+                conn.sendall(struct.pack('>I', len(reply)) + reply)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def receive(conn, size):
+        data = b''
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def answer(self, kind, payload):
+        self.lock.acquire()
+        try:
+            self.requests.append(kind)
+            if kind == REQUEST_IDENTITIES:
+                body = struct.pack('>I', len(self.keys))
+                for blob, comment in self.keys:
+                    body += pack_string(blob) + pack_string(comment.encode('utf-8'))
+                return struct.pack('>B', IDENTITIES_ANSWER) + body
+
+            if kind == REMOVE_ALL_IDENTITIES:
+                self.keys = []
+                return struct.pack('>B', SUCCESS)
+
+            if kind == REMOVE_IDENTITY and len(payload) >= 4:
+                length = struct.unpack_from('>I', payload)[0]
+                blob = payload[4:4 + length]
+                for key in self.keys:
+                    if key[0] == blob:
+                        self.keys.remove(key)
+                        return struct.pack('>B', SUCCESS)
+
+            return struct.pack('>B', FAILURE)
+        finally:
+            self.lock.release()
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else None
+    keys = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+
+    agent = FakeAgent(path, keys).start()
+    print('SSH_AUTH_SOCK=%s; export SSH_AUTH_SOCK;' % agent.path)
+    sys.stdout.flush()
+    try:
+        threading.Event().wait(1e9)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        agent.stop()
+
+
+if __name__ == '__main__':
+    main()